@@ -0,0 +1,178 @@
+"""
+admin 分析：混淆矩陣、信心 / 模糊度直方圖、建議分佈
+
+聚合在 SQL 端（sample_analytics()，依 created_at 分桶）完成，這裡只合併各桶。
+每個時間桶的部分聚合各自快取：已結束的桶在 closed_ttl_s 內不重算（標註仍會
+陸續補上，所以不是永久），進行中的桶只快取 open_ttl_s；查詢一段區間時只對
+缺少的桶發 RPC。每桶約 90 列，PostgREST 的 max-rows 會靜默截斷較長的結果，
+因此依固定排序以 range() 分頁，直到回傳不滿一頁為止。
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+BUCKETS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+BINS = 20
+BLUR_LOG_MAX = 8.0  # 與 sample_analytics() 的 ln(1+blur) 上限相同
+PAGE_SIZE = 1000  # 不可超過 PostgREST 的 max-rows（預設 1000）
+
+
+def floor_bucket(ts: datetime, bucket: str) -> datetime:
+    ts = ts.astimezone(timezone.utc)
+    if bucket == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _parse_ts(v: str) -> datetime:
+    return datetime.fromisoformat(v.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+
+class SampleAnalytics:
+    def __init__(
+        self,
+        sb,
+        open_ttl_s: float = 60,
+        closed_ttl_s: float = 900,
+        max_buckets: int = 2000,
+        page_size: int = PAGE_SIZE,
+    ):
+        self.sb = sb
+        self.page_size = page_size
+        self.open_ttl_s, self.closed_ttl_s = open_ttl_s, closed_ttl_s
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # (bucket, start) -> (rows, fetched_at)
+        self.stats = dict.fromkeys(("bucket_hits", "bucket_misses", "rpc_calls"), 0)
+
+    def _fresh(self, key, now: datetime):
+        hit = self._buckets.get(key)
+        if hit is None:
+            return None
+        rows, at = hit
+        closed = key[1] + BUCKETS[key[0]] <= now
+        ttl = self.closed_ttl_s if closed else self.open_ttl_s
+        if time.monotonic() - at >= ttl:
+            return None
+        self._buckets.move_to_end(key)
+        return rows
+
+    def _fetch(self, bucket: str, start: datetime, end: datetime) -> dict:
+        params = {
+            "p_from": start.isoformat(),
+            "p_to": end.isoformat(),
+            "p_bucket": bucket,
+            "p_bins": BINS,
+        }
+        rows, offset = [], 0
+        while True:
+            page = (
+                self.sb.rpc("sample_analytics", params)
+                .order("bucket")
+                .order("kind")
+                .order("a")
+                .order("b")
+                .range(offset, offset + self.page_size - 1)
+                .execute()
+                .data
+            ) or []
+            with self._lock:
+                self.stats["rpc_calls"] += 1
+            rows.extend(page)
+            if len(page) < self.page_size:
+                break
+            offset += self.page_size
+        by_bucket = {}
+        for r in rows:
+            by_bucket.setdefault(
+                floor_bucket(_parse_ts(r["bucket"]), bucket), []
+            ).append(r)
+        return by_bucket
+
+    def bucket_rows(self, bucket: str, since: datetime, until: datetime):
+        step = BUCKETS[bucket]
+        now = datetime.now(timezone.utc)
+        starts = []
+        t = floor_bucket(since, bucket)
+        while t < until:
+            starts.append(t)
+            t += step
+        with self._lock:
+            cached = {s: self._fresh((bucket, s), now) for s in starts}
+        missing = [s for s, rows in cached.items() if rows is None]
+        with self._lock:
+            self.stats["bucket_hits"] += len(starts) - len(missing)
+            self.stats["bucket_misses"] += len(missing)
+        if missing:
+            # 缺少的桶通常是連續的（最近幾個），一次分頁查詢取回
+            fetched = self._fetch(bucket, missing[0], missing[-1] + step)
+            with self._lock:
+                for s in missing:
+                    cached[s] = fetched.get(s, [])
+                    self._buckets[(bucket, s)] = (cached[s], time.monotonic())
+                    self._buckets.move_to_end((bucket, s))
+                while len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+        return cached
+
+    def report(self, since: datetime, until: datetime, bucket: str = "day") -> dict:
+        """
+        以桶為單位彙總（since 向下取整到桶邊界）。回傳混淆矩陣（列為標註、欄為預測）、
+        直方圖（edges 長度 = counts + 1）與每桶的建議分佈。
+        """
+        cm = {"stage1": {}, "stage2": {}}
+        hist = {k: [0] * BINS for k in ("stage1_conf", "stage2_conf", "blur")}
+        mix = []
+        kinds = {"cm1": "stage1", "cm2": "stage2"}
+        hists = {"conf1": "stage1_conf", "conf2": "stage2_conf", "blur": "blur"}
+        for start, rows in sorted(self.bucket_rows(bucket, since, until).items()):
+            sugg = {}
+            for r in rows:
+                k, n = r["kind"], int(r["n"])
+                if k in kinds:
+                    cell = (r["b"] or "unknown", r["a"] or "unknown")
+                    cm[kinds[k]][cell] = cm[kinds[k]].get(cell, 0) + n
+                elif k in hists:
+                    i = min(max(int(r["a"]), 1), BINS) - 1
+                    hist[hists[k]][i] += n
+                elif k == "sugg":
+                    sugg[r["a"]] = sugg.get(r["a"], 0) + n
+            mix.append({"bucket": start.isoformat(), **sugg})
+        conf_edges = [round(i / BINS, 4) for i in range(BINS + 1)]
+        blur_edges = [
+            round(math.expm1(BLUR_LOG_MAX * i / BINS), 2) for i in range(BINS + 1)
+        ]
+        return {
+            "since": floor_bucket(since, bucket).isoformat(),
+            "until": until.isoformat(),
+            "bucket": bucket,
+            "confusion": {stage: _matrix(cells) for stage, cells in cm.items()},
+            "histograms": {
+                k: {"edges": blur_edges if k == "blur" else conf_edges, "counts": v}
+                for k, v in hist.items()
+            },
+            "suggestions": mix,
+        }
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {**self.stats, "cached_buckets": len(self._buckets)}
+
+
+def _matrix(cells: dict) -> dict:
+    labels = sorted({c for cell in cells for c in cell})
+    idx = {c: i for i, c in enumerate(labels)}
+    m = [[0] * len(labels) for _ in labels]
+    for (truth, pred), n in cells.items():
+        m[idx[truth]][idx[pred]] += n
+    total = sum(cells.values())
+    correct = sum(m[i][i] for i in range(len(labels)))
+    return {
+        "labels": labels,
+        "matrix": m,
+        "n": total,
+        "acc": round(correct / total, 4) if total else None,
+    }
@@ -1,32 +1,131 @@
+import asyncio
 import base64
+import hashlib
+import hmac
 import io
 import json
+import math
 import os
+import threading
 import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from typing import List, Tuple
 
 import cv2
 import imagehash
 import numpy as np
 import qrcode
-from fastapi import FastAPI, Form, Header, HTTPException, UploadFile
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.staticfiles import StaticFiles
 from PIL import Image
 from pydantic import BaseModel, Field, ValidationError
 from supabase import Client, create_client
 from transformers import AutoModelForCausalLM, AutoProcessor, AutoTokenizer
 from ultralytics import YOLO
 
+from inference.analytics import BUCKETS, SampleAnalytics
+from inference.drift import DriftMonitor
+from inference.gate import APPROVAL_GATE, STAGES, gate_failures, run_stage
+from inference.image_store import (
+    ImageStore,
+    ImageStoreFull,
+    LocalBackend,
+    backend_from_env,
+)
+from inference.listing_cache import ListingCache, listing_key
+from inference.pagination import decode_cursor, encode_cursor
+from inference.price_index import PriceIndex
+from inference.read_cache import ReadCache
+from inference.scans import STATUSES, ScanBuffer, parse_qr, sign_payload, verify_qr
+from inference.scheduler import (
+    CLASSES,
+    ROLE_CLASS,
+    DeadlineExceeded,
+    Scheduler,
+    Ticket,
+)
+from inference.shadow import ShadowEvaluator, load_candidates
+from inference.views import NON_DEFECT, aggregate_views
+
 # --- env ---
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
+# 私有 bucket（ARTIFACT_BUCKET）的讀取需 service role；未設定時沿用 anon key
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+ARTIFACT_BUCKET = os.getenv("ARTIFACT_BUCKET", "models")
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "./inference/cache/artifacts")
 STAGE1 = os.getenv("STAGE1_MODEL_PATH", "./inference/models/stage1_sneaker_cls.pt")
 STAGE2 = os.getenv("STAGE2_MODEL_PATH", "./inference/models/stage2_defects_cls.pt")
 VLM_ID = os.getenv("VLM_ID", "Qwen/Qwen2-VL-2B-Instruct")
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "please-change-me")
+QR_SECRET = os.getenv("QR_SECRET", ADMIN_TOKEN)
+SCAN_TOKEN = os.getenv("SCAN_TOKEN", ADMIN_TOKEN)
+SCAN_MAX_BATCH = int(os.getenv("SCAN_MAX_BATCH", "5000"))
+SCAN_ACK_TIMEOUT_S = float(os.getenv("SCAN_ACK_TIMEOUT_S", "10"))
+CANDIDATE_UNCERTAINTY = float(os.getenv("CANDIDATE_UNCERTAINTY", "0.5"))
+LISTING_CACHE_PATH = os.getenv(
+    "LISTING_CACHE_PATH", "./inference/cache/listing_text.json"
+)
+LISTING_CACHE_SIZE = int(os.getenv("LISTING_CACHE_SIZE", "2000"))
+LISTING_CACHE_TTL_S = float(os.getenv("LISTING_CACHE_TTL_S", str(7 * 86400)))
+# "key:class,..."，例如合作夥伴批次上傳用的 key 對應 bulk
+PRIORITY_API_KEYS = dict(
+    kv.split(":", 1) for kv in os.getenv("PRIORITY_API_KEYS", "").split(",") if kv
+)
+ROLE_CACHE_S = float(os.getenv("ROLE_CACHE_S", "300"))
+ROLE_CACHE_SIZE = int(os.getenv("ROLE_CACHE_SIZE", "4096"))
+# /analyze 延遲預算（ms，0 = 不限）；可用 X-Latency-Budget-Ms header 逐次指定
+ANALYZE_BUDGET_MS = float(os.getenv("ANALYZE_BUDGET_MS", "0"))
+VLM_MAX_TOKENS = 256
+VLM_MIN_TOKENS = int(os.getenv("VLM_MIN_TOKENS", "96"))  # 少於此數 JSON 多半不完整
+# 啟動時重新排入的未完成背景 listing 上限（依建立時間由舊到新）
+DEFERRED_REPLAY_LIMIT = int(os.getenv("DEFERRED_REPLAY_LIMIT", "500"))
+DRIFT_REFERENCE_PATH = os.getenv(
+    "DRIFT_REFERENCE_PATH", "./inference/cache/drift_reference.json"
+)
+DRIFT_WINDOW_S = float(os.getenv("DRIFT_WINDOW_S", "300"))
+DRIFT_WINDOWS = int(os.getenv("DRIFT_WINDOWS", "12"))
+DRIFT_REFERENCE_N = int(os.getenv("DRIFT_REFERENCE_N", "1000"))
+READ_CACHE_TTL_S = float(os.getenv("READ_CACHE_TTL_S", "30"))
+READ_CACHE_STALE_S = float(os.getenv("READ_CACHE_STALE_S", "300"))
+PRICE_INDEX_DIR = os.getenv("PRICE_INDEX_DIR", "./inference/price_index")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))
+SHADOW_MAX_QUEUE = int(os.getenv("SHADOW_MAX_QUEUE", "8"))
+SHADOW_MAX_DUTY = float(os.getenv("SHADOW_MAX_DUTY", "0.25"))
+
+
+def weights_version(path: str) -> str:
+    """權重檔內容雜湊的前 16 碼；換模型後 embedding / 分佈基準依此區分。"""
+    if not os.path.isfile(path):
+        return path
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
 
 # --- clients & models ---
 sb: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+sb_service: Client = (
+    create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    if SUPABASE_SERVICE_ROLE_KEY
+    else sb
+)
 yolo_s1, yolo_s2 = YOLO(STAGE1), YOLO(STAGE2)
+STAGE1_VERSION, STAGE2_VERSION = weights_version(STAGE1), weights_version(STAGE2)
 tok = AutoTokenizer.from_pretrained(VLM_ID)
 proc = AutoProcessor.from_pretrained(VLM_ID)
 vlm = AutoModelForCausalLM.from_pretrained(
@@ -50,12 +149,68 @@ class VLMOut(BaseModel):
     title_zh: str
     title_en: str
     desc: str
-    prices: Prices
+    prices: Prices | None = None
+
+
+class ScanEvent(BaseModel):
+    event_id: str = Field(min_length=1, max_length=128)
+    qr: dict | str
+    status: str
+    location: str | None = None
+    device_id: str | None = None
+    scanned_at: datetime | None = None
+
+
+class ScanBatch(BaseModel):
+    events: List[ScanEvent]
 
 
 ALLOWED_MIME = {"image/jpeg", "image/png", "image/webp"}
 MAX_PIXELS = 4096 * 4096
 MAX_BYTES = 8 * 1024 * 1024
+UPLOAD_MAX_EDGE = 1024  # frontend-min/index.html 上傳前縮到的長邊上限
+MAX_VIEWS = int(os.getenv("MAX_VIEWS", "6"))
+# 多視角：任一視角對某瑕疵的信心達此值，即使平均分數是 good 也判為該瑕疵
+DEFECT_VIEW_CONF = float(os.getenv("DEFECT_VIEW_CONF", "0.6"))
+
+
+analytics = SampleAnalytics(sb)
+# 參考分佈依目前載入的 stage1+stage2 權重分開保存
+drift = DriftMonitor(
+    DRIFT_REFERENCE_PATH,
+    f"{STAGE1_VERSION}+{STAGE2_VERSION}",
+    DRIFT_WINDOW_S,
+    DRIFT_WINDOWS,
+    reference_n=DRIFT_REFERENCE_N,
+)
+reads = ReadCache(ttl_s=READ_CACHE_TTL_S, stale_s=READ_CACHE_STALE_S)
+
+
+def system_flag(key: str, default=None, fresh: bool = False):
+    """fresh=True 時略過快取直接讀（並更新快取），供 admin 寫入路徑做決策。"""
+
+    def load():
+        rows = (
+            sb.table("system_flags")
+            .select("value")
+            .eq("key", key)
+            .limit(1)
+            .execute()
+            .data
+        )
+        return rows[0]["value"] if rows else None
+
+    if fresh:
+        reads.invalidate("system_flags", key)
+    value = reads.get(("system_flags", key), load)
+    return default if value is None else value
+
+
+def training_run(run_id: str) -> dict:
+    # 只在 admin 寫入路徑上讀，依 status / metrics 做決定，不經快取
+    return (
+        sb.table("training_runs").select("*").eq("id", run_id).single().execute().data
+    )
 
 
 def require_admin(token: str | None):
@@ -63,37 +218,51 @@ def require_admin(token: str | None):
         raise HTTPException(403, "admin only")
 
 
-def yolo_cls(model, img: Image.Image):
-    r = model.predict(img, imgsz=640, conf=0.25, verbose=False)
-    probs = getattr(r[0], "probs", None)
+def yolo_cls_batch(model, imgs: List[Image.Image]):
+    res = model.predict(imgs, imgsz=640, conf=0.25, verbose=False)
     names = model.names
-    scores = (
-        {names[i]: float(probs.data[i]) for i in range(len(names))} if probs else {}
-    )
-    top = max(scores, key=scores.get) if scores else "unknown"
-    return top, scores
+    out = []
+    for r in res:
+        probs = getattr(r, "probs", None)
+        scores = (
+            {names[i]: float(probs.data[i]) for i in range(len(names))} if probs else {}
+        )
+        out.append((max(scores, key=scores.get) if scores else "unknown", scores))
+    return out
 
 
-def prompt_json(is_sneaker, defects, brand, model_name):
+def yolo_cls(model, img: Image.Image):
+    return yolo_cls_batch(model, [img])[0]
+
+
+def prompt_json(is_sneaker, defects, brand, model_name, with_prices=True):
     d = ", ".join(defects) if defects else "none"
+    prices = ", prices{90:[l,u],70:[l,u],50:[l,u]}" if with_prices else ""
     return (
         "Output STRICT JSON with keys: summary, defects[], suggestion(donate|resale|recycle), "
-        "title_zh, title_en, desc(<=150 chars), prices{90:[l,u],70:[l,u],50:[l,u]}.\n"
+        f"title_zh, title_en, desc(<=150 chars){prices}.\n"
         f"Type: {'sneaker' if is_sneaker else 'non-sneaker'}\nBrand:{brand or 'unknown'}\n"
         f"Model:{model_name or 'unknown'}\nDetected defects:{d}\n"
         "Rules: hole/split-off -> recycle; flat -> donate; else resale. Only JSON."
     )
 
 
+DEFAULT_PRICES = {"90": [1000, 1500], "70": [700, 1000], "50": [400, 700]}
+
+
 def parse_vlm_json(txt: str) -> dict:
     try:
         raw = json.loads(txt.strip())
         parsed = VLMOut.model_validate(raw)
-        prices = {
-            "90": list(parsed.prices._90),
-            "70": list(parsed.prices._70),
-            "50": list(parsed.prices._50),
-        }
+        prices = (
+            {
+                "90": list(parsed.prices._90),
+                "70": list(parsed.prices._70),
+                "50": list(parsed.prices._50),
+            }
+            if parsed.prices
+            else None
+        )
         d = parsed.model_dump(by_alias=True)
         d["prices"] = prices
         return d
@@ -105,17 +274,305 @@ def parse_vlm_json(txt: str) -> dict:
             "title_zh": "運動鞋",
             "title_en": "Sneakers",
             "desc": "一般使用痕跡，清潔後可再用。",
-            "prices": {"90": [1000, 1500], "70": [700, 1000], "50": [400, 700]},
+            "prices": dict(DEFAULT_PRICES),
+            "fallback": True,
         }
 
 
-def run_vlm(img: Image.Image, prompt: str) -> dict:
+def template_listing(brand, model_name, defects, suggestion) -> dict:
+    """不跑 VLM 時的樣板文字；fallback=True 使其不進 listing 快取、價格標為 default。"""
+    name = " ".join(filter(None, [brand, model_name])) or "二手鞋"
+    d_zh = "、".join(defects) if defects else "無明顯瑕疵"
+    d_en = ", ".join(defects) if defects else "no visible defects"
+    return {
+        "summary": f"{name}，{d_zh}",
+        "defects": defects,
+        "suggestion": suggestion,
+        "title_zh": f"{name}（{d_zh}）",
+        "title_en": f"{name} ({d_en})",
+        "desc": f"{name}，{d_zh}，詳細描述稍後補上。",
+        "prices": dict(DEFAULT_PRICES),
+        "fallback": True,
+    }
+
+
+vlm_cost = {"ms_per_token": 40.0}  # EWMA，含 prefill 攤提，偏保守
+
+
+def run_vlm(img: Image.Image, prompt: str, max_new_tokens=VLM_MAX_TOKENS) -> dict:
+    t0 = time.perf_counter()
     inputs = proc(images=img, text=prompt, return_tensors="pt").to(vlm.device)
-    out = vlm.generate(**inputs, max_new_tokens=256)
-    txt = tok.decode(out[0], skip_special_tokens=True)
+    out = vlm.generate(**inputs, max_new_tokens=max_new_tokens)
+    input_len = inputs["input_ids"].shape[1]
+    n = max(1, out.shape[1] - input_len)
+    ms = (time.perf_counter() - t0) * 1000
+    vlm_cost["ms_per_token"] = 0.8 * vlm_cost["ms_per_token"] + 0.2 * ms / n
+    # generate() 的輸出包含 prompt，只解碼新生成的部分
+    txt = tok.decode(out[0][input_len:], skip_special_tokens=True)
     return parse_vlm_json(txt)
 
 
+def run_vlm_within(img: Image.Image, prompt: str, deadline: float | None):
+    """
+    在 VLM lane 開始執行時才依剩餘時間決定生成長度（排隊時間也算在預算內）；
+    連 VLM_MIN_TOKENS 都來不及時不生成，回傳 (None, tokens)。
+    """
+    tokens = VLM_MAX_TOKENS
+    if deadline is not None:
+        left_ms = (deadline - time.perf_counter()) * 1000
+        tokens = min(tokens, int(left_ms / vlm_cost["ms_per_token"]))
+    if tokens < VLM_MIN_TOKENS:
+        return None, tokens
+    return run_vlm(img, prompt, tokens), tokens
+
+
+async def fill_listing(item_id, job: dict, img=None):
+    """
+    降級回應後以 bulk 優先權在背景補上 VLM 文字（與價格）。job 同時寫在
+    items.deferred_json，程序重啟前沒補完的由 replay_deferred() 重新排入；
+    img 為 None 時從 image store 讀回。
+    """
+    try:
+        if img is None:
+            raw = await run_in_threadpool(image_store.read, job["image_key"])
+            img, _ = await run_in_threadpool(decode_image, raw, False)
+        js = await scheduler.run(
+            "vlm", Ticket("bulk", "deferred"), run_vlm, img, job["prompt"]
+        )
+    except DeadlineExceeded:
+        return
+    except Exception:
+        # 影像還沒寫完或讀不到：保留 deferred_json，下次啟動再補
+        return
+    if js.get("fallback"):
+        return
+    listing_cache.put(job["lkey"], js)
+    row = {
+        "listing_title_zh": js.get("title_zh"),
+        "listing_title_en": js.get("title_en"),
+        "listing_desc": js.get("desc"),
+        "vlm_summary": js.get("summary"),
+        "degradation": "filled",
+        "deferred_json": None,
+    }
+    if job["with_prices"] and js.get("prices"):
+        row.update(price_ranges_json=js["prices"], price_source="vlm")
+    await run_in_threadpool(
+        lambda: sb.table("items").update(row).eq("id", item_id).execute()
+    )
+
+
+def shadow_flush(run_id: str, summary: dict):
+    sb.table("training_runs").update({"shadow_json": summary}).eq(
+        "id", run_id
+    ).execute()
+
+
+shadow = ShadowEvaluator(
+    yolo_cls,
+    shadow_flush,
+    sample_rate=SHADOW_SAMPLE_RATE,
+    max_queue=SHADOW_MAX_QUEUE,
+    max_duty=SHADOW_MAX_DUTY,
+)
+
+
+def candidate_weights(artifacts: dict, stage: str) -> dict:
+    w = {
+        "stage1": artifacts.get("stage1_weights"),
+        "stage2": artifacts.get("stage2_weights"),
+    }
+    if not any(w.values()) and artifacts.get("weights"):
+        w[stage] = artifacts["weights"]
+    return w
+
+
+price_index = PriceIndex(PRICE_INDEX_DIR, model=STAGE1_VERSION)
+
+
+listing_cache = ListingCache(
+    LISTING_CACHE_PATH, max_size=LISTING_CACHE_SIZE, ttl_s=LISTING_CACHE_TTL_S
+)
+
+
+def mark_images_missing(uris: list):
+    """影像寫入重試用盡：標記樣本，匯出與標註都略過。"""
+    sb.table("dataset_samples").update({"image_missing": True}).in_(
+        "image_path", uris
+    ).execute()
+
+
+# samples bucket 只允許 service role 寫入（見 infra/supabase.sql）
+image_store = ImageStore(
+    backend_from_env(sb_service),
+    workers=int(os.getenv("IMAGE_STORE_WORKERS", "2")),
+    max_pending=int(os.getenv("IMAGE_STORE_MAX_PENDING", "16")),
+    on_failed=lambda sha, keys: mark_images_missing(
+        [image_store.backend.uri(keys["model"])]
+    ),
+)
+if isinstance(image_store.backend, LocalBackend):
+    image_store.backend.root.mkdir(parents=True, exist_ok=True)
+    app.mount("/images", StaticFiles(directory=image_store.backend.root), name="images")
+
+
+_replays = set()
+
+
+@app.on_event("startup")
+async def replay_deferred():
+    """重新排入上次程序結束前沒補完的背景 listing。"""
+    rows = await run_in_threadpool(
+        lambda: sb.table("items")
+        .select("id,deferred_json")
+        .in_("degradation", ["cached", "deferred"])
+        .not_.is_("deferred_json", "null")
+        .order("created_at")
+        .limit(DEFERRED_REPLAY_LIMIT)
+        .execute()
+        .data
+    )
+    for r in rows:
+        task = asyncio.create_task(fill_listing(r["id"], r["deferred_json"]))
+        _replays.add(task)
+        task.add_done_callback(_replays.discard)
+
+
+@app.on_event("shutdown")
+def flush_caches():
+    listing_cache.flush()
+    image_store.close()
+    scans.close()
+
+
+def rule_suggestion(defects) -> str:
+    # 與 prompt_json 的 Rules 相同
+    d = " ".join(defects).lower()
+    if "hole" in d or "split" in d:
+        return "recycle"
+    if "flat" in d:
+        return "donate"
+    return "resale"
+
+
+def embed(img: Image.Image):
+    """stage1 分類器 backbone 的 embedding；失敗時回傳 None（改由 VLM 定價）。"""
+    try:
+        return yolo_s1.embed(img, imgsz=640, verbose=False)[0].detach().cpu().numpy()
+    except Exception:
+        return None
+
+
+def detect(imgs: List[Image.Image]) -> dict:
+    """
+    所有視角一起跑 stage1、（球鞋才跑）stage2 的 batch，彙總成單一判斷，並對
+    代表視角算 embedding（在 YOLO lane 內由 analyze_views 呼叫）。
+    """
+    t0 = time.perf_counter()
+    v1 = yolo_cls_batch(yolo_s1, imgs)
+    top1, s1, view = aggregate_views(v1)
+    top2, s2, v2 = None, {}, [(None, None)] * len(imgs)
+    if top1 == "sneaker":
+        v2 = yolo_cls_batch(yolo_s2, imgs)
+        top2, s2, view = aggregate_views(v2, DEFECT_VIEW_CONF)
+    return {
+        "top1": top1,
+        "s1": s1,
+        "top2": top2,
+        "s2": s2,
+        "view": view,
+        "views": list(zip(v1, v2)),
+        "ms": (time.perf_counter() - t0) * 1000,
+        "emb": embed(imgs[view]),
+    }
+
+
+scheduler = Scheduler(
+    {
+        "yolo": int(os.getenv("YOLO_WORKERS", "1")),
+        "vlm": int(os.getenv("VLM_WORKERS", "1")),
+    }
+)
+# sha256(access token) -> (email, role, fetched_at)；LRU，最多 ROLE_CACHE_SIZE 筆
+_identities: OrderedDict = OrderedDict()
+_identities_lock = threading.Lock()
+
+
+def verified_identity(token: str) -> Tuple[str, str | None] | None:
+    """
+    以 Supabase Auth 驗證 Bearer access token，回傳 (email, users.role)；
+    無效時 None。會連線，須在 threadpool 中呼叫。
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+    with _identities_lock:
+        hit = _identities.get(key)
+        if hit and time.time() - hit[2] < ROLE_CACHE_S:
+            _identities.move_to_end(key)
+            return hit[:2]
+    try:
+        email = sb.auth.get_user(token).user.email
+    except Exception:
+        email = None
+    role = None
+    if email:
+        rows = (
+            sb.table("users").select("role").eq("email", email).limit(1).execute().data
+        )
+        role = rows[0]["role"] if rows else None
+    with _identities_lock:
+        _identities[key] = (email, role, time.time())
+        _identities.move_to_end(key)
+        while len(_identities) > ROLE_CACHE_SIZE:
+            _identities.popitem(last=False)
+    return (email, role) if email else None
+
+
+async def make_ticket(
+    request: Request, authorization, api_key, admin_token, priority, deadline_ms
+) -> Ticket:
+    """
+    優先等級與 tenant 只依已驗證的身分決定（admin token、PRIORITY_API_KEYS、
+    Supabase Auth Bearer token）；表單上的 user_email 不可信，匿名呼叫端以
+    client IP 作為 tenant。
+    """
+    bearer = (authorization or "").removeprefix("Bearer ").strip()
+    ident = await run_in_threadpool(verified_identity, bearer) if bearer else None
+    if admin_token and hmac.compare_digest(admin_token, ADMIN_TOKEN):
+        cls, tenant = "interactive", "admin"
+    elif api_key and api_key in PRIORITY_API_KEYS:
+        cls = PRIORITY_API_KEYS[api_key]
+        tenant = "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:8]
+    elif ident:
+        cls, tenant = ROLE_CLASS.get(ident[1], "standard"), "user:" + ident[0]
+    else:
+        cls = "standard"
+        tenant = "ip:" + (request.client.host if request.client else "unknown")
+    # 呼叫端只能自行降級（例如把批次工作標成 bulk），不能升級
+    if priority in CLASSES and CLASSES.index(priority) > CLASSES.index(cls):
+        cls = priority
+    return Ticket(cls, tenant, deadline_ms / 1000 if deadline_ms else None)
+
+
+async def scheduled(lane: str, ticket: Ticket, fn, *args):
+    try:
+        return await scheduler.run(lane, ticket, fn, *args)
+    except DeadlineExceeded as e:
+        raise HTTPException(504, str(e))
+
+
+def decode_image(raw: bytes, client_scaled: bool):
+    """回傳 (RGB 影像, 是否為前端已縮圖的輸入)。"""
+    im = Image.open(io.BytesIO(raw))
+    # 前端已縮圖（附原始尺寸）且在上限內時不必再走 MAX_PIXELS 縮圖
+    prescaled = client_scaled and max(im.size) <= UPLOAD_MAX_EDGE
+    if not prescaled and im.width * im.height > MAX_PIXELS:
+        im.draft("RGB", (4096, 4096))  # JPEG 直接以縮小比例解碼
+    im = im.convert("RGB")
+    if not prescaled and im.width * im.height > MAX_PIXELS:
+        im.thumbnail((4096, 4096))
+    return im, prescaled
+
+
 def phash_hex(img: Image.Image) -> str:
     return str(imagehash.phash(img))
 
@@ -125,16 +582,64 @@ def laplacian_blur(img: Image.Image) -> float:
     return float(cv2.Laplacian(arr, cv2.CV_64F).var())
 
 
+def uncertainty(scores: dict | None) -> float:
+    """0.5 * (正規化 entropy + (1 - margin))；沒有分數視為完全不確定。"""
+    k = len(scores or {})
+    p = sorted((v for v in (scores or {}).values() if v > 0), reverse=True)
+    total = sum(p)
+    if not p or total <= 0:
+        return 1.0
+    p = [v / total for v in p]
+    ent = -sum(v * math.log(v) for v in p) / math.log(k) if k > 1 else 0.0
+    margin = p[0] - (p[1] if len(p) > 1 else 0.0)
+    return 0.5 * (ent + (1.0 - margin))
+
+
 def mark_candidate(
-    s1c: float | None, s2c: float | None, defects: list, sugg: str
-) -> bool:
-    if s1c and s1c < 0.7:
-        return True
-    if s2c and s2c < 0.6:
-        return True
-    if ("good" in defects) and (sugg in ["donate", "recycle"]):
-        return True
-    return False
+    s1: dict, s2: dict | None, top2: str | None, sugg: str
+) -> Tuple[bool, float]:
+    # s2 為 None 代表 stage2 沒跑（非球鞋），不計入
+    u = max(uncertainty(s1), uncertainty(s2) if s2 is not None else 0.0)
+    if u >= CANDIDATE_UNCERTAINTY:
+        return True, u
+    if top2 == "good" and sugg in ["donate", "recycle"]:
+        return True, u
+    return False, u
+
+
+def analyze_views(uploads: list, client_scaled: bool) -> dict:
+    """
+    /analyze 在 YOLO lane 內的整份工作：解碼、影像儲存的 sha256、pHash / blur 與
+    推論都依請求的優先等級排隊，bulk 上傳不會在 event loop 上拖慢 interactive。
+    uploads 為 [(原始位元組, content type)]。
+    """
+    ims, stored, scaled = [], [], []
+    for raw, content_type in uploads:
+        im, pre = decode_image(raw, client_scaled)
+        stored.append(image_store.put(raw, im, content_type))
+        ims.append(im)
+        scaled.append(pre)
+    det = detect(ims)
+    det.update(
+        ims=ims,
+        stored=stored,
+        scaled=scaled,
+        phash=[phash_hex(im) for im in ims],
+        blur=[laplacian_blur(im) for im in ims],
+    )
+    return det
+
+
+def insert_rows(table: str, rows):
+    """同步的 Supabase insert；在 async 端點中以 run_in_threadpool 呼叫。"""
+    return sb.table(table).insert(rows).execute().data
+
+
+def flush_scans(events: list):
+    sb.rpc("ingest_scan_events", {"p_events": events}).execute()
+
+
+scans = ScanBuffer(flush_scans)
 
 
 def qr_b64(payload: dict) -> str:
@@ -153,106 +658,230 @@ def healthz():
 
 @app.post("/analyze")
 async def analyze(
+    request: Request,
     img: UploadFile,
+    background: BackgroundTasks,
+    views: List[UploadFile] = File(None),
     user_email: str = Form(None),
     brand: str = Form(None),
     model_name: str = Form(None),
+    detail: bool = Form(False),
+    priority: str = Form(None),
+    deadline_ms: int = Form(None),
+    x_api_key: str | None = Header(None),
+    x_admin_token: str | None = Header(None),
+    authorization: str | None = Header(None),
+    x_latency_budget_ms: float | None = Header(None),
+    orig_width: int = Form(None),
+    orig_height: int = Form(None),
 ):
-    if img.content_type not in ALLOWED_MIME:
-        return {"error": "unsupported file type"}
-    raw = await img.read()
-    if len(raw) > MAX_BYTES:
-        return {"error": "file too large"}
-    im = Image.open(io.BytesIO(raw)).convert("RGB")
-    if im.width * im.height > MAX_PIXELS:
-        im.thumbnail((4096, 4096))
+    started = time.perf_counter()
+    budget_ms = x_latency_budget_ms or ANALYZE_BUDGET_MS
+    # 同一件 item 的多個視角：img 為主視角，views 為其他角度
+    uploads = [img] + [v for v in views or [] if v is not None]
+    if len(uploads) > MAX_VIEWS:
+        return {"error": f"at most {MAX_VIEWS} views"}
+    raws = []
+    for up in uploads:
+        if up.content_type not in ALLOWED_MIME:
+            return {"error": "unsupported file type"}
+        raw = await up.read()
+        if len(raw) > MAX_BYTES:
+            return {"error": "file too large"}
+        raws.append((raw, up.content_type))
 
-    top1, s1 = yolo_cls(yolo_s1, im)
+    ticket = await make_ticket(
+        request, authorization, x_api_key, x_admin_token, priority, deadline_ms
+    )
+    try:
+        det = await scheduled(
+            "yolo", ticket, analyze_views, raws, bool(orig_width and orig_height)
+        )
+    except ImageStoreFull:
+        raise HTTPException(503, "image store busy", headers={"Retry-After": "1"})
+    ims, stored = det["ims"], det["stored"]
+    prescaled = det["scaled"][0]  # orig_width/orig_height 描述主視角
+    top1, s1, top2, s2, emb = (det[k] for k in ("top1", "s1", "top2", "s2", "emb"))
     is_sneaker = top1 == "sneaker"
-    defects, s2 = [], {}
-    if is_sneaker:
-        top2, s2 = yolo_cls(yolo_s2, im)
-        if top2 not in ["good", "unknown"]:
-            defects = [top2]
+    defects = [top2] if is_sneaker and top2 not in NON_DEFECT else []
+    # VLM、縮圖與 price index 都用最具代表性的視角
+    im, primary = ims[det["view"]], stored[det["view"]]
+    (p1, _), (p2, _) = det["views"][0]
+    shadow.submit(ims[0], {"stage1": p1, "stage2": p2}, det["ms"] / len(ims))
 
-    js = run_vlm(im, prompt_json(is_sneaker, defects, brand, model_name))
+    # 相似且已定價的 item 足夠時用最近鄰估價，VLM 只需產生文字
+    est = (
+        await run_in_threadpool(price_index.estimate, emb, brand, defects)
+        if emb is not None
+        else None
+    )
+    # listing 文字依 (brand, model, defects, suggestion) 快取；價格也已知時不必跑 VLM，
+    # detail=True 代表需要依照片寫 summary，一律呼叫 VLM
+    lkey = listing_key(
+        brand,
+        model_name,
+        defects if is_sneaker else ["non-sneaker"],
+        rule_suggestion(defects),
+    )
+    cached = None if detail else listing_cache.get(lkey)
+    # 降級等級：full → short（縮短生成）→ cached（快取文字）→ deferred（樣板文字，
+    # 背景補 VLM）；超出預算才往下降
+    degradation, deferred = "full", None
+    if cached and est:
+        js, text_source = dict(cached), "cache"
+        listing_cache.avoided()
+    else:
+        prompt = prompt_json(is_sneaker, defects, brand, model_name, est is None)
+        deadline = started + budget_ms / 1000 if budget_ms else None
+        js, tokens = None, 0
+        if deadline is None or deadline > time.perf_counter():
+            vt = ticket
+            if deadline is not None:
+                left = min(ticket.remaining(), deadline - time.perf_counter())
+                vt = Ticket(ticket.cls, ticket.tenant, left)
+            try:
+                js, tokens = await scheduler.run(
+                    "vlm", vt, run_vlm_within, im, prompt, deadline
+                )
+            except DeadlineExceeded:
+                pass
+        # 截短的回答常解析失敗而回傳通用 fallback，視同沒有結果，改走快取或背景補
+        if js is not None and not js.get("fallback"):
+            text_source = "vlm"
+            degradation = "full" if tokens >= VLM_MAX_TOKENS else "short"
+            if not cached:
+                listing_cache.put(lkey, js)
+        elif cached:
+            js, text_source, degradation = dict(cached), "cache", "cached"
+            js["prices"] = dict(DEFAULT_PRICES)
+            js["fallback"] = True
+        else:
+            sugg = rule_suggestion(defects)
+            js = template_listing(brand, model_name, defects, sugg)
+            text_source, degradation = "template", "deferred"
+        if text_source != "vlm":
+            deferred = {
+                "prompt": prompt,
+                "lkey": lkey,
+                "with_prices": est is None and bool(js.get("fallback")),
+                "image_key": primary["keys"]["webp"],
+            }
     suggestion = js.get("suggestion", "resale")
-    prices = js.get("prices", {})
+    if est:
+        prices, price_source = est["prices"], "nn"
+    else:
+        prices = js.get("prices") or {}
+        price_source = "default" if js.get("fallback") else "vlm"
+    js["prices"] = prices
 
     item = (
-        sb.table("items")
-        .insert(
+        await run_in_threadpool(
+            insert_rows,
+            "items",
             {
                 "user_email": user_email,
-                "image_url": None,
+                "image_url": primary["urls"]["webp"],
+                "thumb_url": primary["urls"]["thumb"],
+                "image_sha256": primary["sha256"],
+                "orig_width": orig_width if prescaled else ims[0].width,
+                "orig_height": orig_height if prescaled else ims[0].height,
+                "view_count": len(ims),
                 "is_sneaker": is_sneaker,
                 "defects_json": s2 or s1,
                 "suggestion": suggestion,
                 "price_ranges_json": prices,
+                "price_source": price_source,
+                "degradation": degradation,
+                "deferred_json": deferred,
                 "listing_title_zh": js.get("title_zh"),
                 "listing_title_en": js.get("title_en"),
                 "listing_desc": js.get("desc"),
                 "vlm_summary": js.get("summary"),
                 "status": "created",
-            }
+            },
         )
-        .execute()
-        .data[0]
-    )
+    )[0]
 
-    phex = phash_hex(im)
-    blur = laplacian_blur(im)
-    s1c = max(s1.values()) if isinstance(s1, dict) and s1 else None
-    s2c = max(s2.values()) if isinstance(s2, dict) and s2 else None
-    cand = mark_candidate(s1c or 1.0, s2c or 1.0, defects, suggestion)
-    sb.table("dataset_samples").insert(
-        {
-            "item_id": item["id"],
-            "image_path": None,
-            "phash": phex,
-            "blur_score": blur,
-            "stage1_pred": top1,
-            "stage1_conf": s1c,
-            "stage2_pred": defects[0] if defects else None,
-            "stage2_conf": s2c,
-            "vlm_suggestion": suggestion,
-            "candidate_for_training": cand,
-        }
-    ).execute()
+    if deferred:
+        background.add_task(fill_listing, item["id"], deferred, im)
+    if emb is not None:
+        await run_in_threadpool(
+            price_index.add, item["id"], emb, brand, defects, prices, price_source
+        )
+
+    # 每個視角各是一筆訓練樣本，分數用該視角自己的預測
+    samples = []
+    for view_stored, phex, blur, ((t1, v1), (t2, v2)) in zip(
+        stored, det["phash"], det["blur"], det["views"]
+    ):
+        cand, unc = mark_candidate(v1, v2 if is_sneaker else None, t2, suggestion)
+        drift.observe(v1, v2 if is_sneaker else None, blur, phex)
+        samples.append(
+            {
+                "item_id": item["id"],
+                # 訓練匯出讀 640px 衍生檔，不必重新解碼原圖
+                "image_path": view_stored["uris"]["model"],
+                "phash": phex,
+                "blur_score": blur,
+                "stage1_pred": t1,
+                "stage1_conf": max(v1.values()) if v1 else None,
+                "stage2_pred": t2 if t2 not in (None, *NON_DEFECT) else None,
+                "stage2_conf": max(v2.values()) if v2 else None,
+                "stage1_scores": v1,
+                "stage2_scores": v2 if is_sneaker else None,
+                "uncertainty": unc,
+                "vlm_suggestion": suggestion,
+                "candidate_for_training": cand,
+            }
+        )
+    await run_in_threadpool(insert_rows, "dataset_samples", samples)
+    # 寫入在插入前就已失敗時 on_failed 找不到這些列，這裡補標記
+    lost = [s["uris"]["model"] for s in stored if image_store.failed(s["sha256"])]
+    if lost:
+        await run_in_threadpool(mark_images_missing, lost)
 
     qr = None
     if suggestion in ["donate", "recycle"]:
-        payload = {
-            "item_id": item["id"],
-            "route": suggestion.upper(),
-            "ts": int(time.time()),
-        }
-        sb.table("logistics").insert(
-            {"item_id": item["id"], "route": suggestion.upper(), "qr_payload": payload}
-        ).execute()
-        qr = qr_b64(payload)
+        payload = sign_payload(
+            QR_SECRET,
+            {
+                "item_id": item["id"],
+                "route": suggestion.upper(),
+                "ts": int(time.time()),
+            },
+        )
+        await run_in_threadpool(
+            insert_rows,
+            "logistics",
+            {"item_id": item["id"], "route": suggestion.upper(), "qr_payload": payload},
+        )
+        qr = await run_in_threadpool(qr_b64, payload)
 
-    return {"is_sneaker": is_sneaker, "defects": defects, "vlm": js, "qr_b64": qr}
+    return {
+        "is_sneaker": is_sneaker,
+        "defects": defects,
+        "views": len(ims),
+        "primary_view": det["view"],
+        "vlm": js,
+        "price_source": price_source,
+        "text_source": text_source,
+        "degradation": degradation,
+        "qr_b64": qr,
+    }
 
 
 @app.post("/admin/start_cold_start")
 async def start_cold_start(x_admin_token: str | None = Header(None)):
     require_admin(x_admin_token)
-    cold = (
-        sb.table("system_flags")
-        .select("value")
-        .eq("key", "cold_start_required")
-        .single()
-        .execute()
-        .data["value"]
-    )
+    cold = system_flag("cold_start_required", {})
     min_samples = cold.get("min_samples", 80)
     total = (
-        sb.table("dataset_samples")
-        .select("id", count="exact")
-        .eq("is_labeled", True)
+        sb.table("dataset_stats")
+        .select("labeled")
+        .eq("key", "all")
+        .single()
         .execute()
-        .count
+        .data["labeled"]
     )
     if total < min_samples:
         return {
@@ -263,7 +892,7 @@ async def start_cold_start(x_admin_token: str | None = Header(None)):
         sb.table("training_runs")
         .insert(
             {
-                "status": "running",
+                "status": "queued",
                 "triggered_by": "manual:admin",
                 "data_count": total,
                 "params_json": {
@@ -282,18 +911,77 @@ async def start_cold_start(x_admin_token: str | None = Header(None)):
     return {"ok": True, "run_id": run["id"]}
 
 
+RUN_LIGHT_COLUMNS = (
+    "id,started_at,finished_at,status,triggered_by,data_count,"
+    "error_msg,gate_notes,approved_at,approved_by,"
+    "lease_owner,heartbeat_at,attempts,progress_json"
+)
+RUN_HEAVY_COLUMNS = {
+    "params": "params_json",
+    "metrics": "metrics_json",
+    "artifacts": "artifacts",
+    "shadow": "shadow_json",
+}
+RUNS_MAX_LIMIT = 200
+
+
 @app.get("/admin/runs")
-async def list_runs(x_admin_token: str | None = Header(None)):
+async def list_runs(
+    cursor: str | None = None,
+    limit: int = 50,
+    status: str | None = None,
+    triggered_by: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    include: str | None = None,
+    x_admin_token: str | None = Header(None),
+    if_none_match: str | None = Header(None),
+):
+    """
+    Keyset 分頁：依 (started_at, id) 由新到舊，下一頁游標放在 X-Next-Cursor。
+    include=params,metrics,artifacts,shadow 才回傳對應的 jsonb 欄位。
+    """
     require_admin(x_admin_token)
+    limit = max(1, min(limit, RUNS_MAX_LIMIT))
+    cols = RUN_LIGHT_COLUMNS
+    for name in filter(None, (include or "").split(",")):
+        if name.strip() not in RUN_HEAVY_COLUMNS:
+            raise HTTPException(400, f"unknown include: {name}")
+        cols += "," + RUN_HEAVY_COLUMNS[name.strip()]
+
+    q = sb.table("training_runs").select(cols)
+    if status:
+        q = q.eq("status", status)
+    if triggered_by:
+        q = q.eq("triggered_by", triggered_by)
+    if since:
+        q = q.gte("started_at", since)
+    if until:
+        q = q.lt("started_at", until)
+    if cursor:
+        try:
+            ts, rid = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(400, "invalid cursor")
+        q = q.or_(f'started_at.lt."{ts}",and(started_at.eq."{ts}",id.lt.{rid})')
     rows = (
-        sb.table("training_runs")
-        .select("*")
-        .order("started_at", desc=True)
-        .limit(50)
+        q.order("started_at", desc=True)
+        .order("id", desc=True)
+        .limit(limit + 1)
         .execute()
         .data
     )
-    return rows
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    body = json.dumps(rows, ensure_ascii=False, sort_keys=True, default=str)
+    etag = 'W/"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @app.post("/admin/approve_run")
@@ -301,16 +989,62 @@ async def approve_run(
     run_id: str,
     model_name: str,
     version: str | None = None,
+    override: bool = False,
+    reason: str | None = None,
     x_admin_token: str | None = Header(None),
 ):
     require_admin(x_admin_token)
-    row = sb.table("training_runs").select("*").eq("id", run_id).single().execute().data
+    # 核可依 metrics 做決定，不能用 stale-while-revalidate 的舊資料
+    row = training_run(run_id)
     if row["status"] != "pending_review":
         raise HTTPException(400, f"run not pending_review: {row['status']}")
+    # registry 依 stage 欄位找正式模型（warm start 來源、評估基準），不看名稱
+    stage = run_stage(row)
+    if stage not in STAGES:
+        raise HTTPException(400, f"run has unknown stage: {stage}")
+    if any(s in model_name.lower() for s in STAGES if s != stage):
+        raise HTTPException(
+            400, f"model_name {model_name!r} does not match the run's stage {stage}"
+        )
+    gate = {**APPROVAL_GATE, **system_flag("approval_gate", {}, fresh=True)}
+    failures = gate_failures(row.get("metrics_json"), gate)
+    if failures and not override:
+        raise HTTPException(
+            409, {"msg": "evaluation gate failed", "failures": failures}
+        )
+    if failures and not reason:
+        raise HTTPException(400, "override requires a reason")
+    gate_notes = (
+        f"override: {reason}; failed: {'; '.join(failures)}"
+        if failures
+        else "evaluation gate passed"
+    )
+    if shadow.run_id == run_id:
+        shadow.stop()
+    # 條件式更新：只有仍是 pending_review 才核可
+    updated = (
+        sb.table("training_runs")
+        .update(
+            {
+                "status": "succeeded",
+                "approved_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "approved_by": "admin@your.org",
+                "gate_notes": gate_notes,
+            }
+        )
+        .eq("id", run_id)
+        .eq("status", "pending_review")
+        .execute()
+        .data
+    )
+    if not updated:
+        raise HTTPException(409, "run is no longer pending_review")
+    row = updated[0]  # 更新當下的 row，registry 複製的是最新的 metrics / artifacts
     version = version or time.strftime("%Y%m%d-%H%M%S", time.gmtime())
     sb.table("model_registry").insert(
         {
             "model_name": model_name,
+            "stage": stage,
             "run_id": run_id,
             "version": version,
             "metrics_json": row.get("metrics_json", {}),
@@ -318,17 +1052,257 @@ async def approve_run(
             "approved_by": "admin@your.org",
         }
     ).execute()
-    sb.table("training_runs").update(
-        {
-            "status": "succeeded",
-            "approved_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-            "approved_by": "admin@your.org",
-        }
-    ).eq("id", run_id).execute()
     sb.table("system_flags").update({"value": {"enabled": False}}).eq(
         "key", "cold_start_required"
     ).execute()
+    reads.invalidate("system_flags", "cold_start_required")
     return {
         "ok": True,
-        "message": f"run {run_id} approved and registered for {model_name}",
+        "message": f"run {run_id} approved and registered as {stage} {model_name}",
+        "gate": gate_notes,
     }
+
+
+@app.post("/admin/shadow/start")
+async def shadow_start(
+    run_id: str,
+    sample_rate: float | None = None,
+    stage: str = "stage2",
+    x_admin_token: str | None = Header(None),
+):
+    require_admin(x_admin_token)
+    if stage not in ("stage1", "stage2"):
+        raise HTTPException(400, "stage must be stage1 or stage2")
+    row = training_run(run_id)
+    if row["status"] != "pending_review":
+        raise HTTPException(400, f"run not pending_review: {row['status']}")
+    weights = candidate_weights(row.get("artifacts") or {}, stage)
+    if not any(weights.values()):
+        raise HTTPException(400, "run has no candidate weights in artifacts")
+    try:
+        # artifacts 內是 ARTIFACT_BUCKET 的 key；下載與載入都不在 event loop 上做
+        models = await run_in_threadpool(
+            load_candidates,
+            weights,
+            YOLO,
+            sb_service.storage.from_(ARTIFACT_BUCKET).download,
+            ARTIFACT_CACHE_DIR,
+        )
+    except Exception as e:
+        raise HTTPException(400, f"failed to load candidate weights: {e}")
+    shadow.start(run_id, models, sample_rate)
+    return {
+        "ok": True,
+        "run_id": run_id,
+        "stages": list(models),
+        "sample_rate": shadow.sample_rate,
+    }
+
+
+@app.post("/admin/shadow/stop")
+async def shadow_stop(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    return {"ok": True, "shadow": shadow.stop()}
+
+
+@app.get("/admin/shadow")
+async def shadow_status(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    return {
+        "active": shadow.active,
+        "shadow": shadow.summary() if shadow.active else None,
+    }
+
+
+@app.post("/admin/price_index/rebuild")
+async def price_index_rebuild(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    # k-means 需數秒，不能在 event loop 上跑
+    nlist = await run_in_threadpool(price_index.build_ivf)
+    return {
+        "ok": True,
+        "items": len(price_index),
+        "ivf_lists": nlist,
+        "model": price_index.model,
+        "archived": price_index.archived,
+    }
+
+
+@app.get("/admin/listing_cache")
+async def listing_cache_status(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    return listing_cache.summary()
+
+
+@app.delete("/admin/listing_cache")
+async def listing_cache_clear(
+    key: str | None = None, x_admin_token: str | None = Header(None)
+):
+    require_admin(x_admin_token)
+    return {"ok": True, "removed": listing_cache.invalidate(key)}
+
+
+@app.get("/admin/image_store")
+async def image_store_status(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    return image_store.summary()
+
+
+@app.get("/admin/scheduler")
+async def scheduler_status(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    return scheduler.summary()
+
+
+@app.post("/logistics/scans")
+async def ingest_scans(batch: ScanBatch, x_scan_token: str | None = Header(None)):
+    if x_scan_token not in (SCAN_TOKEN, ADMIN_TOKEN):
+        raise HTTPException(403, "scanner only")
+    if len(batch.events) > SCAN_MAX_BATCH:
+        raise HTTPException(413, f"at most {SCAN_MAX_BATCH} events per batch")
+    now = datetime.now(timezone.utc)
+    accepted, rejected, unsigned = [], [], {}
+    for ev in batch.events:
+        qr = parse_qr(ev.qr)
+        if qr is None or ev.status not in STATUSES:
+            rejected.append({"event_id": ev.event_id, "reason": "invalid"})
+            continue
+        row = {
+            "event_id": ev.event_id,
+            "item_id": qr["item_id"],
+            "status": ev.status,
+            "location": ev.location,
+            "device_id": ev.device_id,
+            "scanned_at": (ev.scanned_at or now).isoformat(),
+        }
+        if "sig" in qr:
+            if verify_qr(QR_SECRET, qr):
+                accepted.append(row)
+            else:
+                rejected.append({"event_id": ev.event_id, "reason": "bad signature"})
+        else:
+            unsigned.setdefault(qr["item_id"], []).append((row, qr.get("route")))
+    if unsigned:
+        # 簽章上線前印出的 QR：整批一次比對 logistics 紀錄
+        known = {
+            r["item_id"]: r["route"]
+            for r in sb.table("logistics")
+            .select("item_id,route")
+            .in_("item_id", list(unsigned))
+            .execute()
+            .data
+        }
+        for item_id, rows in unsigned.items():
+            for row, route in rows:
+                if known.get(item_id) == route:
+                    accepted.append(row)
+                else:
+                    rejected.append(
+                        {"event_id": row["event_id"], "reason": "unknown item"}
+                    )
+    # 寫入成功才回報 accepted；逾時未寫入的請裝置重送（event_id 去重）
+    futs = scans.offer(accepted)
+    waits = [asyncio.wrap_future(f) for f in futs]
+    if waits:
+        await asyncio.wait(waits, timeout=SCAN_ACK_TIMEOUT_S)
+    written = 0
+    for i, row in enumerate(accepted):
+        w = waits[i] if i < len(waits) else None
+        if w is None or not w.done():
+            rejected.append({"event_id": row["event_id"], "reason": "busy, retry"})
+        elif w.result() is None:
+            written += 1
+        else:
+            rejected.append({"event_id": row["event_id"], "reason": "write failed"})
+    return {"accepted": written, "rejected": rejected}
+
+
+@app.get("/logistics/{item_id}/status")
+async def logistics_status(
+    item_id: str,
+    limit: int = 20,
+    route: str | None = None,
+    ts: int | None = None,
+    sig: str | None = None,
+    x_admin_token: str | None = Header(None),
+):
+    """
+    含掃描地點與裝置，僅限 admin token，或持有該 item 已簽章 QR 的
+    route/ts/sig 查詢參數。
+    """
+    admin = bool(x_admin_token) and hmac.compare_digest(x_admin_token, ADMIN_TOKEN)
+    qr = {"item_id": item_id, "route": route, "ts": ts, "sig": sig or ""}
+    if not admin and not (sig and verify_qr(QR_SECRET, qr)):
+        raise HTTPException(401, "admin token or signed QR required")
+    limit = max(1, min(limit, 200))
+    latest = await run_in_threadpool(
+        lambda: sb.table("logistics_status")
+        .select("*")
+        .eq("item_id", item_id)
+        .execute()
+        .data
+    )
+    events = await run_in_threadpool(
+        lambda: sb.table("scan_events")
+        .select("event_id,status,location,device_id,scanned_at")
+        .eq("item_id", item_id)
+        .order("scanned_at", desc=True)
+        .limit(limit)
+        .execute()
+        .data
+    )
+    return {"latest": latest[0] if latest else None, "events": events}
+
+
+@app.get("/admin/scans")
+async def scans_status(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    return scans.summary()
+
+
+@app.get("/admin/read_cache")
+async def read_cache_status(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    return reads.summary()
+
+
+@app.get("/admin/analytics")
+async def admin_analytics(
+    since: str | None = None,
+    until: str | None = None,
+    bucket: str = "day",
+    x_admin_token: str | None = Header(None),
+):
+    require_admin(x_admin_token)
+    if bucket not in BUCKETS:
+        raise HTTPException(400, f"bucket must be one of {sorted(BUCKETS)}")
+    try:
+        end = datetime.fromisoformat(until) if until else datetime.now(timezone.utc)
+        start = datetime.fromisoformat(since) if since else end - timedelta(days=30)
+    except ValueError:
+        raise HTTPException(400, "since/until must be ISO 8601 timestamps")
+    end, start = (
+        t if t.tzinfo else t.replace(tzinfo=timezone.utc) for t in (end, start)
+    )
+    if (end - start) / BUCKETS[bucket] > 2000:
+        raise HTTPException(400, "range too large for this bucket size")
+    report = analytics.report(start, end, bucket)
+    report["cache"] = analytics.summary()
+    return report
+
+
+@app.get("/admin/drift")
+async def drift_status(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    return drift.report()
+
+
+@app.post("/admin/drift/reference")
+async def drift_reference(x_admin_token: str | None = Header(None)):
+    require_admin(x_admin_token)
+    return {"ok": True, "reference": drift.set_reference({"source": "manual"})}
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(drift.metrics_text(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,269 @@
+"""
+串流漂移監控：固定記憶體的分佈 sketch，比較近期視窗與核可時的參考快照
+
+每筆 /analyze 視角只做幾個計數器遞增（微秒級、不讀資料庫）：
+- stage1/stage2 top 信心與 blur（ln(1+x)）的固定 bin 直方圖
+- stage1/stage2 預測類別計數
+- pHash 64 個 bit 各自為 1 的次數（影像內容/構圖的粗略分佈）
+
+最近 windows 個、每個 window_s 秒的 sketch 合併為 rolling 分佈，與參考快照
+計算 PSI 作為漂移分數。參考快照依模型版本分開保存（JSON，重啟與回滾模型後
+沿用）：目前版本還沒有快照時，自動以載入後的前 reference_n 筆觀測建立，
+換模型本身的分佈變化不會被當成漂移。也可手動以目前 rolling 分佈重設。
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+BINS = 20
+BLUR_LOG_MAX = 8.0  # 與 analytics / sample_analytics() 的 blur bin 相同
+HISTS = ("stage1_conf", "stage2_conf", "blur")
+PSI_WARN = 0.1
+PSI_ALERT = 0.25
+
+
+def _bin(x: float, hi: float = 1.0) -> int:
+    return min(BINS - 1, max(0, int(x / hi * BINS)))
+
+
+class Sketch:
+    __slots__ = ("n", "hist", "classes", "bits", "nbits")
+
+    def __init__(self):
+        self.n = 0
+        self.hist = {k: [0] * BINS for k in HISTS}
+        self.classes = {"stage1": {}, "stage2": {}}
+        self.bits = [0] * 64
+        self.nbits = 0
+
+    def add(self, s1: dict, s2: dict | None, blur: float | None, phash: str | None):
+        self.n += 1
+        for stage, scores in (("stage1", s1), ("stage2", s2)):
+            if not scores:
+                continue
+            top = max(scores, key=scores.get)
+            self.hist[f"{stage}_conf"][_bin(scores[top])] += 1
+            c = self.classes[stage]
+            c[top] = c.get(top, 0) + 1
+        if blur is not None:
+            self.hist["blur"][_bin(math.log1p(max(blur, 0.0)), BLUR_LOG_MAX)] += 1
+        if phash:
+            h = int(phash, 16)
+            bits = self.bits
+            while h:
+                low = h & -h
+                bits[low.bit_length() - 1] += 1
+                h ^= low
+            self.nbits += 1
+
+    def merge(self, other: "Sketch"):
+        self.n += other.n
+        for k in HISTS:
+            self.hist[k] = [a + b for a, b in zip(self.hist[k], other.hist[k])]
+        for stage, counts in other.classes.items():
+            mine = self.classes[stage]
+            for c, v in counts.items():
+                mine[c] = mine.get(c, 0) + v
+        self.bits = [a + b for a, b in zip(self.bits, other.bits)]
+        self.nbits += other.nbits
+        return self
+
+    def to_json(self) -> dict:
+        return {
+            "n": self.n,
+            "hist": self.hist,
+            "classes": self.classes,
+            "bits": self.bits,
+            "nbits": self.nbits,
+        }
+
+    @classmethod
+    def from_json(cls, d: dict) -> "Sketch":
+        s = cls()
+        s.n, s.nbits = d["n"], d["nbits"]
+        s.hist = {k: list(d["hist"][k]) for k in HISTS}
+        s.classes = {k: dict(v) for k, v in d["classes"].items()}
+        s.bits = list(d["bits"])
+        return s
+
+
+def psi(ref: list, cur: list, eps: float = 1e-4) -> float | None:
+    """Population Stability Index；任一邊沒有資料時回傳 None。"""
+    rt, ct = sum(ref), sum(cur)
+    if not rt or not ct:
+        return None
+    out = 0.0
+    for r, c in zip(ref, cur):
+        p, q = max(r / rt, eps), max(c / ct, eps)
+        out += (q - p) * math.log(q / p)
+    return round(out, 4)
+
+
+def quantiles(hist: list, hi: float, qs=(0.1, 0.5, 0.9), log: bool = False):
+    total = sum(hist)
+    if not total:
+        return None
+    out, acc, i = {}, 0, 0
+    width = hi / BINS
+    for q in qs:
+        target = q * total
+        while i < BINS - 1 and acc + hist[i] < target:
+            acc += hist[i]
+            i += 1
+        frac = (target - acc) / hist[i] if hist[i] else 0.0
+        x = (i + min(max(frac, 0.0), 1.0)) * width
+        out[f"p{int(q * 100)}"] = round(math.expm1(x) if log else x, 4)
+    return out
+
+
+class DriftMonitor:
+    def __init__(
+        self,
+        path: str,
+        model: str,
+        window_s: float = 300,
+        windows: int = 12,
+        min_n: int = 200,
+        reference_n: int = 1000,
+    ):
+        self.path = Path(path)
+        self.model = model
+        self.window_s, self.min_n = window_s, min_n
+        self.reference_n = max(reference_n, min_n)
+        self._lock = threading.Lock()
+        self._windows: deque = deque(maxlen=windows)
+        self._cur = Sketch()
+        self._cur_start = time.monotonic()
+        self._saved = {}  # model -> {"meta", "sketch"}
+        if self.path.exists():
+            self._saved = json.loads(self.path.read_text()).get("references", {})
+        self.reference, self.reference_meta = None, {}
+        if model in self._saved:
+            self.reference = Sketch.from_json(self._saved[model]["sketch"])
+            self.reference_meta = self._saved[model].get("meta", {})
+        # 目前模型還沒有參考快照時，累積前 reference_n 筆觀測
+        self._capture = Sketch() if self.reference is None else None
+
+    def observe(self, s1, s2, blur=None, phash=None):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._cur_start >= self.window_s:
+                self._windows.append(self._cur)
+                self._cur = Sketch()
+                self._cur_start = now
+            self._cur.add(s1, s2, blur, phash)
+            cap = self._capture
+            if cap is None:
+                return
+            cap.add(s1, s2, blur, phash)
+            if cap.n < self.reference_n:
+                return
+            self._capture = None
+        self._store(cap, {"source": "auto"})
+
+    def rolling(self) -> Sketch:
+        with self._lock:
+            out = Sketch()
+            for w in (*self._windows, self._cur):
+                out.merge(w)
+            return out
+
+    def set_reference(self, meta: dict | None = None) -> dict:
+        """以目前 rolling 分佈作為目前模型的參考快照（手動重設）。"""
+        with self._lock:
+            self._capture = None
+        return self._store(self.rolling(), meta)
+
+    def _store(self, ref: Sketch, meta: dict | None) -> dict:
+        meta = {
+            **(meta or {}),
+            "model": self.model,
+            "n": ref.n,
+            "taken_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        with self._lock:
+            self._saved[self.model] = {"meta": meta, "sketch": ref.to_json()}
+            data = json.dumps({"references": self._saved})
+            self.reference, self.reference_meta = ref, meta
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(data)
+        os.replace(tmp, self.path)
+        return meta
+
+    def scores(self, cur: Sketch | None = None) -> dict:
+        cur = cur or self.rolling()
+        ref = self.reference
+        if ref is None or ref.n < self.min_n or cur.n < self.min_n:
+            return {}
+        out = {k: psi(ref.hist[k], cur.hist[k]) for k in HISTS}
+        for stage in ("stage1", "stage2"):
+            names = sorted(set(ref.classes[stage]) | set(cur.classes[stage]))
+            out[f"{stage}_classes"] = psi(
+                [ref.classes[stage].get(c, 0) for c in names],
+                [cur.classes[stage].get(c, 0) for c in names],
+            )
+        if ref.nbits and cur.nbits:
+            out["phash_bits"] = round(
+                sum(
+                    abs(a / ref.nbits - b / cur.nbits)
+                    for a, b in zip(ref.bits, cur.bits)
+                )
+                / 64,
+                4,
+            )
+        return {k: v for k, v in out.items() if v is not None}
+
+    def report(self) -> dict:
+        cur = self.rolling()
+        scores = self.scores(cur)
+        worst = max((v for k, v in scores.items() if k != "phash_bits"), default=0.0)
+        status = (
+            "alert" if worst >= PSI_ALERT else "warn" if worst >= PSI_WARN else "ok"
+        )
+
+        def describe(s: Sketch | None):
+            if s is None:
+                return None
+            return {
+                "n": s.n,
+                "stage1_conf": quantiles(s.hist["stage1_conf"], 1.0),
+                "stage2_conf": quantiles(s.hist["stage2_conf"], 1.0),
+                "blur": quantiles(s.hist["blur"], BLUR_LOG_MAX, log=True),
+                "classes": s.classes,
+            }
+
+        capture = self._capture
+        return {
+            "status": status if scores else "insufficient_data",
+            "model": self.model,
+            "capturing_reference": (
+                {"n": capture.n, "target": self.reference_n} if capture else None
+            ),
+            "scores": scores,
+            "window_s": self.window_s,
+            "windows": len(self._windows) + 1,
+            "current": describe(cur),
+            "reference": describe(self.reference),
+            "reference_meta": self.reference_meta,
+        }
+
+    def metrics_text(self) -> str:
+        """Prometheus text exposition。"""
+        cur = self.rolling()
+        lines = [
+            "# TYPE shoes_drift_psi gauge",
+            *(
+                f'shoes_drift_psi{{feature="{k}"}} {v}'
+                for k, v in self.scores(cur).items()
+            ),
+            "# TYPE shoes_drift_samples gauge",
+            f'shoes_drift_samples{{window="rolling"}} {cur.n}',
+            f'shoes_drift_samples{{window="reference"}} {self.reference.n if self.reference else 0}',
+        ]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,41 @@
+"""
+approve_run 的評估把關：比較 training/evaluate.py 寫入 metrics_json["eval"] 的
+候選與正式模型（同一份 holdout、同一台機器）
+"""
+
+from typing import List
+
+STAGES = ("stage1", "stage2")
+APPROVAL_GATE = {
+    "max_acc_drop": 0.0,
+    "max_f1_drop": 0.01,
+    "latency_budget_ms": 150,
+    "max_latency_regression": 0.2,
+}
+
+
+def run_stage(run: dict) -> str:
+    """run 訓練的 stage；與 training/pipeline.py 相同，未指定時為 stage2。"""
+    return (run.get("params_json") or {}).get("stage", "stage2")
+
+
+def gate_failures(metrics: dict, gate: dict) -> List[str]:
+    """比較 metrics_json["eval"] 中候選與正式模型；回傳未通過的項目。"""
+    ev = (metrics or {}).get("eval") or {}
+    cand, prod = ev.get("candidate"), ev.get("production")
+    if ev.get("error"):
+        return [f"holdout evaluation failed: {ev['error']} (re-run with --evaluate)"]
+    if not cand:
+        return ["no holdout evaluation (run training/pipeline.py --evaluate)"]
+    out = []
+    if prod:
+        for k, drop in (("acc", "max_acc_drop"), ("f1", "max_f1_drop")):
+            if cand.get(k, 0) < prod.get(k, 0) - gate[drop]:
+                out.append(f"{k} regressed: {cand.get(k)} < {prod.get(k)}")
+    p95 = ((cand.get("latency") or {}).get("bs1") or {}).get("p95_ms")
+    if p95 is not None and p95 > gate["latency_budget_ms"]:
+        out.append(f"p95 latency {p95}ms over budget {gate['latency_budget_ms']}ms")
+    base = ((prod or {}).get("latency") or {}).get("bs1", {}).get("p95_ms")
+    if p95 is not None and base and p95 > base * (1 + gate["max_latency_regression"]):
+        out.append(f"p95 latency {p95}ms regressed vs production {base}ms")
+    return out
@@ -0,0 +1,281 @@
+"""
+內容定址的影像儲存
+
+原圖以 sha256 為鍵，同一張圖只存一次，旁邊預先產生衍生檔：
+
+    images/<sha[:2]>/<sha>/original<ext>
+    images/<sha[:2]>/<sha>/model.jpg     # 640px，訓練匯出與 shadow 用
+    images/<sha[:2]>/<sha>/thumb.webp    # 256px，admin 列表用
+    images/<sha[:2]>/<sha>/full.webp
+
+put() 只計算雜湊並回傳各檔的 key / URI，實際寫入與縮圖在背景 thread pool
+進行，不佔用 request 時間；待寫入的工作有上限（每筆都帶著原始位元組與解碼後
+的影像），滿了 put() 拋出 ImageStoreFull，由呼叫端回 503。寫入失敗會退避重試，
+仍失敗時記下 sha256 並呼叫 on_failed，讓呼叫端標記指向不存在物件的資料列。
+鍵由內容決定，已存在的物件不會覆寫。
+
+backend 預設為 Supabase Storage 的 STORAGE_BUCKET（與 training/exporter.py
+讀取的 bucket 相同，URI 為不含 scheme 的 key，GitHub runner 上的訓練也能讀）；
+設定 IMAGE_STORE_S3_BUCKET 時改用 S3 相容儲存（需安裝 boto3），
+IMAGE_STORE_BACKEND=local 則寫本地檔案系統（僅供單機開發）。
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+MODEL_SIZE = 640  # 與 yolo_cls 的 imgsz 相同
+THUMB_SIZE = 256
+EXT = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
+
+
+class ImageStoreFull(RuntimeError):
+    pass
+
+
+class LocalBackend:
+    def __init__(self, root: str, public_base: str = "/images"):
+        self.root = Path(root).resolve()
+        self.public_base = public_base.rstrip("/")
+
+    def exists(self, key: str) -> bool:
+        return (self.root / key).exists()
+
+    def write(self, key: str, data: bytes, content_type: str):
+        p = self.root / key
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(p.name + ".part")
+        tmp.write_bytes(data)
+        os.replace(tmp, p)
+
+    def read(self, key: str) -> bytes:
+        return (self.root / key).read_bytes()
+
+    def uri(self, key: str) -> str:
+        return (self.root / key).as_uri()
+
+    def url(self, key: str) -> str:
+        return f"{self.public_base}/{key}"
+
+
+class SupabaseBackend:
+    def __init__(self, sb, bucket: str, public_base: str | None = None):
+        self.bucket = sb.storage.from_(bucket)
+        self.public_base = (
+            public_base or f"{sb.supabase_url}/storage/v1/object/public/{bucket}"
+        ).rstrip("/")
+
+    def exists(self, key: str) -> bool:
+        folder, _, name = key.rpartition("/")
+        try:
+            found = self.bucket.list(folder, {"search": name, "limit": 1})
+        except Exception:
+            return False
+        return any(f.get("name") == name for f in found)
+
+    def write(self, key: str, data: bytes, content_type: str):
+        try:
+            self.bucket.upload(
+                key, data, {"content-type": content_type, "cache-control": "31536000"}
+            )
+        except Exception as e:
+            # 先前寫到一半留下的同一個 key，內容相同，不必也不能覆寫
+            if "Duplicate" not in str(e) and "already exists" not in str(e):
+                raise
+
+    def read(self, key: str) -> bytes:
+        return self.bucket.download(key)
+
+    def uri(self, key: str) -> str:
+        # exporter.fetch_bytes 把不含 scheme 的路徑當作 STORAGE_BUCKET 內的 key
+        return key
+
+    def url(self, key: str) -> str:
+        return f"{self.public_base}/{key}"
+
+
+class S3Backend:
+    def __init__(self, bucket: str, endpoint: str | None, public_base: str | None):
+        import boto3
+
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint or None)
+        # 未指定時用 path-style URL；DB 內不存會過期的 presigned URL
+        self.public_base = (
+            public_base or f"{self.client.meta.endpoint_url}/{bucket}"
+        ).rstrip("/")
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception:
+            return False
+
+    def write(self, key: str, data: bytes, content_type: str):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000, immutable",
+        )
+
+    def read(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def uri(self, key: str) -> str:
+        return f"s3://{self.bucket}/{key}"
+
+    def url(self, key: str) -> str:
+        return f"{self.public_base}/{key}"
+
+
+def backend_from_env(sb):
+    bucket = os.getenv("IMAGE_STORE_S3_BUCKET")
+    if bucket:
+        return S3Backend(
+            bucket,
+            os.getenv("IMAGE_STORE_S3_ENDPOINT"),
+            os.getenv("IMAGE_STORE_PUBLIC_BASE"),
+        )
+    if os.getenv("IMAGE_STORE_BACKEND", "supabase") == "local":
+        return LocalBackend(
+            os.getenv("IMAGE_STORE_DIR", "./inference/image_store"),
+            os.getenv("IMAGE_STORE_PUBLIC_BASE", "/images"),
+        )
+    return SupabaseBackend(
+        sb,
+        os.getenv("STORAGE_BUCKET", "samples"),
+        os.getenv("IMAGE_STORE_PUBLIC_BASE"),
+    )
+
+
+def _encode(img: Image.Image, size: int | None, fmt: str, quality: int) -> bytes:
+    if size:
+        img = img.copy()
+        img.thumbnail((size, size))
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=quality)
+    return buf.getvalue()
+
+
+class ImageStore:
+    def __init__(
+        self,
+        backend,
+        workers: int = 2,
+        max_pending: int = 16,
+        attempts: int = 3,
+        retry_s: float = 1.0,
+        on_failed=None,
+        max_failed: int = 10000,
+    ):
+        self.backend = backend
+        self.max_pending = max_pending
+        self.attempts, self.retry_s = attempts, retry_s
+        self.on_failed = on_failed  # (sha, keys)，在背景 thread 呼叫
+        self.max_failed = max_failed
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="img")
+        self._lock = threading.Lock()
+        self._inflight = set()
+        self._failed = OrderedDict()  # 最近寫入失敗的 sha256
+        self.stats = dict.fromkeys(
+            ("stored", "duplicates", "failed", "pending", "rejected", "retries"), 0
+        )
+
+    @staticmethod
+    def keys(sha: str, ext: str) -> dict:
+        base = f"images/{sha[:2]}/{sha}"
+        return {
+            "original": f"{base}/original{ext}",
+            "model": f"{base}/model.jpg",
+            "thumb": f"{base}/thumb.webp",
+            "webp": f"{base}/full.webp",
+        }
+
+    def put(self, raw: bytes, img: Image.Image, content_type: str) -> dict:
+        """回傳 {"sha256", "keys", "uris", "urls"}；寫入在背景完成。"""
+        sha = hashlib.sha256(raw).hexdigest()
+        keys = self.keys(sha, EXT.get(content_type, ".jpg"))
+        with self._lock:
+            submit = sha not in self._inflight
+            if submit and self.stats["pending"] >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise ImageStoreFull(f"{self.stats['pending']} images pending write")
+            if submit:
+                self._inflight.add(sha)
+                self.stats["pending"] += 1
+        if submit:
+            self._pool.submit(self._write, sha, raw, img, content_type, keys)
+        return {
+            "sha256": sha,
+            "keys": keys,
+            "uris": {k: self.backend.uri(v) for k, v in keys.items()},
+            "urls": {k: self.backend.url(v) for k, v in keys.items()},
+        }
+
+    def _write_all(self, raw, img, content_type, keys) -> str:
+        # 衍生檔最後寫原圖：原圖存在即代表整組完成，重複上傳直接略過
+        if self.backend.exists(keys["original"]):
+            return "duplicates"
+        self.backend.write(
+            keys["model"], _encode(img, MODEL_SIZE, "JPEG", 90), "image/jpeg"
+        )
+        self.backend.write(
+            keys["thumb"], _encode(img, THUMB_SIZE, "WEBP", 75), "image/webp"
+        )
+        self.backend.write(keys["webp"], _encode(img, None, "WEBP", 80), "image/webp")
+        self.backend.write(keys["original"], raw, content_type)
+        return "stored"
+
+    def _write(self, sha, raw, img, content_type, keys):
+        outcome = "failed"
+        for attempt in range(self.attempts):
+            if attempt:
+                with self._lock:
+                    self.stats["retries"] += 1
+                time.sleep(self.retry_s * 2 ** (attempt - 1))
+            try:
+                outcome = self._write_all(raw, img, content_type, keys)
+                break
+            except Exception:
+                continue
+        with self._lock:
+            if outcome == "failed":
+                self._failed[sha] = True
+                while len(self._failed) > self.max_failed:
+                    self._failed.popitem(last=False)
+            else:
+                self._failed.pop(sha, None)
+            self._inflight.discard(sha)
+            self.stats["pending"] -= 1
+            self.stats[outcome] += 1
+        if outcome == "failed" and self.on_failed is not None:
+            try:
+                self.on_failed(sha, keys)
+            except Exception:
+                pass
+
+    def read(self, key: str) -> bytes:
+        """讀回已寫入的檔案；尚在背景寫入或寫入失敗時由 backend 丟出例外。"""
+        return self.backend.read(key)
+
+    def failed(self, sha: str) -> bool:
+        """最近是否寫入失敗（重試用盡）。"""
+        with self._lock:
+            return sha in self._failed
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {**self.stats, "backend": type(self.backend).__name__}
+
+    def close(self):
+        self._pool.shutdown(wait=True)
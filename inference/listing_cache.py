@@ -0,0 +1,120 @@
+"""
+listing 文字快取：以正規化後的 (brand, model_name, defects, suggestion) 為鍵
+
+大部分上傳落在少數幾種組合，title_zh / title_en / desc 不必每次都請 VLM 重寫。
+有上限的 LRU + TTL，定期寫回 JSON（暫存檔 + os.replace），重啟後沿用。
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+TEXT_FIELDS = ("summary", "title_zh", "title_en", "desc", "suggestion")
+
+
+def listing_key(brand, model_name, defects, suggestion) -> str:
+    norm = lambda s: " ".join((s or "").lower().split()) or "unknown"  # noqa: E731
+    d = ",".join(sorted(defects)) if defects else "none"
+    return f"{norm(brand)}|{norm(model_name)}|{d}|{suggestion}"
+
+
+class ListingCache:
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 2000,
+        ttl_s: float = 7 * 86400,
+        flush_every: int = 20,
+    ):
+        self.path = Path(path)
+        self.max_size, self.ttl_s, self.flush_every = max_size, ttl_s, flush_every
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._dirty = 0
+        self.stats = dict.fromkeys(
+            ("hits", "misses", "expired", "evicted", "vlm_calls_avoided"), 0
+        )
+        self._load()
+
+    def _load(self):
+        try:
+            entries = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, entry in entries:
+            if now - entry["at"] < self.ttl_s:
+                self._data[key] = entry
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if time.time() - entry["at"] >= self.ttl_s:
+                del self._data[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            entry["uses"] = entry.get("uses", 0) + 1
+            self.stats["hits"] += 1
+            return entry["text"]
+
+    def put(self, key: str, js: dict):
+        text = {k: js.get(k) for k in TEXT_FIELDS}
+        if not text.get("title_zh") or not text.get("desc"):
+            return
+        with self._lock:
+            self._data[key] = {"text": text, "at": time.time(), "uses": 0}
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats["evicted"] += 1
+            self._dirty += 1
+            flush = self._dirty >= self.flush_every
+        if flush:
+            self.flush()
+
+    def avoided(self):
+        with self._lock:
+            self.stats["vlm_calls_avoided"] += 1
+
+    def invalidate(self, key: str | None = None) -> int:
+        with self._lock:
+            if key is None:
+                n = len(self._data)
+                self._data.clear()
+            else:
+                n = int(self._data.pop(key, None) is not None)
+            self._dirty += n
+        self.flush()
+        return n
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = list(self._data.items())
+            self._dirty = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(entries, ensure_ascii=False))
+        os.replace(tmp, self.path)
+
+    def summary(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_s": self.ttl_s,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,22 @@
+"""
+/admin/runs 的 keyset 分頁游標：(started_at, id) 以 urlsafe base64 編碼的 JSON
+"""
+
+import base64
+import json
+from typing import Tuple
+
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["started_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """格式錯誤時拋出 ValueError。"""
+    try:
+        pad = "=" * (-len(cursor) % 4)
+        started_at, run_id = json.loads(base64.urlsafe_b64decode(cursor + pad))
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    return str(started_at), str(run_id)
@@ -0,0 +1,244 @@
+"""
+以影像 embedding 最近鄰估價
+
+每件 item 的 embedding（L2 正規化、float16）append 到 vectors.f16，對應的
+item_id / 品牌+瑕疵群組 / 三段價格 / 價格來源 / 產生 embedding 的 stage1
+模型版本 append 到 meta.jsonl，兩者都是 O(1) 追加寫入。查詢時先以
+(brand, defects) 群組過濾；資料量大時用 IVF（k-means 粗分群、只搜 nprobe 個
+list）縮小範圍。只有 VLM 或人工定價的 item 會被當成鄰居，避免估價結果自我強化。
+
+不同模型的 embedding 不在同一個空間：載入時若索引含其他版本的向量，整份移到
+stale-<版本>/ 重新累積，查詢也只比對目前版本的向量。
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+BANDS = ("90", "70", "50")
+PRICED_SOURCES = {"vlm", "human"}
+IVF_MIN = 20000
+IVF_ITERS = 8
+
+
+def group_key(brand: str | None, defects: list | None) -> str:
+    b = (brand or "unknown").strip().lower() or "unknown"
+    d = ",".join(sorted(defects)) if defects else "none"
+    return f"{b}|{d}"
+
+
+class _Grow:
+    """容量倍增的 append-only numpy 陣列，避免每次 add 都整份複製。"""
+
+    def __init__(self, data: np.ndarray):
+        self.n = len(data)
+        self.buf = data.copy() if len(data) else data
+
+    def append(self, row):
+        row = np.asarray(row, dtype=self.buf.dtype)
+        if self.n == len(self.buf):
+            cap = max(64, 2 * len(self.buf))
+            buf = np.zeros((cap,) + self.buf.shape[1:], dtype=self.buf.dtype)
+            buf[: self.n] = self.buf[: self.n]
+            self.buf = buf
+        self.buf[self.n] = row
+        self.n += 1
+
+    @property
+    def data(self) -> np.ndarray:
+        return self.buf[: self.n]
+
+
+def _weighted_median(values: np.ndarray, weights: np.ndarray) -> float:
+    order = np.argsort(values)
+    v, w = values[order], weights[order]
+    cut = np.searchsorted(np.cumsum(w), w.sum() / 2)
+    return float(v[min(cut, len(v) - 1)])
+
+
+class PriceIndex:
+    def __init__(
+        self,
+        root: str,
+        model: str | None = None,
+        k: int = 5,
+        min_sim: float = 0.8,
+        min_n: int = 3,
+    ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.model = model
+        self.k, self.min_sim, self.min_n = k, min_sim, min_n
+        self._lock = threading.Lock()  # add / estimate / 換 centroids 共用
+        self._build_lock = threading.Lock()  # 同時只跑一個 k-means
+        self._vec_path = self.root / "vectors.f16"
+        self._meta_path = self.root / "meta.jsonl"
+        self._ivf_path = self.root / "ivf.npz"
+        self.archived = None
+        self._load()
+
+    def _read_meta(self) -> list:
+        if not self._meta_path.exists():
+            return []
+        with open(self._meta_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _archive(self, meta: list):
+        """其他模型版本的索引整份移開（保留以便回滾模型時手動搬回）。"""
+        old = next((m.get("model") for m in meta if m.get("model") != self.model), None)
+        dest = self.root / f"stale-{old or 'unknown'}"
+        dest.mkdir(exist_ok=True)
+        for p in (self._vec_path, self._meta_path, self._ivf_path):
+            if p.exists():
+                os.replace(p, dest / p.name)
+        self.archived = {"model": old, "items": len(meta), "path": str(dest)}
+
+    def _load(self):
+        meta = self._read_meta()
+        if self.model and any(m.get("model") != self.model for m in meta):
+            self._archive(meta)
+            meta = []
+        self.dim = meta[0]["dim"] if meta else None
+        vecs = (
+            np.fromfile(self._vec_path, dtype=np.float16)
+            if self._vec_path.exists()
+            else np.zeros(0, dtype=np.float16)
+        )
+        n = min(len(meta), len(vecs) // self.dim) if self.dim else 0
+        self.meta = meta[:n]
+        self.groups = {}
+        self._vectors = _Grow(vecs[: n * (self.dim or 0)].reshape(n, self.dim or 0))
+        self._group_ids = _Grow(
+            np.array([self._gid(m["group"]) for m in self.meta], dtype=np.int32)
+        )
+        self._priced = _Grow(
+            np.array([m["src"] in PRICED_SOURCES for m in self.meta], dtype=bool)
+        )
+        self._prices = _Grow(
+            np.array([m["prices"] for m in self.meta], dtype=np.float32).reshape(-1, 6)
+        )
+        self._current = _Grow(
+            np.array([m.get("model") == self.model for m in self.meta], dtype=bool)
+        )
+        self.centroids, self._lists = None, None
+        if self._ivf_path.exists():
+            ivf = np.load(self._ivf_path)
+            if len(ivf["lists"]) <= n:
+                self.centroids = ivf["centroids"]
+                tail = self._assign(self.vectors[len(ivf["lists"]) :])
+                self._lists = _Grow(np.concatenate([ivf["lists"], tail]))
+
+    vectors = property(lambda self: self._vectors.data)
+    group_ids = property(lambda self: self._group_ids.data)
+    priced = property(lambda self: self._priced.data)
+    prices = property(lambda self: self._prices.data)
+    current = property(lambda self: self._current.data)
+    lists = property(lambda self: None if self._lists is None else self._lists.data)
+
+    def _gid(self, key: str) -> int:
+        return self.groups.setdefault(key, len(self.groups))
+
+    def __len__(self):
+        return len(self.meta)
+
+    def _assign(self, vecs: np.ndarray) -> np.ndarray:
+        if self.centroids is None or len(vecs) == 0:
+            return np.zeros(len(vecs), dtype=np.int32)
+        return np.argmax(vecs.astype(np.float32) @ self.centroids.T, axis=1).astype(
+            np.int32
+        )
+
+    @staticmethod
+    def normalize(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32).ravel()
+        return v / (np.linalg.norm(v) + 1e-12)
+
+    def add(self, item_id, vec, brand, defects, prices: dict | None, src: str):
+        if not prices:
+            return
+        v = self.normalize(vec)
+        row = [int(x) for b in BANDS for x in prices.get(b, [0, 0])[:2]]
+        key = group_key(brand, defects)
+        m = {"id": item_id, "group": key, "prices": row, "src": src, "dim": len(v)}
+        m["model"] = self.model
+        with self._lock:
+            if self.dim is None:
+                self.dim = len(v)
+                self._vectors = _Grow(np.zeros((0, self.dim), dtype=np.float16))
+            with open(self._vec_path, "ab") as f:
+                f.write(v.astype(np.float16).tobytes())
+            with open(self._meta_path, "a") as f:
+                f.write(json.dumps(m) + "\n")
+            self._vectors.append(v.astype(np.float16))
+            self.meta.append(m)
+            self._group_ids.append(self._gid(key))
+            self._priced.append(src in PRICED_SOURCES)
+            self._prices.append(row)
+            self._current.append(True)
+            if self._lists is not None:
+                self._lists.append(self._assign(v[None])[0])
+
+    def build_ivf(self, nlist: int | None = None, seed: int = 0):
+        """
+        以 k-means 建 IVF 粗分群（資料量小於 IVF_MIN 時直接暴力搜尋）。耗時數秒，
+        須在 event loop 之外呼叫；k-means 期間 add / estimate 照常進行。
+        """
+        with self._build_lock:
+            with self._lock:
+                n = len(self)
+                X = self.vectors.astype(np.float32)
+            if n < IVF_MIN:
+                return 0
+            nlist = nlist or int(np.sqrt(n))
+            rng = np.random.default_rng(seed)
+            C = X[rng.choice(n, nlist, replace=False)]
+            for _ in range(IVF_ITERS):
+                assign = np.argmax(X @ C.T, axis=1)
+                for j in range(nlist):
+                    members = X[assign == j]
+                    if len(members):
+                        c = members.mean(axis=0)
+                        C[j] = c / (np.linalg.norm(c) + 1e-12)
+            lists = np.argmax(X @ C.T, axis=1).astype(np.int32)
+            with self._lock:
+                # k-means 期間新增的向量以新的 centroids 補上，lists 與 vectors 等長
+                self.centroids = C
+                tail = self._assign(self.vectors[n:])
+                self._lists = _Grow(np.concatenate([lists, tail]))
+                np.savez(self._ivf_path, centroids=C, lists=self.lists)
+            return nlist
+
+    def estimate(self, vec, brand, defects, nprobe: int = 8) -> dict | None:
+        """回傳 {"prices", "neighbors": [item_id], "similarity"}；鄰居不足時 None。"""
+        with self._lock:
+            # 取一致的快照（_Grow 只往後寫，之後的 add 不影響這些 view）
+            gid = self.groups.get(group_key(brand, defects))
+            if gid is None or not len(self):
+                return None
+            mask = (self.group_ids == gid) & self.priced & self.current
+            centroids, lists = self.centroids, self.lists
+            vectors, prices, meta = self.vectors, self.prices, self.meta
+        if centroids is not None:
+            q = self.normalize(vec)
+            probe = np.argsort(-(centroids @ q))[:nprobe]
+            mask &= np.isin(lists, probe)
+        idx = np.nonzero(mask)[0]
+        if len(idx) < self.min_n:
+            return None
+        q = self.normalize(vec).astype(np.float16)
+        sims = (vectors[idx] @ q).astype(np.float32)
+        top = np.argsort(-sims)[: self.k]
+        top = top[sims[top] >= self.min_sim]
+        if len(top) < self.min_n:
+            return None
+        w, P = sims[top], prices[idx[top]]
+        cols = [int(round(_weighted_median(P[:, j], w))) for j in range(6)]
+        bands = {b: [cols[2 * i], cols[2 * i + 1]] for i, b in enumerate(BANDS)}
+        return {
+            "prices": bands,
+            "neighbors": [meta[i]["id"] for i in idx[top]],
+            "similarity": round(float(w.mean()), 4),
+        }
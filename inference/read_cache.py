@@ -0,0 +1,97 @@
+"""
+Supabase 設定 / registry 讀取的 read-through 快取
+
+鍵為 tuple，第一個元素是資料表名稱（統計依此分組），例如
+("system_flags", "approval_gate")。
+
+- TTL 內：直接回傳
+- 過期但仍在 stale 視窗內：先回傳舊值，背景重新載入（stale-while-revalidate），
+  Supabase 慢或暫時失敗都不會卡住請求
+- 完全過期或沒有：同步載入
+- 服務自己寫入時呼叫 invalidate() 讓下一次讀取拿到新值
+
+只用於請求路徑上的設定讀取；會影響 admin 核可或訓練決策的讀取不經快取。
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+STAT_KEYS = ("hits", "stale_hits", "misses", "refreshes", "errors")
+
+
+class ReadCache:
+    def __init__(self, ttl_s: float = 30.0, stale_s: float = 300.0, workers: int = 2):
+        self.ttl_s, self.stale_s = ttl_s, stale_s
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> {"value", "at", "ttl"}
+        self._refreshing = set()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rc")
+        self._stats = {}
+
+    def _count(self, ns: str, stat: str):
+        self._stats.setdefault(ns, dict.fromkeys(STAT_KEYS, 0))[stat] += 1
+
+    def get(self, key: tuple, loader, ttl: float | None = None):
+        ttl = self.ttl_s if ttl is None else ttl
+        ns = key[0]
+        with self._lock:
+            e = self._entries.get(key)
+            age = time.monotonic() - e["at"] if e else None
+            if e and age < e["ttl"]:
+                self._count(ns, "hits")
+                return e["value"]
+            if e and age < e["ttl"] + self.stale_s:
+                self._count(ns, "stale_hits")
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    self._pool.submit(self._refresh, key, loader, ttl)
+                return e["value"]
+            self._count(ns, "misses")
+        value = loader()
+        self._store(key, value, ttl)
+        return value
+
+    def _store(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = {"value": value, "at": time.monotonic(), "ttl": ttl}
+
+    def _refresh(self, key, loader, ttl):
+        try:
+            value = loader()
+        except Exception:
+            with self._lock:
+                self._count(key[0], "errors")
+            return
+        else:
+            self._store(key, value, ttl)
+            with self._lock:
+                self._count(key[0], "refreshes")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, *prefix) -> int:
+        """刪除所有以 prefix 開頭的鍵，例如 invalidate("training_runs", run_id)。"""
+        n = len(prefix)
+        with self._lock:
+            keys = [k for k in self._entries if k[:n] == prefix]
+            for k in keys:
+                del self._entries[k]
+        return len(keys)
+
+    def summary(self) -> dict:
+        with self._lock:
+            out = {}
+            for ns, st in self._stats.items():
+                lookups = st["hits"] + st["stale_hits"] + st["misses"]
+                out[ns] = {
+                    **st,
+                    "entries": sum(1 for k in self._entries if k[0] == ns),
+                    "hit_rate": (
+                        round((st["hits"] + st["stale_hits"]) / lookups, 4)
+                        if lookups
+                        else None
+                    ),
+                }
+            return out
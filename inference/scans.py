@@ -0,0 +1,186 @@
+"""
+物流掃描事件：QR 簽章驗證與批次寫入
+
+倉庫手持裝置一次上傳一批掃描；驗證後放進記憶體緩衝，背景執行緒每
+max_batch 筆或 max_wait_s 秒呼叫一次 ingest_scan_events() 整批寫入
+append-only 的 scan_events，並在同一個交易內更新 logistics_status
+（每個 item 的最新狀態），不必改寫 logistics.scan_events_json。
+event_id 由裝置產生且唯一，重送不會重複寫入。
+
+每筆事件帶一個 Future，寫入成功才算 accepted（group commit：多個請求的事件
+合併成一次 RPC）。資料錯誤（SQLSTATE 22xxx/23xxx，例如 item 已刪除的 FK
+違規）時把批次二分，只有壞掉的那幾筆進 dead letter；連線等暫時性錯誤則整批
+重試，超過 max_attempts 才放棄。
+"""
+
+import hashlib
+import hmac
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable
+
+STATUSES = {
+    "received",
+    "sorted",
+    "packed",
+    "shipped",
+    "delivered",
+    "donated",
+    "recycled",
+}
+
+
+def qr_signature(secret: str, payload: dict) -> str:
+    msg = f"{payload.get('item_id')}|{payload.get('route')}|{payload.get('ts')}"
+    return hmac.new(secret.encode(), msg.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def sign_payload(secret: str, payload: dict) -> dict:
+    return {**payload, "sig": qr_signature(secret, payload)}
+
+
+def verify_qr(secret: str, qr: dict) -> bool:
+    return hmac.compare_digest(str(qr.get("sig", "")), qr_signature(secret, qr))
+
+
+def parse_qr(qr) -> dict | None:
+    if isinstance(qr, str):
+        try:
+            qr = json.loads(qr)
+        except ValueError:
+            return None
+    if not isinstance(qr, dict) or not qr.get("item_id"):
+        return None
+    try:
+        uuid.UUID(str(qr["item_id"]))
+    except ValueError:
+        return None  # 舊格式或手寫的 QR；不擋下整批寫入
+    return qr
+
+
+def is_data_error(e: Exception) -> bool:
+    """PostgREST APIError 的 SQLSTATE：22（資料格式）/ 23（約束違規）重試也不會成功。"""
+    return str(getattr(e, "code", "") or "")[:2] in ("22", "23")
+
+
+class ScanBuffer:
+    def __init__(
+        self,
+        flush: Callable[[list], None],
+        max_batch: int = 500,
+        max_wait_s: float = 0.5,
+        max_buffer: int = 50000,
+        max_attempts: int = 5,
+        max_dead: int = 1000,
+    ):
+        self.flush = flush
+        self.max_batch, self.max_wait_s = max_batch, max_wait_s
+        self.max_attempts = max_attempts
+        self._q: queue.Queue = queue.Queue(maxsize=max_buffer)
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(
+            ("buffered", "written", "batches", "retries", "splits", "dead"), 0
+        )
+        self.dead: deque = deque(maxlen=max_dead)  # 最近的 dead letter
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def offer(self, events: list) -> list:
+        """
+        回傳已放入緩衝之事件的 Future（依序，可能少於 events）；寫入成功時結果為
+        None，進 dead letter 時為錯誤原因。緩衝滿時其餘的由呼叫端回報，讓裝置稍後重送。
+        """
+        futs = []
+        for ev in events:
+            fut = Future()
+            try:
+                self._q.put_nowait((ev, 0, fut))
+            except queue.Full:
+                break
+            futs.append(fut)
+        self._count("buffered", len(futs))
+        return futs
+
+    def _drain(self, timeout: float) -> list:
+        batch = []
+        end = time.monotonic() + timeout
+        while len(batch) < self.max_batch:
+            left = end - time.monotonic()
+            try:
+                item = self._q.get(timeout=left) if left > 0 else self._q.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _bury(self, batch: list, reason: str):
+        with self._lock:
+            for ev, _, _ in batch:
+                self.dead.append({"event": ev, "error": reason})
+            self.stats["dead"] += len(batch)
+        for _, _, fut in batch:
+            fut.set_result(reason)
+
+    def _write(self, batch: list):
+        try:
+            self.flush([ev for ev, _, _ in batch])
+        except Exception as e:
+            if is_data_error(e):
+                # 找出壞掉的那幾筆，其餘照常寫入
+                if len(batch) == 1:
+                    self._bury(batch, str(e)[:300])
+                    return
+                self._count("splits")
+                mid = len(batch) // 2
+                self._write(batch[:mid])
+                self._write(batch[mid:])
+                return
+            retry = [(ev, n + 1, f) for ev, n, f in batch if n + 1 < self.max_attempts]
+            self._bury(
+                [x for x in batch if x[1] + 1 >= self.max_attempts], str(e)[:300]
+            )
+            self._count("retries", len(retry))
+            for i, item in enumerate(retry):
+                try:
+                    self._q.put_nowait(item)
+                except queue.Full:
+                    self._bury(retry[i:], "buffer full")
+                    break
+            time.sleep(self.max_wait_s)
+            return
+        for _, _, fut in batch:
+            fut.set_result(None)
+        self._count("written", len(batch))
+        self._count("batches")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            batch = self._drain(self.max_wait_s)
+            if batch:
+                self._write(batch)
+
+    def close(self, timeout: float = 10.0):
+        """停止背景執行緒並把剩下的事件寫完（shutdown 時呼叫）。"""
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        end = time.monotonic() + timeout
+        while not self._q.empty() and time.monotonic() < end:
+            self._write(self._drain(0))
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "queued": self._q.qsize(),
+                "recent_dead": list(self.dead)[-20:],
+            }
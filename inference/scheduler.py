@@ -0,0 +1,145 @@
+"""
+推論工作排程：YOLO 與 VLM 各一條 lane，取代共用的 FIFO
+
+- 優先等級：interactive（現場 admin/staff）> standard（一般 user）> bulk（ngo
+  合作夥伴批次上傳）；嚴格優先，同等級內各 tenant 輪流（round robin），
+  避免單一 tenant 的大量上傳佔滿 lane
+- 每個工作帶 deadline，輪到時已過期就直接丟棄（DeadlineExceeded），不浪費算力
+- 每條 lane 固定 worker 數（預設 1），模型不會被並行呼叫
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+CLASSES = ("interactive", "standard", "bulk")
+ROLE_CLASS = {
+    "admin": "interactive",
+    "staff": "interactive",
+    "user": "standard",
+    "ngo": "bulk",
+}
+DEFAULT_DEADLINE_S = {"interactive": 15.0, "standard": 60.0, "bulk": 600.0}
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class Ticket:
+    def __init__(self, cls: str, tenant: str, deadline_s: float | None = None):
+        self.cls = cls if cls in CLASSES else "standard"
+        self.tenant = tenant or "anon"
+        self.created = time.monotonic()
+        self.deadline = self.created + (deadline_s or DEFAULT_DEADLINE_S[self.cls])
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+
+def _pct(values, q: float):
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(q * len(s)))], 1)
+
+
+class Lane:
+    def __init__(self, name: str, workers: int = 1, window: int = 500):
+        self.name = name
+        self._cv = threading.Condition()
+        # class -> OrderedDict(tenant -> deque[job])；輪到的 tenant 移到最後
+        self._queues = {c: OrderedDict() for c in CLASSES}
+        self._stats = {
+            c: {"done": 0, "expired": 0, "wait_ms": deque(maxlen=window)}
+            for c in CLASSES
+        }
+        self._threads = [
+            threading.Thread(target=self._loop, daemon=True, name=f"{name}-{i}")
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, ticket: Ticket, fn, *args) -> Future:
+        fut = Future()
+        with self._cv:
+            q = self._queues[ticket.cls].setdefault(ticket.tenant, deque())
+            q.append((ticket, fn, args, fut, time.monotonic()))
+            self._cv.notify()
+        return fut
+
+    def _pop(self):
+        for c in CLASSES:
+            tenants = self._queues[c]
+            while tenants:
+                tenant, q = next(iter(tenants.items()))
+                job = q.popleft()
+                if q:
+                    tenants.move_to_end(tenant)
+                else:
+                    del tenants[tenant]
+                if job[0].remaining() > 0:
+                    return job
+                self._stats[c]["expired"] += 1
+                # 呼叫端已取消（例如連線中斷）的 future 不能再設定結果
+                if job[3].set_running_or_notify_cancel():
+                    job[3].set_exception(
+                        DeadlineExceeded(f"{self.name}: deadline passed while queued")
+                    )
+        return None
+
+    def _loop(self):
+        while True:
+            try:
+                self._step()
+            except Exception:
+                # 單一工作出錯不能讓 lane 的 worker 停掉
+                continue
+
+    def _step(self):
+        with self._cv:
+            job = self._pop()
+            while job is None:
+                self._cv.wait()
+                job = self._pop()
+            ticket, fn, args, fut, queued_at = job
+            st = self._stats[ticket.cls]
+            st["wait_ms"].append((time.monotonic() - queued_at) * 1000)
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            fut.set_result(fn(*args))
+        except Exception as e:
+            fut.set_exception(e)
+        with self._cv:
+            st["done"] += 1
+
+    def summary(self) -> dict:
+        with self._cv:
+            return {
+                c: {
+                    "queued": sum(len(q) for q in self._queues[c].values()),
+                    "tenants": len(self._queues[c]),
+                    "done": st["done"],
+                    "expired": st["expired"],
+                    "wait_p50_ms": _pct(st["wait_ms"], 0.5),
+                    "wait_p99_ms": _pct(st["wait_ms"], 0.99),
+                }
+                for c, st in self._stats.items()
+            }
+
+
+class Scheduler:
+    def __init__(self, lanes: dict):
+        self.lanes = {name: Lane(name, n) for name, n in lanes.items()}
+
+    async def run(self, lane: str, ticket: Ticket, fn, *args):
+        if ticket.remaining() <= 0:
+            raise DeadlineExceeded(f"{lane}: deadline passed before submit")
+        return await asyncio.wrap_future(self.lanes[lane].submit(ticket, fn, *args))
+
+    def summary(self) -> dict:
+        return {name: lane.summary() for name, lane in self.lanes.items()}
@@ -0,0 +1,235 @@
+"""
+候選模型影子評估（shadow mode）
+
+候選 stage1/stage2 模型在背景執行緒中對抽樣的 /analyze 流量做推論，
+不影響回應路徑；結果（預測分佈、與正式模型一致率、延遲）彙總後寫回
+training_runs.shadow_json 供 admin 審核。
+
+候選權重在 artifacts 中是 ARTIFACT_BUCKET 的 storage key（training/pipeline.py
+的 upload_artifact），載入前先下載到以內容 sha256 命名的本地快取。
+"""
+
+import hashlib
+import os
+import queue
+import random
+import threading
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Callable
+
+
+def _pct(values, q: float):
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(q * len(s)))], 2)
+
+
+def fetch_weights(download: Callable[[str], bytes], key: str, cache_dir) -> str:
+    """回傳權重的本地路徑；本地已有的檔案直接使用，否則視為 storage key 下載。"""
+    if os.path.isfile(key):
+        return key
+    data = download(key)
+    path = Path(cache_dir) / (hashlib.sha256(data).hexdigest() + Path(key).suffix)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".part")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    return str(path)
+
+
+def load_candidates(weights: dict, load: Callable, download: Callable, cache_dir):
+    """weights 為 {stage: 路徑或 storage key}；回傳 {stage: load(本地路徑)}。"""
+    return {
+        stage: load(fetch_weights(download, key, cache_dir))
+        for stage, key in weights.items()
+        if key
+    }
+
+
+class ShadowEvaluator:
+    """
+    預算控制：
+    - sample_rate：抽樣比例
+    - max_queue：待處理佇列上限，滿了直接丟棄（絕不阻塞請求）
+    - max_duty：影子執行緒在滑動視窗內最多佔用的時間比例，超過就丟棄樣本
+    """
+
+    def __init__(
+        self,
+        predict: Callable,
+        on_flush: Callable[[str, dict], None],
+        sample_rate: float = 0.1,
+        max_queue: int = 8,
+        max_duty: float = 0.25,
+        flush_every: int = 20,
+        window_s: float = 60.0,
+    ):
+        self.predict = predict
+        self.on_flush = on_flush
+        self.sample_rate = sample_rate
+        self.max_duty = max_duty
+        self.flush_every = flush_every
+        self.window_s = window_s
+        self._q: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._busy: deque = deque()  # (finished_at, seconds)，只在 _lock 內讀寫
+        self._busy_sum = 0.0
+        self._thread: threading.Thread | None = None
+        self.run_id: str | None = None
+        self.models: dict = {}
+        self._reset()
+
+    def _reset(self):
+        self.stats = {
+            "samples": 0,
+            "dropped": 0,
+            "errors": 0,
+            "stage1_compared": 0,
+            "stage1_agree": 0,
+            "stage2_compared": 0,
+            "stage2_agree": 0,
+            "stage1_preds": Counter(),
+            "stage2_preds": Counter(),
+        }
+        self._lat_ms: deque = deque(maxlen=512)
+        self._prod_ms: deque = deque(maxlen=512)
+        self._since_flush = 0
+
+    @property
+    def active(self) -> bool:
+        return self.run_id is not None and bool(self.models)
+
+    def start(self, run_id: str, models: dict, sample_rate: float | None = None):
+        self.stop()
+        with self._lock:
+            self.run_id = run_id
+            self.models = {k: m for k, m in models.items() if m is not None}
+            if sample_rate is not None:
+                self.sample_rate = max(0.0, min(1.0, sample_rate))
+            self._reset()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> dict | None:
+        if not self.active:
+            return None
+        self._q.put(None)
+        if self._thread:
+            self._thread.join(timeout=10)
+        summary = self.summary()
+        self._flush()
+        with self._lock:
+            self.run_id, self.models, self._thread = None, {}, None
+        return summary
+
+    def _duty(self) -> float:
+        """呼叫端須持有 _lock。"""
+        now = time.monotonic()
+        while self._busy and now - self._busy[0][0] > self.window_s:
+            self._busy_sum -= self._busy.popleft()[1]
+        return max(self._busy_sum, 0.0) / self.window_s
+
+    def submit(self, img, prod: dict, prod_ms: float | None = None) -> bool:
+        """在請求路徑上呼叫；只做 O(1) 判斷與非阻塞入列。"""
+        if not self.active or random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            if self._duty() > self.max_duty:
+                self.stats["dropped"] += 1
+                return False
+        try:
+            self._q.put_nowait((img, prod, prod_ms))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.stats["dropped"] += 1
+            return False
+
+    def _loop(self):
+        while True:
+            job = self._q.get()
+            if job is None:
+                return
+            img, prod, prod_ms = job
+            t0 = time.perf_counter()
+            try:
+                self._evaluate(img, prod)
+            except Exception:
+                with self._lock:
+                    self.stats["errors"] += 1
+                continue
+            finally:
+                took = time.perf_counter() - t0
+                with self._lock:
+                    self._busy.append((time.monotonic(), took))
+                    self._busy_sum += took
+            with self._lock:
+                self._lat_ms.append(took * 1000)
+                if prod_ms is not None:
+                    self._prod_ms.append(prod_ms)
+                self._since_flush += 1
+                due = self._since_flush >= self.flush_every
+            if due:
+                self._flush()
+
+    def _evaluate(self, img, prod: dict):
+        m1, m2 = self.models.get("stage1"), self.models.get("stage2")
+        top1 = top2 = None
+        if m1 is not None:
+            top1, _ = self.predict(m1, img)
+        # stage2 只在正式模型也跑了 stage2 時比較，一致率才有意義
+        if m2 is not None and prod.get("stage2") is not None:
+            top2, _ = self.predict(m2, img)
+        with self._lock:
+            st = self.stats
+            st["samples"] += 1
+            if top1 is not None:
+                st["stage1_preds"][top1] += 1
+                st["stage1_compared"] += 1
+                st["stage1_agree"] += int(top1 == prod.get("stage1"))
+            if top2 is not None:
+                st["stage2_preds"][top2] += 1
+                st["stage2_compared"] += 1
+                st["stage2_agree"] += int(top2 == prod.get("stage2"))
+
+    def summary(self) -> dict:
+        with self._lock:
+            st = self.stats
+            lat, prod = list(self._lat_ms), list(self._prod_ms)
+            return {
+                "run_id": self.run_id,
+                "sample_rate": self.sample_rate,
+                "samples": st["samples"],
+                "dropped": st["dropped"],
+                "errors": st["errors"],
+                "stage1_agreement": (
+                    round(st["stage1_agree"] / st["stage1_compared"], 4)
+                    if st["stage1_compared"]
+                    else None
+                ),
+                "stage2_agreement": (
+                    round(st["stage2_agree"] / st["stage2_compared"], 4)
+                    if st["stage2_compared"]
+                    else None
+                ),
+                "stage1_preds": dict(st["stage1_preds"]),
+                "stage2_preds": dict(st["stage2_preds"]),
+                "latency_ms": {"p50": _pct(lat, 0.5), "p95": _pct(lat, 0.95)},
+                "prod_latency_ms": {"p50": _pct(prod, 0.5), "p95": _pct(prod, 0.95)},
+                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }
+
+    def _flush(self):
+        if self.run_id is None:
+            return
+        summary = self.summary()
+        with self._lock:
+            self._since_flush = 0
+        try:
+            self.on_flush(self.run_id, summary)
+        except Exception:
+            pass
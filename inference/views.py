@@ -0,0 +1,36 @@
+"""
+同一件 item 多視角的分類結果彙整（/analyze 的 stage1/stage2）
+"""
+
+NON_DEFECT = ("good", "unknown")
+
+
+def aggregate_views(per_view, defect_conf: float | None = None):
+    """
+    per_view 為 [(top, scores)]；回傳 (top, 平均分數, 最具代表性的視角 index)。
+    defect_conf 有值時，任一視角對某瑕疵足夠有信心就以該瑕疵為準
+    （破洞可能只在一個角度看得到）。
+    """
+    # 沒有分數的視角（推論失敗）不列入平均；其餘視角的類別必須一致
+    scored = [i for i, (_, s) in enumerate(per_view) if s]
+    if not scored:
+        return "unknown", {}, 0
+    names = list(per_view[scored[0]][1])
+    if any(set(per_view[i][1]) != set(names) for i in scored):
+        raise ValueError("views were scored with different class names")
+    mean = {c: sum(per_view[i][1][c] for i in scored) / len(scored) for c in names}
+    top = max(mean, key=mean.get)
+    view = max(scored, key=lambda i: per_view[i][1][top])
+    if defect_conf is not None and top in NON_DEFECT:
+        best = max(
+            (
+                (score, i, c)
+                for i, (_, scores) in enumerate(per_view)
+                for c, score in scores.items()
+                if c not in NON_DEFECT
+            ),
+            default=None,
+        )
+        if best and best[0] >= defect_conf:
+            top, view = best[2], best[1]
+    return top, mean, view
@@ -2,10 +2,18 @@ create table if not exists items (
   id uuid primary key default gen_random_uuid(),
   user_email text,
   image_url text,
+  thumb_url text,
+  image_sha256 text,                 -- inference/image_store.py 的內容雜湊
+  orig_width int,                    -- 前端縮圖前的原始尺寸
+  orig_height int,
+  view_count int default 1,          -- /analyze 多視角上傳的張數
   is_sneaker boolean,
   defects_json jsonb,
   suggestion text check (suggestion in ('resale','donate','recycle')),
   price_ranges_json jsonb,
+  price_source text,                 -- nn | vlm | default | human
+  degradation text default 'full',   -- full | short | cached | deferred | filled（背景補完）
+  deferred_json jsonb,               -- 尚未補完的背景 listing（prompt、影像 key），補完後清空
   listing_title_zh text,
   listing_title_en text,
   listing_desc text,
@@ -16,6 +24,19 @@ create table if not exists items (
   created_at timestamptz default now()
 );
 
+-- 既有資料庫：create table if not exists 不會補欄位，重跑本檔時在這裡補上
+alter table items add column if not exists thumb_url text;
+alter table items add column if not exists image_sha256 text;
+alter table items add column if not exists orig_width int;
+alter table items add column if not exists orig_height int;
+alter table items add column if not exists view_count int default 1;
+alter table items add column if not exists price_source text;
+alter table items add column if not exists degradation text default 'full';
+alter table items add column if not exists deferred_json jsonb;
+-- 啟動時找未補完的背景 listing
+create index if not exists items_deferred_idx on items (created_at)
+  where degradation in ('cached','deferred') and deferred_json is not null;
+
 create table if not exists logistics (
   id uuid primary key default gen_random_uuid(),
   item_id uuid references items(id) on delete cascade,
@@ -35,6 +56,9 @@ create table if not exists dataset_samples (
   stage1_conf real,
   stage2_pred text,
   stage2_conf real,
+  stage1_scores jsonb,               -- 完整類別分數，供 entropy/margin 計算
+  stage2_scores jsonb,
+  uncertainty real,
   vlm_suggestion text,
   candidate_for_training boolean default false,
   is_labeled boolean default false,
@@ -43,11 +67,17 @@ create table if not exists dataset_samples (
   created_at timestamptz default now()
 );
 
+alter table dataset_samples add column if not exists stage1_scores jsonb;
+alter table dataset_samples add column if not exists stage2_scores jsonb;
+alter table dataset_samples add column if not exists uncertainty real;
+-- 影像寫入重試用盡（inference/image_store.py）；匯出與標註略過這些樣本
+alter table dataset_samples add column if not exists image_missing boolean not null default false;
+
 create table if not exists training_runs (
   id uuid primary key default gen_random_uuid(),
   started_at timestamptz default now(),
   finished_at timestamptz,
-  status text check (status in ('running','succeeded','failed','canceled','pending_review')) default 'running',
+  status text constraint training_runs_status_check check (status in ('queued','running','succeeded','failed','canceled','pending_review')) default 'queued',
   triggered_by text,                 -- 'auto' | 'manual:<user>'
   data_count integer,
   params_json jsonb,
@@ -55,10 +85,35 @@ create table if not exists training_runs (
   artifacts jsonb,
   error_msg text,
   gate_notes text,
+  shadow_json jsonb,                 -- 候選模型影子評估彙總（一致率、延遲）
+  parent_model_id uuid,              -- warm start 來源 model_registry.id
+  parent_run_id uuid references training_runs(id) on delete cascade,  -- sweep trial 所屬的 run
+  lease_owner text,                  -- 目前執行的 worker（host:pid）
+  lease_expires_at timestamptz,
+  heartbeat_at timestamptz,
+  attempts integer default 0,
+  progress_json jsonb,
   approved_at timestamptz,
   approved_by text
 );
 
+alter table training_runs add column if not exists shadow_json jsonb;
+alter table training_runs add column if not exists parent_model_id uuid;
+alter table training_runs add column if not exists parent_run_id uuid
+  references training_runs(id) on delete cascade;
+alter table training_runs add column if not exists lease_owner text;
+alter table training_runs add column if not exists lease_expires_at timestamptz;
+alter table training_runs add column if not exists heartbeat_at timestamptz;
+alter table training_runs add column if not exists attempts integer default 0;
+alter table training_runs add column if not exists progress_json jsonb;
+
+create index if not exists idx_training_runs_started_id
+  on training_runs(started_at desc, id desc);
+create index if not exists idx_training_runs_status
+  on training_runs(status, started_at desc);
+create index if not exists idx_training_runs_parent
+  on training_runs(parent_run_id) where parent_run_id is not null;
+
 create table if not exists model_registry (
   id uuid primary key default gen_random_uuid(),
   created_at timestamptz default now(),
@@ -70,6 +125,20 @@ create table if not exists model_registry (
   approved_by text
 );
 
+-- 正式模型依 stage 查詢（approve_run 取自 training_runs.params_json.stage），
+-- 不依 model_name；既有資料依名稱補上
+alter table model_registry add column if not exists stage text;
+update model_registry
+   set stage = case when model_name ilike '%stage1%' then 'stage1'
+                    when model_name ilike '%stage2%' then 'stage2' end
+ where stage is null;
+create index if not exists idx_model_registry_stage
+  on model_registry(stage, created_at desc);
+
+alter table training_runs drop constraint if exists training_runs_parent_model_fk;
+alter table training_runs add constraint training_runs_parent_model_fk
+  foreign key (parent_model_id) references model_registry(id) on delete set null;
+
 create table if not exists system_flags (
   key text primary key,
   value jsonb
@@ -86,6 +155,307 @@ insert into system_flags(key, value) values
 ('auto_train_threshold', '{"min_new_samples":200,"min_label_ratio":0.7}')
 on conflict (key) do nothing;
 
+insert into system_flags(key, value) values
+('approval_gate', '{"max_acc_drop":0.0,"max_f1_drop":0.01,"latency_budget_ms":150,"max_latency_regression":0.2}')
+on conflict (key) do nothing;
+
 insert into system_flags(key, value) values
 ('cold_start_required', '{"enabled":true,"min_samples":80,"min_label_ratio":0.9}')
-on conflict (key) do nothing;
\ No newline at end of file
+on conflict (key) do nothing;
+
+-- dataset_samples 的增量統計：由 trigger 維護，門檻檢查只需讀一列
+create table if not exists dataset_stats (
+  key text primary key,
+  total bigint not null default 0,
+  labeled bigint not null default 0,
+  candidates bigint not null default 0,
+  updated_at timestamptz default now()
+);
+
+create table if not exists dataset_label_counts (
+  stage text not null check (stage in ('stage1','stage2')),
+  label text not null,
+  n bigint not null default 0,
+  primary key (stage, label)
+);
+
+insert into dataset_stats(key) values ('all') on conflict (key) do nothing;
+
+create or replace function bump_label_count(p_stage text, p_label text, p_delta int)
+returns void language sql as $$
+  insert into dataset_label_counts(stage, label, n) values (p_stage, p_label, p_delta)
+  on conflict (stage, label) do update set n = dataset_label_counts.n + excluded.n;
+$$;
+
+create or replace function dataset_samples_stats_trg()
+returns trigger language plpgsql as $$
+declare
+  d_total int := 0;
+  d_labeled int := 0;
+  d_cand int := 0;
+begin
+  if tg_op in ('UPDATE','DELETE') then
+    d_total := d_total - 1;
+    d_labeled := d_labeled - (coalesce(old.is_labeled, false))::int;
+    d_cand := d_cand - (coalesce(old.candidate_for_training, false))::int;
+    if coalesce(old.is_labeled, false) then
+      if old.label_stage1 is not null then perform bump_label_count('stage1', old.label_stage1, -1); end if;
+      if old.label_stage2 is not null then perform bump_label_count('stage2', old.label_stage2, -1); end if;
+    end if;
+  end if;
+  if tg_op in ('INSERT','UPDATE') then
+    d_total := d_total + 1;
+    d_labeled := d_labeled + (coalesce(new.is_labeled, false))::int;
+    d_cand := d_cand + (coalesce(new.candidate_for_training, false))::int;
+    if coalesce(new.is_labeled, false) then
+      if new.label_stage1 is not null then perform bump_label_count('stage1', new.label_stage1, 1); end if;
+      if new.label_stage2 is not null then perform bump_label_count('stage2', new.label_stage2, 1); end if;
+    end if;
+  end if;
+  if d_total <> 0 or d_labeled <> 0 or d_cand <> 0 then
+    update dataset_stats
+       set total = total + d_total,
+           labeled = labeled + d_labeled,
+           candidates = candidates + d_cand,
+           updated_at = now()
+     where key = 'all';
+  end if;
+  return null;
+end $$;
+
+drop trigger if exists trg_dataset_samples_stats on dataset_samples;
+create trigger trg_dataset_samples_stats
+after insert or delete or update of is_labeled, candidate_for_training, label_stage1, label_stage2
+on dataset_samples for each row execute function dataset_samples_stats_trg();
+
+-- 一致性重建：python training/pipeline.py --rebuild-stats
+create or replace function rebuild_dataset_stats()
+returns dataset_stats language plpgsql as $$
+declare
+  r dataset_stats;
+begin
+  lock table dataset_samples in share mode;
+  insert into dataset_stats(key) values ('all') on conflict (key) do nothing;
+  update dataset_stats s
+     set total = c.total, labeled = c.labeled, candidates = c.candidates, updated_at = now()
+    from (
+      select count(*) as total,
+             count(*) filter (where is_labeled) as labeled,
+             count(*) filter (where candidate_for_training) as candidates
+        from dataset_samples
+    ) c
+   where s.key = 'all'
+  returning s.* into r;
+  delete from dataset_label_counts;
+  insert into dataset_label_counts(stage, label, n)
+    select 'stage1', label_stage1, count(*) from dataset_samples
+     where is_labeled and label_stage1 is not null group by label_stage1
+    union all
+    select 'stage2', label_stage2, count(*) from dataset_samples
+     where is_labeled and label_stage2 is not null group by label_stage2;
+  return r;
+end $$;
+
+-- 既有資料庫：trigger 只記錄之後的變動，先以現有資料重建一次
+select rebuild_dataset_stats();
+
+create index if not exists idx_dataset_samples_uncertainty
+  on dataset_samples(uncertainty desc) where not is_labeled;
+
+-- training/scoring.py 批次寫回不確定度與本輪選中的標註批次
+create or replace function apply_candidate_scores(p_ids uuid[], p_scores real[])
+returns void language sql as $$
+  update dataset_samples d
+     set uncertainty = u.score
+    from unnest(p_ids, p_scores) as u(id, score)
+   where d.id = u.id;
+$$;
+
+create or replace function select_candidates(p_ids uuid[])
+returns void language sql as $$
+  update dataset_samples
+     set candidate_for_training = (id = any(p_ids))
+   where not is_labeled
+     and candidate_for_training is distinct from (id = any(p_ids));
+$$;
+
+-- 訓練 worker：領取 queued 或 lease 已過期的 run（見 training/worker.py）
+alter table training_runs drop constraint if exists training_runs_status_check;
+alter table training_runs add constraint training_runs_status_check
+  check (status in ('queued','running','succeeded','failed','canceled','pending_review'));
+alter table training_runs alter column status set default 'queued';
+
+create index if not exists idx_training_runs_claim
+  on training_runs(status, started_at) where status in ('queued','running');
+
+create or replace function claim_training_run(p_worker text, p_lease_s int, p_run_id uuid default null)
+returns setof training_runs language plpgsql as $$
+declare
+  r training_runs;
+begin
+  select * into r from training_runs
+   where parent_run_id is null
+     and (p_run_id is null or id = p_run_id)
+     and (status = 'queued'
+          or (status = 'running' and lease_expires_at < now())
+          -- 指定 run_id（manual-train）時也可重跑沒有 lease 的 running/failed
+          or (p_run_id is not null and status in ('running','failed')
+              and (lease_expires_at is null or lease_expires_at < now())))
+   order by started_at
+   for update skip locked
+   limit 1;
+  if not found then
+    return;
+  end if;
+  update training_runs
+     set status = 'running',
+         lease_owner = p_worker,
+         lease_expires_at = now() + make_interval(secs => p_lease_s),
+         heartbeat_at = now(),
+         attempts = coalesce(attempts, 0) + 1
+   where id = r.id
+  returning * into r;
+  return next r;
+end $$;
+
+create or replace function heartbeat_training_run(p_id uuid, p_worker text, p_lease_s int, p_progress jsonb)
+returns boolean language plpgsql as $$
+begin
+  update training_runs
+     set lease_expires_at = now() + make_interval(secs => p_lease_s),
+         heartbeat_at = now(),
+         progress_json = coalesce(p_progress, progress_json)
+   where id = p_id and lease_owner = p_worker and status = 'running';
+  return found;
+end $$;
+
+-- 物流掃描：append-only 事件表 + 每個 item 的最新狀態（見 inference/scans.py）
+-- logistics.scan_events_json 保留給舊資料，新的掃描不再寫入該陣列
+create table if not exists scan_events (
+  id bigserial primary key,
+  event_id text unique not null,     -- 手持裝置產生，重送時去重
+  item_id uuid references items(id) on delete cascade,
+  status text not null check (status in ('received','sorted','packed','shipped','delivered','donated','recycled')),
+  location text,
+  device_id text,
+  scanned_at timestamptz not null,
+  received_at timestamptz default now()
+);
+
+create index if not exists idx_scan_events_item
+  on scan_events(item_id, scanned_at desc);
+
+create table if not exists logistics_status (
+  item_id uuid primary key references items(id) on delete cascade,
+  status text not null,
+  location text,
+  scanned_at timestamptz not null,
+  scan_count int not null default 0,
+  updated_at timestamptz default now()
+);
+
+create or replace function ingest_scan_events(p_events jsonb)
+returns int language plpgsql as $$
+declare
+  n int;
+begin
+  with ins as (
+    insert into scan_events(event_id, item_id, status, location, device_id, scanned_at)
+    select e->>'event_id', (e->>'item_id')::uuid, e->>'status', e->>'location',
+           e->>'device_id', (e->>'scanned_at')::timestamptz
+      from jsonb_array_elements(p_events) e
+    on conflict (event_id) do nothing
+    returning item_id, status, location, scanned_at
+  ), latest as (
+    select distinct on (item_id) item_id, status, location, scanned_at,
+           count(*) over (partition by item_id) as cnt
+      from ins
+     order by item_id, scanned_at desc
+  ), up as (
+    insert into logistics_status as s(item_id, status, location, scanned_at, scan_count)
+    select item_id, status, location, scanned_at, cnt from latest
+    on conflict (item_id) do update
+      set status = case when excluded.scanned_at >= s.scanned_at then excluded.status else s.status end,
+          location = case when excluded.scanned_at >= s.scanned_at then excluded.location else s.location end,
+          scanned_at = greatest(s.scanned_at, excluded.scanned_at),
+          scan_count = s.scan_count + excluded.scan_count,
+          updated_at = now()
+    returning 1
+  )
+  select count(*) into n from ins;
+  return n;
+end $$;
+
+-- admin 分析：依 created_at 分桶的部分聚合（見 inference/analytics.py）
+-- kind: cm1/cm2 = (預測, 標註) 混淆矩陣；conf1/conf2/blur = 直方圖 bin；sugg = 建議分佈
+-- 每桶約 90 列，會超過 PostgREST max-rows；呼叫端依 (bucket, kind, a, b) 排序分頁
+create index if not exists idx_dataset_samples_created
+  on dataset_samples(created_at);
+
+create or replace function sample_analytics(
+  p_from timestamptz, p_to timestamptz, p_bucket text default 'day', p_bins int default 20)
+returns table(bucket timestamptz, kind text, a text, b text, n bigint)
+language sql stable as $$
+  with s as materialized (
+    select date_trunc(p_bucket, created_at) as bucket,
+           stage1_pred, label_stage1, stage1_conf,
+           stage2_pred, label_stage2, stage2_conf,
+           blur_score, vlm_suggestion
+      from dataset_samples
+     where created_at >= p_from and created_at < p_to
+  )
+  select bucket, 'cm1', stage1_pred, label_stage1, count(*) from s
+   where label_stage1 is not null group by 1, 3, 4
+  union all
+  select bucket, 'cm2', coalesce(stage2_pred, 'good'), label_stage2, count(*) from s
+   where label_stage2 is not null group by 1, 3, 4
+  union all
+  select bucket, 'conf1', width_bucket(stage1_conf, 0, 1.000001, p_bins)::text, null, count(*) from s
+   where stage1_conf is not null group by 1, 3
+  union all
+  select bucket, 'conf2', width_bucket(stage2_conf, 0, 1.000001, p_bins)::text, null, count(*) from s
+   where stage2_conf is not null group by 1, 3
+  union all
+  -- blur（Laplacian 變異數）跨好幾個數量級，以 ln(1+x) 分 bin，上限 ln(1+e^8)
+  select bucket, 'blur', least(width_bucket(ln(1 + greatest(blur_score, 0)), 0, 8, p_bins), p_bins)::text,
+         null, count(*) from s
+   where blur_score is not null group by 1, 3
+  union all
+  select bucket, 'sugg', coalesce(vlm_suggestion, 'none'), null, count(*) from s group by 1, 3;
+$$;
+
+-- 新模型核可後的重新評分（training/backfill.py）：整批寫回預測與不確定度
+create or replace function apply_sample_predictions(p_rows jsonb)
+returns int language plpgsql as $$
+declare
+  n int;
+begin
+  update dataset_samples d
+     set stage1_pred = r.stage1_pred,
+         stage1_conf = r.stage1_conf,
+         stage1_scores = r.stage1_scores,
+         stage2_pred = r.stage2_pred,
+         stage2_conf = r.stage2_conf,
+         stage2_scores = r.stage2_scores,
+         uncertainty = r.uncertainty
+    from jsonb_to_recordset(p_rows) as r(
+      id uuid, stage1_pred text, stage1_conf real, stage1_scores jsonb,
+      stage2_pred text, stage2_conf real, stage2_scores jsonb, uncertainty real)
+   where d.id = r.id;
+  get diagnostics n = row_count;
+  return n;
+end $$;
+
+-- inference/image_store.py 預設寫入的 bucket（training/exporter.py 的 STORAGE_BUCKET）；
+-- thumb_url 等以公開 URL 提供。訓練直接使用這些檔案，只有推論服務（service role）
+-- 可以寫入；鍵由內容決定，不需要也不允許覆寫（沒有 update policy）
+insert into storage.buckets (id, name, public) values ('samples', 'samples', true)
+on conflict (id) do nothing;
+
+drop policy if exists samples_read on storage.objects;
+create policy samples_read on storage.objects for select
+  using (bucket_id = 'samples');
+drop policy if exists samples_write on storage.objects;
+create policy samples_write on storage.objects for insert to service_role
+  with check (bucket_id = 'samples');
+drop policy if exists samples_update on storage.objects;
@@ -3,8 +3,13 @@
 在 VS Code 中可以直接執行或調試此腳本
 """
 
+import json
+import multiprocessing as mp
 import os
 import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from roboflow import Roboflow
 from ultralytics import YOLO
@@ -13,6 +18,16 @@ from ultralytics import YOLO
 ROOT_DIR = Path(__file__).parent.parent
 MODELS_DIR = ROOT_DIR / "inference" / "models"
 
+# 與 training/pipeline.py 共用資料集快取
+sys.path.insert(0, str(ROOT_DIR / "training"))
+from dataset_cache import dataset_dir, get_or_fetch  # noqa: E402
+
+BASE_WEIGHTS = 'yolov8n-cls.pt'
+
+# 從頭訓練 vs. 從目前部署模型 warm start 的排程
+FULL_SCHEDULE = {'epochs': 100, 'patience': 10}
+INCREMENTAL_SCHEDULE = {'epochs': 20, 'patience': 5, 'lr0': 0.0005, 'warmup_epochs': 0}
+
 def setup_roboflow(api_key: str = None):
     """設定 Roboflow 連接"""
     if api_key:
@@ -21,25 +36,54 @@ def setup_roboflow(api_key: str = None):
         rf = Roboflow()  # 公開專案不需要 API key
     return rf
 
-def train_stage1(rf, workspace: str, project_name: str, version: int = 1):
+def download_dataset(rf, workspace: str, project_name: str, version: int,
+                     offline: bool = False):
+    """下載 Roboflow 資料集到版本化快取；已快取且未損毀時直接使用"""
+    path = dataset_dir("roboflow", workspace, project_name, f"v{version}")
+
+    def fetch(tmp):
+        project = rf.workspace(workspace).project(project_name)
+        project.version(version).download("yolov8", location=str(tmp), overwrite=True)
+
+    meta = {"source": "roboflow", "workspace": workspace,
+            "project": project_name, "version": version}
+    path, hit = get_or_fetch(path, fetch, meta, offline=offline)
+    print(f"{'📦 使用快取' if hit else '⬇️  已下載'}資料集: {path}")
+    return path
+
+def init_weights(model_name: str, incremental: bool):
+    """選擇初始權重與排程：incremental 且已有部署模型時 warm start"""
+    deployed = MODELS_DIR / f'{model_name}.pt'
+    if incremental and deployed.exists():
+        print(f"♻️  Warm start 自 {deployed}")
+        return str(deployed), INCREMENTAL_SCHEDULE
+    if incremental:
+        print(f"⚠️  找不到 {deployed}，改為從 {BASE_WEIGHTS} 完整訓練")
+    return BASE_WEIGHTS, FULL_SCHEDULE
+
+def train_stage1(rf, workspace: str, project_name: str, version: int = 1,
+                 incremental: bool = False, offline: bool = False,
+                 resources: dict = None, on_epoch=None):
     """訓練 Stage 1: Sneaker vs Non-sneaker"""
     print("🚀 開始訓練 Stage 1: Sneaker/Non-sneaker 分類...")
     
-    # 下載資料集
-    project = rf.workspace(workspace).project(project_name)
-    dataset = project.version(version).download("yolov8")
+    # 下載資料集（有快取就不重抓）
+    data_dir = download_dataset(rf, workspace, project_name, version, offline)
     
-    # 載入預訓練模型
-    model = YOLO('yolov8n-cls.pt')
+    # 載入預訓練模型（incremental 時從目前部署的模型接續）
+    weights, schedule = init_weights('stage1_sneaker_cls', incremental)
+    model = YOLO(weights)
+    if on_epoch:
+        model.add_callback('on_fit_epoch_end', on_epoch)
     
-    # 訓練參數
+    # 訓練參數（resources: 平行訓練時分配到的 device / dataloader workers）
     train_args = {
-        'data': dataset.location,
-        'epochs': 100,
+        'data': str(data_dir),
         'imgsz': 640,
         'batch': 16,
         'name': 'stage1_sneaker_cls',
-        'patience': 10,
+        **schedule,
+        **(resources or {}),
         'save': True,
         'plots': True,
         'val': True,
@@ -55,25 +99,29 @@ def train_stage1(rf, workspace: str, project_name: str, version: int = 1):
     
     return model, results, metrics
 
-def train_stage2(rf, workspace: str, project_name: str, version: int = 1):
+def train_stage2(rf, workspace: str, project_name: str, version: int = 1,
+                 incremental: bool = False, offline: bool = False,
+                 resources: dict = None, on_epoch=None):
     """訓練 Stage 2: 瑕疵檢測"""
     print("🚀 開始訓練 Stage 2: 瑕疵檢測分類...")
     
-    # 下載資料集
-    project = rf.workspace(workspace).project(project_name)
-    dataset = project.version(version).download("yolov8")
+    # 下載資料集（有快取就不重抓）
+    data_dir = download_dataset(rf, workspace, project_name, version, offline)
     
-    # 載入預訓練模型
-    model = YOLO('yolov8n-cls.pt')
+    # 載入預訓練模型（incremental 時從目前部署的模型接續）
+    weights, schedule = init_weights('stage2_defects_cls', incremental)
+    model = YOLO(weights)
+    if on_epoch:
+        model.add_callback('on_fit_epoch_end', on_epoch)
     
-    # 訓練參數
+    # 訓練參數（resources: 平行訓練時分配到的 device / dataloader workers）
     train_args = {
-        'data': dataset.location,
-        'epochs': 100,
+        'data': str(data_dir),
         'imgsz': 640,
         'batch': 16,
         'name': 'stage2_defects_cls',
-        'patience': 10,
+        **schedule,
+        **(resources or {}),
         'save': True,
         'plots': True,
         'val': True,
@@ -89,6 +137,86 @@ def train_stage2(rf, workspace: str, project_name: str, version: int = 1):
     
     return model, results, metrics
 
+def plan_resources(n_jobs: int = 2):
+    """把 CPU 核心、dataloader workers 與 GPU 分給同時進行的訓練"""
+    import torch
+
+    cores = os.cpu_count() or 1
+    threads = max(1, cores // n_jobs)
+    gpus = torch.cuda.device_count() if torch.cuda.is_available() else 0
+    plans = []
+    for i in range(n_jobs):
+        # 多張 GPU 各分一張；只有一張時共用（兩個 nano 分類模型放得下）
+        device = str(i % gpus) if gpus else 'cpu'
+        plans.append({'threads': threads, 'device': device,
+                      'workers': max(1, min(8, threads // 2))})
+    return plans
+
+def _stage_worker(stage: int, config: dict, plan: dict, progress):
+    """子行程：限制執行緒數後訓練單一 stage，回傳可序列化的摘要"""
+    import torch
+    torch.set_num_threads(plan['threads'])
+
+    def on_epoch(trainer):
+        top1 = (trainer.metrics or {}).get('metrics/accuracy_top1')
+        progress.put((stage, trainer.epoch + 1, trainer.epochs, top1))
+
+    rf = None if config["offline"] else setup_roboflow(config["api_key"])
+    train = train_stage1 if stage == 1 else train_stage2
+    t0 = time.time()
+    _, _, metrics = train(
+        rf, config["workspace"], config[f"stage{stage}_project"], config["version"],
+        incremental=config["incremental"], offline=config["offline"],
+        resources={'device': plan['device'], 'workers': plan['workers']},
+        on_epoch=on_epoch
+    )
+    return {'stage': stage, 'top1': float(metrics.top1), 'top5': float(metrics.top5),
+            'seconds': round(time.time() - t0, 1), **plan}
+
+def train_parallel(config: dict):
+    """同時訓練 Stage 1 與 Stage 2，彙整進度與指標成一份報告"""
+    plans = plan_resources(2)
+    # spawn 的子行程重新 import 本模組（連帶 torch）後才執行 _stage_worker，
+    # OpenMP/MKL 執行緒數只能在父行程啟動子行程前用環境變數傳入
+    thread_vars = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+    saved = {var: os.environ.get(var) for var in thread_vars}
+    for var in thread_vars:
+        os.environ[var] = str(plans[0]['threads'])
+    ctx = mp.get_context('spawn')
+    manager = ctx.Manager()
+    progress = manager.Queue()
+    report = {'stages': {}, 'errors': {}}
+    t0 = time.time()
+    with ProcessPoolExecutor(max_workers=2, mp_context=ctx) as pool:
+        futs = {pool.submit(_stage_worker, st, config, plans[st - 1], progress): st
+                for st in (1, 2)}
+        state = {}
+        while any(not f.done() for f in futs):
+            try:
+                st, epoch, epochs, top1 = progress.get(timeout=5)
+            except Exception:
+                continue
+            state[st] = f"S{st} {epoch}/{epochs}" + (f" top1={top1:.3f}" if top1 else "")
+            print("⏳ " + " | ".join(state[k] for k in sorted(state)))
+        for f, st in futs.items():
+            try:
+                report['stages'][st] = f.result()
+            except Exception as e:
+                report['errors'][st] = str(e)
+    manager.shutdown()
+    for var, val in saved.items():
+        if val is None:
+            os.environ.pop(var, None)
+        else:
+            os.environ[var] = val
+    report['wall_seconds'] = round(time.time() - t0, 1)
+    report['sum_seconds'] = sum(r['seconds'] for r in report['stages'].values())
+    out = ROOT_DIR / 'runs' / 'classify' / 'parallel_report.json'
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"📊 平行訓練報告: {out}")
+    return report
+
 def save_models():
     """儲存訓練好的模型到 inference/models/"""
     MODELS_DIR.mkdir(parents=True, exist_ok=True)
@@ -134,46 +262,72 @@ def test_models():
     
     return stage1_model, stage2_model
 
-def main():
-    """主函數"""
-    # 配置 - 請修改為您的實際專案資訊
-    CONFIG = {
-        "api_key": None,  # 如果是私有專案，請填入您的 API key
-        "workspace": "YOUR_WORKSPACE_NAME",
-        "stage1_project": "sneaker-classification",
-        "stage2_project": "shoe-defects",
-        "version": 1
-    }
-    
-    print("🎯 開始兩階段模型訓練...")
-    print(f"📁 專案根目錄: {ROOT_DIR}")
-    print(f"📁 模型儲存目錄: {MODELS_DIR}")
-    
-    # 設定 Roboflow
-    try:
-        rf = setup_roboflow(CONFIG["api_key"])
-        print("✅ Roboflow 連接成功")
-    except Exception as e:
-        print(f"❌ Roboflow 連接失敗: {e}")
-        return
+def train_sequential(CONFIG: dict) -> bool:
+    """依序訓練 Stage 1、Stage 2"""
+    # 設定 Roboflow（offline 時只用快取）
+    rf = None
+    if CONFIG["offline"]:
+        print("📴 Offline 模式：使用本地資料集快取")
+    else:
+        try:
+            rf = setup_roboflow(CONFIG["api_key"])
+            print("✅ Roboflow 連接成功")
+        except Exception as e:
+            print(f"❌ Roboflow 連接失敗: {e}")
+            return False
     
     # 訓練 Stage 1
     try:
         model_stage1, results_stage1, metrics_stage1 = train_stage1(
-            rf, CONFIG["workspace"], CONFIG["stage1_project"], CONFIG["version"]
+            rf, CONFIG["workspace"], CONFIG["stage1_project"], CONFIG["version"],
+            incremental=CONFIG["incremental"], offline=CONFIG["offline"]
         )
     except Exception as e:
         print(f"❌ Stage 1 訓練失敗: {e}")
-        return
+        return False
     
     # 訓練 Stage 2
     try:
         model_stage2, results_stage2, metrics_stage2 = train_stage2(
-            rf, CONFIG["workspace"], CONFIG["stage2_project"], CONFIG["version"]
+            rf, CONFIG["workspace"], CONFIG["stage2_project"], CONFIG["version"],
+            incremental=CONFIG["incremental"], offline=CONFIG["offline"]
         )
     except Exception as e:
         print(f"❌ Stage 2 訓練失敗: {e}")
-        return
+        return False
+    
+    return True
+
+def main():
+    """主函數"""
+    # 配置 - 請修改為您的實際專案資訊
+    CONFIG = {
+        "api_key": None,  # 如果是私有專案，請填入您的 API key
+        "workspace": "YOUR_WORKSPACE_NAME",
+        "stage1_project": "sneaker-classification",
+        "stage2_project": "shoe-defects",
+        "version": 1,
+        "incremental": False,  # True: 從 inference/models/ 的現有模型 warm start
+        "offline": os.getenv("DATASET_OFFLINE") == "1",  # 只用本地快取，不連 Roboflow
+        "parallel": True  # 同時訓練兩個 stage（各自分配 CPU/GPU）
+    }
+    
+    print("🎯 開始兩階段模型訓練...")
+    print(f"📁 專案根目錄: {ROOT_DIR}")
+    print(f"📁 模型儲存目錄: {MODELS_DIR}")
+    
+    if CONFIG["parallel"]:
+        # 兩個 stage 互相獨立，同時訓練；總時間接近較慢的那一個
+        report = train_parallel(CONFIG)
+        for st, err in report['errors'].items():
+            print(f"❌ Stage {st} 訓練失敗: {err}")
+        if report['errors']:
+            return
+        for st, r in sorted(report['stages'].items()):
+            print(f"✅ Stage {st} 準確率: {r['top1']:.3f}（{r['seconds']}s, device={r['device']}）")
+    else:
+        if not train_sequential(CONFIG):
+            return
     
     # 儲存模型
     save_models()
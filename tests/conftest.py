@@ -0,0 +1,11 @@
+"""
+測試共用設定：inference 以套件匯入，training 的模組彼此以平面方式匯入
+"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+for p in (ROOT, ROOT / "training"):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
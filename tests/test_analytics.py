@@ -0,0 +1,136 @@
+"""
+admin 分析：RPC 分頁、時間桶快取與混淆矩陣
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from inference.analytics import BINS, SampleAnalytics, _matrix
+
+DAY = timedelta(days=1)
+T0 = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+class FakeRPC:
+    """模擬 PostgREST：依 order() 排序、range() 分頁，並套用 max-rows 截斷"""
+
+    def __init__(self, sb, params):
+        self.sb, self.params, self.keys, self.lo, self.hi = sb, params, [], 0, None
+
+    def order(self, key):
+        self.keys.append(key)
+        return self
+
+    def range(self, lo, hi):
+        self.lo, self.hi = lo, hi
+        return self
+
+    def execute(self):
+        lo, hi = _parse(self.params["p_from"]), _parse(self.params["p_to"])
+        rows = [r for r in self.sb.rows if lo <= _parse(r["bucket"]) < hi]
+        rows.sort(key=lambda r: tuple(str(r[k]) for k in self.keys))
+        end = len(rows) if self.hi is None else self.hi + 1
+        self.sb.calls.append(self.params)
+        self.data = rows[self.lo : min(end, self.lo + self.sb.max_rows)]
+        return self
+
+
+class FakeSB:
+    def __init__(self, rows, max_rows=1000):
+        self.rows, self.max_rows, self.calls = rows, max_rows, []
+
+    def rpc(self, name, params):
+        assert name == "sample_analytics"
+        return FakeRPC(self, params)
+
+
+def _parse(v):
+    return datetime.fromisoformat(v)
+
+
+def day_rows(day, n_sugg=90):
+    """一個日桶：一筆 stage1 混淆矩陣格、一個信心 bin，其餘為建議分佈"""
+    b = (T0 + day * DAY).isoformat()
+    rows = [
+        {"bucket": b, "kind": "cm1", "a": "sneaker", "b": "sneaker", "n": 3},
+        {"bucket": b, "kind": "conf1", "a": str(BINS), "b": None, "n": 2},
+    ]
+    rows += [
+        {"bucket": b, "kind": "sugg", "a": f"s{i:03d}", "b": None, "n": 1}
+        for i in range(n_sugg)
+    ]
+    return rows
+
+
+class TestFetch:
+    """分頁與桶快取測試"""
+
+    def test_pages_past_max_rows(self):
+        """30 天約 2.7k 列，超過 max-rows 時仍取回完整結果"""
+        rows = [r for d in range(30) for r in day_rows(d)]
+        sb = FakeSB(rows)
+        analytics = SampleAnalytics(sb)
+        report = analytics.report(T0, T0 + 30 * DAY)
+        assert len(sb.calls) == 3
+        assert report["confusion"]["stage1"]["n"] == 90
+        assert report["histograms"]["stage1_conf"]["counts"][-1] == 60
+        assert all(len(m) == 91 for m in report["suggestions"])
+
+    def test_exact_multiple_of_page(self):
+        """剛好整頁時再取一次，拿到空頁才停"""
+        sb = FakeSB(day_rows(0, n_sugg=8), max_rows=1000)
+        analytics = SampleAnalytics(sb, page_size=5)
+        analytics.report(T0, T0 + DAY)
+        assert len(sb.calls) == 3
+
+    def test_cached_buckets_not_refetched(self):
+        """已快取的桶不再查詢，只對缺少的桶發 RPC，結果與完整查詢相同"""
+        sb = FakeSB([r for d in range(4) for r in day_rows(d, n_sugg=2)])
+        analytics = SampleAnalytics(sb)
+        first = analytics.report(T0, T0 + 2 * DAY)
+        assert first["confusion"]["stage1"]["n"] == 6
+        sb.calls.clear()
+        merged = analytics.report(T0, T0 + 4 * DAY)
+        assert len(sb.calls) == 1
+        assert sb.calls[0]["p_from"] == (T0 + 2 * DAY).isoformat()
+        assert merged["confusion"]["stage1"]["n"] == 12
+        assert [m["bucket"] for m in merged["suggestions"]] == [
+            (T0 + d * DAY).isoformat() for d in range(4)
+        ]
+        fresh = SampleAnalytics(FakeSB(sb.rows)).report(T0, T0 + 4 * DAY)
+        assert merged == fresh
+        st = analytics.summary()
+        assert (st["bucket_hits"], st["bucket_misses"]) == (2, 4)
+
+    def test_closed_bucket_expires(self):
+        sb = FakeSB(day_rows(0, n_sugg=1))
+        analytics = SampleAnalytics(sb, closed_ttl_s=0)
+        analytics.report(T0, T0 + DAY)
+        analytics.report(T0, T0 + DAY)
+        assert len(sb.calls) == 2
+
+    def test_empty_bucket_cached(self):
+        sb = FakeSB([])
+        analytics = SampleAnalytics(sb)
+        analytics.report(T0, T0 + DAY)
+        report = analytics.report(T0, T0 + DAY)
+        assert len(sb.calls) == 1
+        assert report["suggestions"] == [{"bucket": T0.isoformat()}]
+
+
+class TestMatrix:
+    """_matrix() 測試"""
+
+    def test_rows_are_truth_columns_are_predictions(self):
+        m = _matrix({("hole", "hole"): 3, ("hole", "good"): 1, ("good", "good"): 4})
+        assert m["labels"] == ["good", "hole"]
+        assert m["matrix"] == [[4, 0], [1, 3]]
+        assert (m["n"], m["acc"]) == (8, 0.875)
+
+    def test_label_only_seen_as_prediction(self):
+        m = _matrix({("good", "flat"): 2})
+        assert m["labels"] == ["flat", "good"]
+        assert m["matrix"] == [[0, 0], [2, 0]]
+        assert m["acc"] == 0.0
+
+    def test_empty(self):
+        assert _matrix({}) == {"labels": [], "matrix": [], "n": 0, "acc": None}
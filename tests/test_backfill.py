@@ -0,0 +1,234 @@
+"""
+新模型核可後的批次重新評分：分頁、stage2 只跑球鞋、checkpoint 接續
+"""
+
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import backfill as bf
+from exporter import ObjectCache
+
+S1_NAMES = {0: "sneaker", 1: "other"}
+S2_NAMES = {0: "good", 1: "hole", 2: "flat"}
+
+
+class Probs:
+    def __init__(self, data):
+        self.data = data
+
+
+class Result:
+    def __init__(self, probs):
+        self.probs = probs
+
+
+class FakeModel:
+    """影像內容為 "<stage1 標籤>:<stage2 標籤>"，對應標籤給 0.9"""
+
+    def __init__(self, names, field):
+        self.names, self.field = names, field
+        self.calls = []
+
+    def predict(self, paths, imgsz, verbose, batch):
+        self.calls.append(len(paths))
+        out = []
+        for p in paths:
+            label = Path(p).read_text().split(":")[self.field]
+            rest = 0.1 / (len(self.names) - 1)
+            scores = [0.9 if n == label else rest for n in self.names.values()]
+            out.append(Result(Probs(scores)))
+        return out
+
+
+class Data:
+    def __init__(self, data):
+        self.data = data
+
+    def execute(self):
+        return self
+
+
+class Query:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def select(self, columns):
+        return self
+
+    @property
+    def not_(self):
+        return self
+
+    def is_(self, col, val):
+        self.rows = [r for r in self.rows if r.get(col) is not None]
+        return self
+
+    def gt(self, col, val):
+        self.rows = [r for r in self.rows if r[col] > val]
+        return self
+
+    def eq(self, col, val):
+        self.rows = [r for r in self.rows if r.get(col) == val]
+        return self
+
+    def order(self, col):
+        self.rows = sorted(self.rows, key=lambda r: r[col])
+        return self
+
+    def limit(self, n):
+        self.rows = self.rows[:n]
+        return self
+
+    def execute(self):
+        return Data(self.rows)
+
+
+class FakeSB:
+    def __init__(self, samples, images):
+        self.samples, self.images = samples, images
+        self.flags, self.applied = {}, []
+        self.storage = self
+
+    def from_(self, bucket):
+        return self
+
+    def download(self, path):
+        if path not in self.images:
+            raise FileNotFoundError(path)
+        return self.images[path]
+
+    def table(self, name):
+        if name == "dataset_samples":
+            return Query([dict(r) for r in self.samples])
+        sb = self
+
+        class Flags(Query):
+            def upsert(self, row):
+                sb.flags[row["key"]] = row["value"]
+                return self
+
+        return Flags([{"key": k, "value": v} for k, v in self.flags.items()])
+
+    def rpc(self, name, params):
+        assert name == "apply_sample_predictions"
+        self.applied.extend(params["p_rows"])
+        return Data(None)
+
+
+class InlinePool(ThreadPoolExecutor):
+    """取代 ProcessPoolExecutor：同一個行程內執行，initializer 照跑"""
+
+    def __init__(self, max_workers, mp_context=None, initializer=None, initargs=()):
+        super().__init__(1, initializer=initializer, initargs=initargs)
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    models = {}
+
+    def init(weights, threads):
+        for stage in weights:
+            names, field = (S1_NAMES, 0) if stage == "stage1" else (S2_NAMES, 1)
+            bf._models[stage] = models[stage] = FakeModel(names, field)
+
+    monkeypatch.setattr(bf, "_init_worker", init)
+    monkeypatch.setattr(bf, "ProcessPoolExecutor", InlinePool)
+    monkeypatch.setattr(bf, "ObjectCache", lambda: ObjectCache(tmp_path))
+    monkeypatch.setattr(bf, "iter_pages", functools.partial(bf.iter_pages, page_size=2))
+    return models
+
+
+def make_sb(labels, missing=()):
+    samples, images = [], {}
+    for i, label in enumerate(labels):
+        path = f"s/{i}.jpg"
+        samples.append({"id": f"{i:03d}", "image_path": path, "stage1_pred": None})
+        if i not in missing:
+            images[path] = label.encode()
+    return FakeSB(samples, images)
+
+
+WEIGHTS = {"stage1": "s1.pt", "stage2": "s2.pt"}
+MODELS = {"stage1": "m1", "stage2": "m2"}
+
+
+class TestBackfill:
+    """backfill() 測試"""
+
+    def test_rescores_all_pages(self, env):
+        labels = ["sneaker:hole", "other:good", "sneaker:good", "sneaker:flat", "x:x"]
+        sb = make_sb(labels, missing={4})
+        out = bf.backfill(sb, WEIGHTS, MODELS, max_duty=1.0)
+        assert out["done"] and out["processed"] == 4 and out["skipped"] == 1
+        rows = {r["id"]: r for r in sb.applied}
+        assert set(rows) == {"000", "001", "002", "003"}
+        assert rows["000"]["stage2_pred"] == "hole"
+        assert rows["000"]["stage2_conf"] == pytest.approx(0.9)
+        # 非球鞋清空 stage2；good 不算瑕疵但保留分數
+        assert rows["001"]["stage1_pred"] == "other"
+        assert rows["001"]["stage2_scores"] is None
+        assert rows["002"]["stage2_pred"] is None
+        assert rows["002"]["stage2_scores"]["good"] == pytest.approx(0.9)
+        assert rows["003"]["stage2_pred"] == "flat"
+        assert all(
+            "image_path" not in r and 0 <= r["uncertainty"] <= 1 for r in rows.values()
+        )
+        # stage2 只對判為球鞋的樣本推論
+        assert sum(env["stage2"].calls) == 3
+        assert sb.flags[bf.FLAG_KEY]["done"]
+
+    def test_resumes_from_checkpoint(self, env):
+        sb = make_sb(["sneaker:good"] * 5)
+        first = bf.backfill(sb, WEIGHTS, MODELS, max_duty=1.0, limit=2)
+        assert (first["processed"], first["last_id"], first["done"]) == (
+            2,
+            "001",
+            False,
+        )
+        sb.applied.clear()
+        second = bf.backfill(sb, WEIGHTS, MODELS, max_duty=1.0)
+        assert [r["id"] for r in sb.applied] == ["002", "003", "004"]
+        assert second["processed"] == 5 and second["done"]
+
+    def test_stage1_only_keeps_stage2(self, env):
+        sb = make_sb(["other:good", "sneaker:hole"])
+        bf.backfill(sb, {"stage1": "s1.pt"}, {"stage1": "m1"}, max_duty=1.0)
+        assert [r["stage1_pred"] for r in sb.applied] == ["other", "sneaker"]
+        assert "stage2" not in env
+
+
+class TestCheckpoint:
+    """load_checkpoint() 測試"""
+
+    def test_other_models_start_over(self):
+        sb = make_sb([])
+        bf.save_checkpoint(
+            sb,
+            {
+                "models": {"stage2": "old"},
+                "last_id": "9",
+                "processed": 3,
+                "done": False,
+            },
+        )
+        cp = bf.load_checkpoint(sb, {"stage2": "new"})
+        assert (cp["last_id"], cp["processed"]) == (None, 0)
+
+    def test_finished_run_starts_over(self):
+        sb = make_sb([])
+        bf.save_checkpoint(
+            sb, {"models": MODELS, "last_id": "9", "processed": 3, "done": True}
+        )
+        assert bf.load_checkpoint(sb, MODELS)["last_id"] is None
+
+    def test_same_models_continue(self):
+        sb = make_sb([])
+        bf.save_checkpoint(
+            sb, {"models": MODELS, "last_id": "9", "processed": 3, "done": False}
+        )
+        cp = bf.load_checkpoint(sb, MODELS)
+        assert (cp["last_id"], cp["processed"]) == ("9", 3)
+        assert "updated_at" in sb.flags[bf.FLAG_KEY]
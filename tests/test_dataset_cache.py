@@ -0,0 +1,110 @@
+"""
+版本化資料集快取：manifest 驗證與原子性下載
+"""
+
+import json
+
+import pytest
+
+from dataset_cache import (
+    MANIFEST,
+    DatasetCacheMiss,
+    dataset_dir,
+    get_or_fetch,
+    verify,
+    write_manifest,
+)
+
+
+def fill(files):
+    """回傳把 files 寫進 tmp 目錄的 fetch(tmp)，並記錄呼叫次數"""
+    calls = []
+
+    def fetch(tmp):
+        calls.append(tmp)
+        for rel, data in files.items():
+            p = tmp / rel
+            p.parent.mkdir(parents=True, exist_ok=True)
+            p.write_bytes(data)
+
+    return fetch, calls
+
+
+FILES = {"train/good/a.jpg": b"aaaa", "val/worn/b.jpg": b"bb"}
+
+
+class TestVerify:
+    """write_manifest() / verify() 測試"""
+
+    def test_manifest_lists_files(self, tmp_path):
+        fill(FILES)[0](tmp_path)
+        mf = write_manifest(tmp_path, {"source": "roboflow"})
+        assert mf["file_count"] == 2 and mf["bytes"] == 6
+        assert set(mf["files"]) == set(FILES)
+        assert json.loads((tmp_path / MANIFEST).read_text())["source"] == "roboflow"
+        assert verify(tmp_path, checksums=True)
+
+    def test_missing_manifest_or_file(self, tmp_path):
+        fill(FILES)[0](tmp_path)
+        assert not verify(tmp_path)
+        write_manifest(tmp_path, {})
+        (tmp_path / "val/worn/b.jpg").unlink()
+        assert not verify(tmp_path)
+
+    def test_size_checked_always_content_only_with_checksums(self, tmp_path):
+        fill(FILES)[0](tmp_path)
+        write_manifest(tmp_path, {})
+        (tmp_path / "train/good/a.jpg").write_bytes(b"abcd")
+        assert verify(tmp_path)
+        assert not verify(tmp_path, checksums=True)
+        (tmp_path / "train/good/a.jpg").write_bytes(b"abc")
+        assert not verify(tmp_path)
+
+
+class TestGetOrFetch:
+    """get_or_fetch() 測試"""
+
+    def test_fetch_then_hit(self, tmp_path):
+        path = dataset_dir("roboflow", "ws", "proj", "v3", root=tmp_path)
+        fetch, calls = fill(FILES)
+        out, hit = get_or_fetch(path, fetch, {"version": 3})
+        assert (out, hit) == (path, False)
+        assert (path / "val/worn/b.jpg").read_bytes() == b"bb"
+        assert not path.with_name("v3.part").exists()
+        out, hit = get_or_fetch(path, fetch, {"version": 3})
+        assert hit and len(calls) == 1
+
+    def test_damaged_cache_refetched(self, tmp_path):
+        path = tmp_path / "ds"
+        fetch, calls = fill(FILES)
+        get_or_fetch(path, fetch, {})
+        (path / "train/good/a.jpg").write_bytes(b"")
+        _, hit = get_or_fetch(path, fetch, {})
+        assert not hit and len(calls) == 2
+        assert (path / "train/good/a.jpg").read_bytes() == b"aaaa"
+
+    def test_failed_fetch_keeps_previous(self, tmp_path):
+        path = tmp_path / "ds"
+        get_or_fetch(path, fill(FILES)[0], {})
+        (path / "train/good/a.jpg").write_bytes(b"")
+
+        def broken(tmp):
+            (tmp / "partial.jpg").write_bytes(b"x")
+            raise ConnectionError("download interrupted")
+
+        with pytest.raises(ConnectionError):
+            get_or_fetch(path, broken, {})
+        # 舊資料夾未被半成品取代
+        assert not (path / "partial.jpg").exists()
+        assert (path / MANIFEST).exists()
+
+    def test_offline_miss_raises(self, tmp_path):
+        fetch, calls = fill(FILES)
+        with pytest.raises(DatasetCacheMiss):
+            get_or_fetch(tmp_path / "ds", fetch, {}, offline=True)
+        assert calls == []
+
+    def test_offline_hit(self, tmp_path):
+        path = tmp_path / "ds"
+        get_or_fetch(path, fill(FILES)[0], {})
+        assert get_or_fetch(path, None, {}, offline=True) == (path, True)
@@ -0,0 +1,111 @@
+"""
+pHash 近重複分群：與暴力兩兩比較的結果一致
+"""
+
+import numpy as np
+import pytest
+
+from dedup import cluster, group_keys, phash_to_u64, plan_splits, popcount
+
+
+def brute_force(hashes, max_dist):
+    """兩兩比較 + union-find，回傳每個樣本的群代表（群內最小 index）。"""
+    n = len(hashes)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(n):
+        for j in range(i + 1, n):
+            if bin(int(hashes[i]) ^ int(hashes[j])).count("1") <= max_dist:
+                a, b = find(i), find(j)
+                parent[max(a, b)] = min(a, b)
+    return np.array([find(i) for i in range(n)])
+
+
+def near_duplicates(rng, n_base, copies, flips):
+    """每個基底 hash 產生數個翻轉 flips 個 bit 的變體，另外重複幾個完全相同的。"""
+    base = rng.integers(0, 2**63, size=n_base, dtype=np.uint64)
+    out = list(base)
+    for h in base:
+        for _ in range(copies):
+            bits = rng.choice(64, size=flips, replace=False)
+            mask = 0
+            for b in bits:
+                mask |= 1 << int(b)
+            out.append(np.uint64(int(h) ^ mask))
+    out.extend(base[:5])
+    out = np.array(out, dtype=np.uint64)
+    rng.shuffle(out)
+    return out
+
+
+class TestCluster:
+    """cluster() 測試"""
+
+    @pytest.mark.parametrize("max_dist", [2, 4, 8])
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    def test_matches_brute_force(self, max_dist, seed):
+        """近重複與隨機 hash 混合時，分群結果與暴力法相同"""
+        rng = np.random.default_rng(seed)
+        hashes = near_duplicates(rng, n_base=60, copies=3, flips=rng.integers(1, 7))
+        got = cluster(hashes, max_dist)
+        assert (got == brute_force(hashes, max_dist)).all()
+
+    def test_chain_is_transitive(self):
+        """A~B、B~C 但 A、C 距離超過門檻時仍為同一群"""
+        hashes = np.array([0b0, 0b1111, 0b11111111], dtype=np.uint64)
+        assert cluster(hashes, 4).tolist() == [0, 0, 0]
+
+    def test_identical_hashes(self):
+        """大量完全相同的 hash 只成一群"""
+        hashes = np.full(1000, 0xDEADBEEF, dtype=np.uint64)
+        assert (cluster(hashes) == 0).all()
+
+    def test_small_inputs(self):
+        """空輸入與單筆"""
+        assert cluster(np.array([], dtype=np.uint64)).tolist() == []
+        assert cluster(np.array([7], dtype=np.uint64)).tolist() == [0]
+
+    def test_popcount(self):
+        """popcount 與 Python bin().count 一致"""
+        x = np.array([0, 1, 2**64 - 1, 0xF0F0], dtype=np.uint64)
+        assert popcount(x).tolist() == [0, 1, 64, 8]
+
+
+class TestGroups:
+    """group_keys() / plan_splits() 測試"""
+
+    def test_near_duplicates_share_key(self):
+        """pHash 近重複的樣本共用群鍵"""
+        rows = [
+            {"id": "x", "phash": "00000000000000ff", "created_at": "1"},
+            {"id": "y", "phash": "00000000000000fe", "created_at": "2"},
+        ]
+        assert group_keys(rows) == {"x": "x", "y": "x"}
+
+    def test_item_views_share_key(self):
+        """同一 item 的不同視角（pHash 不相近）同一群，群鍵為最早的樣本"""
+        rows = [
+            {"id": "b", "phash": "ffffffffffffffff", "created_at": "2", "item_id": 1},
+            {"id": "a", "phash": "0000000000000000", "created_at": "1", "item_id": 1},
+            {"id": "c", "phash": "0f0f0f0f0f0f0f0f", "created_at": "3"},
+        ]
+        keys = group_keys(rows)
+        assert keys == {"a": "a", "b": "a", "c": "c"}
+
+    def test_drop_keeps_sharpest(self):
+        """mode=drop 每群只留 blur_score 最高的一張"""
+        rows = [
+            {"id": "x", "phash": "00000000000000ff", "blur_score": 10},
+            {"id": "y", "phash": "00000000000000fe", "blur_score": 50},
+        ]
+        plan, _ = plan_splits(rows, {"x": "x", "y": "x"}, mode="drop")
+        assert plan["x"] is None and plan["y"] in ("train", "val")
+
+    def test_phash_to_u64(self):
+        assert phash_to_u64(["ff", "0"]).tolist() == [255, 0]
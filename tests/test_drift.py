@@ -0,0 +1,91 @@
+"""
+漂移監控：PSI 與依模型版本的參考快照
+"""
+
+import random
+
+import pytest
+
+from inference.drift import BINS, PSI_ALERT, DriftMonitor, psi, quantiles
+
+
+def feed(mon, n, conf, seed=0):
+    """以信心約為 conf 的觀測餵入 monitor"""
+    rng = random.Random(seed)
+    for _ in range(n):
+        c = min(0.999, max(0.0, rng.gauss(conf, 0.05)))
+        mon.observe({"shoe": c, "other": 1 - c}, {"nike": c}, blur=rng.uniform(50, 500))
+
+
+class TestPSI:
+    """psi() / quantiles() 測試"""
+
+    def test_identical_is_zero(self):
+        assert psi([1, 2, 3, 4], [10, 20, 30, 40]) == 0.0
+
+    def test_symmetric_and_positive(self):
+        a, b = [50, 30, 20], [20, 30, 50]
+        assert psi(a, b) == psi(b, a) > PSI_ALERT
+
+    def test_known_value(self):
+        # (0.8-0.2)ln(4) + (0.2-0.8)ln(0.25)
+        assert psi([20, 80], [80, 20]) == pytest.approx(1.2 * 1.3863, abs=1e-3)
+
+    def test_empty(self):
+        assert psi([0, 0], [1, 2]) is None
+        assert psi([1, 2], [0, 0]) is None
+
+    def test_empty_bin_is_finite(self):
+        assert psi([10, 0], [5, 5]) < float("inf")
+
+    def test_quantiles(self):
+        hist = [0] * BINS
+        hist[10] = 100  # 全部落在 [0.5, 0.55)
+        q = quantiles(hist, 1.0)
+        assert 0.5 <= q["p10"] <= q["p50"] <= q["p90"] <= 0.55
+        assert quantiles([0] * BINS, 1.0) is None
+
+
+class TestDriftMonitor:
+    """DriftMonitor 測試"""
+
+    def test_auto_reference_then_alert(self, tmp_path):
+        """前 reference_n 筆自動成為參考；之後分佈偏移時發出 alert"""
+        mon = DriftMonitor(tmp_path / "ref.json", "m1", min_n=50, reference_n=100)
+        feed(mon, 99, 0.9)
+        assert mon.reference is None
+        assert mon.report()["capturing_reference"] == {"n": 99, "target": 100}
+        feed(mon, 1, 0.9)
+        assert mon.reference.n == 100
+        assert mon.reference_meta["source"] == "auto"
+        assert mon.report()["status"] == "ok"
+
+        shifted = DriftMonitor(tmp_path / "ref.json", "m1", min_n=50)
+        feed(shifted, 200, 0.4)
+        report = shifted.report()
+        assert report["status"] == "alert"
+        assert report["scores"]["stage1_conf"] >= PSI_ALERT
+
+    def test_reference_per_model(self, tmp_path):
+        """換模型版本時不沿用舊版本的參考；回滾時再拿回來"""
+        path = tmp_path / "ref.json"
+        feed(DriftMonitor(path, "m1", min_n=10, reference_n=20), 20, 0.9)
+        m2 = DriftMonitor(path, "m2", min_n=10, reference_n=20)
+        assert m2.reference is None
+        feed(m2, 20, 0.4)
+        assert m2.report()["status"] == "ok"
+        back = DriftMonitor(path, "m1", min_n=10)
+        assert back.reference.n == 20
+        assert back.reference_meta["model"] == "m1"
+
+    def test_manual_reference(self, tmp_path):
+        mon = DriftMonitor(tmp_path / "ref.json", "m1", min_n=10, reference_n=1000)
+        feed(mon, 30, 0.7)
+        meta = mon.set_reference({"by": "admin"})
+        assert meta["n"] == 30 and meta["by"] == "admin"
+        assert mon.report()["capturing_reference"] is None
+
+    def test_insufficient_data(self, tmp_path):
+        mon = DriftMonitor(tmp_path / "ref.json", "m1", min_n=50)
+        feed(mon, 10, 0.9)
+        assert mon.report()["status"] == "insufficient_data"
@@ -0,0 +1,31 @@
+"""
+holdout 評估指標
+"""
+
+import pytest
+
+from evaluate import classification_metrics
+
+
+class TestClassificationMetrics:
+    """classification_metrics() 測試"""
+
+    def test_perfect(self):
+        y = ["good", "hole", "flat"]
+        assert classification_metrics(y, y) == {"acc": 1.0, "f1": 1.0}
+
+    def test_macro_f1(self):
+        # good: P=2/3 R=1 F1=0.8；hole: P=1 R=1/2 F1=2/3
+        out = classification_metrics(
+            ["good", "good", "hole", "hole"], ["good", "good", "hole", "good"]
+        )
+        assert out["acc"] == 0.75
+        assert out["f1"] == pytest.approx((0.8 + 2 / 3) / 2, abs=1e-4)
+
+    def test_prediction_outside_truth_labels(self):
+        """預測出 holdout 沒有的類別只會降低召回，不會多出一個類別"""
+        out = classification_metrics(["good", "good"], ["good", "hole"])
+        assert out == {"acc": 0.5, "f1": pytest.approx(2 / 3, abs=1e-4)}
+
+    def test_all_wrong(self):
+        assert classification_metrics(["a", "b"], ["b", "a"]) == {"acc": 0.0, "f1": 0.0}
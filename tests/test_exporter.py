@@ -0,0 +1,113 @@
+"""
+訓練資料匯出：標籤資料夾名稱檢查與依 manifest 重建快照
+"""
+
+import hashlib
+
+import pytest
+
+from dataset_cache import verify
+from exporter import ObjectCache, restore_snapshot, safe_label
+
+IMAGES = {"a.jpg": b"image-a", "b.png": b"image-b"}
+
+
+class FakeBucket:
+    def __init__(self, data, calls):
+        self.data, self.calls = data, calls
+
+    def download(self, path):
+        self.calls.append(path)
+        if path not in self.data:
+            raise FileNotFoundError(path)
+        return self.data[path]
+
+
+class FakeSB:
+    """只提供 storage.from_(bucket).download()"""
+
+    def __init__(self, data):
+        self.data, self.calls = data, []
+        self.storage = self
+
+    def from_(self, bucket):
+        return FakeBucket(self.data, self.calls)
+
+
+def snapshot_manifest(images):
+    sources, files = {}, {}
+    for i, (path, data) in enumerate(sorted(images.items())):
+        sha = hashlib.sha256(data).hexdigest()
+        ext = path[path.rindex(".") :]
+        rel = f"{'train' if i % 2 == 0 else 'val'}/good/{sha}{ext}"
+        sources[rel] = path
+        files[rel] = {"sha256": sha, "size": len(data)}
+    classes = {"good": {"train": 1, "val": 1}}
+    return {
+        "source": "samples",
+        "stage": "stage2",
+        "classes": classes,
+        "sources": sources,
+        "files": files,
+    }
+
+
+class TestSafeLabel:
+    """safe_label() 測試"""
+
+    @pytest.mark.parametrize(
+        "label,expected", [("good", "good"), ("  worn ", "worn"), (3, "3")]
+    )
+    def test_accepted(self, label, expected):
+        assert safe_label(label) == expected
+
+    @pytest.mark.parametrize(
+        "label", [None, "", "  ", ".", "..", "a/b", "../x", "a\\b", "a\0b"]
+    )
+    def test_rejected(self, label):
+        assert safe_label(label) is None
+
+
+class TestRestoreSnapshot:
+    """restore_snapshot() 測試"""
+
+    def test_rebuilds_identical_files(self, tmp_path):
+        sb, manifest = FakeSB(IMAGES), snapshot_manifest(IMAGES)
+        out = restore_snapshot(sb, manifest, "run1", cache=ObjectCache(tmp_path))
+        root = tmp_path / "datasets" / "samples" / "run1"
+        assert out["path"] == str(root)
+        assert out["classes"] == manifest["classes"]
+        for rel, src in manifest["sources"].items():
+            assert (root / rel).read_bytes() == IMAGES[src]
+        assert verify(root, checksums=True)
+        assert sorted(sb.calls) == sorted(IMAGES)
+
+    def test_valid_snapshot_not_rebuilt(self, tmp_path):
+        manifest = snapshot_manifest(IMAGES)
+        restore_snapshot(FakeSB(IMAGES), manifest, "run1", cache=ObjectCache(tmp_path))
+        # 物件快取清空且來源不可用：只有直接沿用既有資料夾才會成功
+        empty, cache = FakeSB({}), ObjectCache(tmp_path)
+        cache.index.clear()
+        restore_snapshot(empty, manifest, "run1", cache=cache)
+        assert empty.calls == []
+
+    def test_damaged_snapshot_rebuilt_from_cache(self, tmp_path):
+        manifest = snapshot_manifest(IMAGES)
+        cache = ObjectCache(tmp_path)
+        restore_snapshot(FakeSB(IMAGES), manifest, "run1", cache=cache)
+        rel = next(iter(manifest["sources"]))
+        (tmp_path / "datasets" / "samples" / "run1" / rel).unlink()
+        sb = FakeSB(IMAGES)
+        restore_snapshot(sb, manifest, "run1", cache=ObjectCache(tmp_path))
+        assert verify(tmp_path / "datasets" / "samples" / "run1", checksums=True)
+        assert sb.calls == []  # 物件快取命中，不重新下載
+
+    def test_missing_source_raises(self, tmp_path):
+        manifest = snapshot_manifest(IMAGES)
+        with pytest.raises(RuntimeError, match="snapshot image unavailable"):
+            restore_snapshot(
+                FakeSB({"a.jpg": IMAGES["a.jpg"]}),
+                manifest,
+                "run1",
+                cache=ObjectCache(tmp_path),
+            )
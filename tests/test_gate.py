@@ -0,0 +1,71 @@
+"""
+核可把關：候選與正式模型的準確率 / F1 / 延遲比較
+"""
+
+import pytest
+
+from inference.gate import APPROVAL_GATE, gate_failures, run_stage
+
+
+def ev(cand, prod=None, **extra):
+    return {"eval": {"candidate": cand, "production": prod, **extra}}
+
+
+def model(acc, f1, p95=None):
+    out = {"acc": acc, "f1": f1}
+    if p95 is not None:
+        out["latency"] = {"bs1": {"p50_ms": p95 / 2, "p95_ms": p95}}
+    return out
+
+
+class TestGate:
+    """gate_failures() 測試"""
+
+    def test_pass(self):
+        m = ev(model(0.9, 0.88, 40), model(0.9, 0.885, 38))
+        assert gate_failures(m, APPROVAL_GATE) == []
+
+    def test_missing_or_failed_evaluation(self):
+        assert "no holdout evaluation" in gate_failures({}, APPROVAL_GATE)[0]
+        assert "no holdout evaluation" in gate_failures(None, APPROVAL_GATE)[0]
+        failed = {"eval": {"error": "OSError: disk full"}}
+        assert "disk full" in gate_failures(failed, APPROVAL_GATE)[0]
+
+    def test_accuracy_and_f1_regression(self):
+        out = gate_failures(ev(model(0.85, 0.80), model(0.9, 0.9)), APPROVAL_GATE)
+        assert [f.split()[0] for f in out] == ["acc", "f1"]
+
+    def test_f1_within_tolerance(self):
+        out = gate_failures(ev(model(0.9, 0.895), model(0.9, 0.9)), APPROVAL_GATE)
+        assert out == []
+
+    def test_first_model_has_no_baseline(self):
+        assert gate_failures(ev(model(0.5, 0.5, 40)), APPROVAL_GATE) == []
+
+    def test_latency_budget_and_regression(self):
+        out = gate_failures(ev(model(0.9, 0.9, 200)), APPROVAL_GATE)
+        assert out == ["p95 latency 200ms over budget 150ms"]
+        out = gate_failures(
+            ev(model(0.9, 0.9, 100), model(0.9, 0.9, 50)), APPROVAL_GATE
+        )
+        assert out == ["p95 latency 100ms regressed vs production 50ms"]
+
+    def test_custom_gate(self):
+        gate = {**APPROVAL_GATE, "max_acc_drop": 0.1}
+        assert gate_failures(ev(model(0.85, 0.9), model(0.9, 0.9)), gate) == []
+
+
+class TestRunStage:
+    """run_stage() 測試"""
+
+    @pytest.mark.parametrize(
+        "run, stage",
+        [
+            ({"params_json": {"stage": "stage1"}}, "stage1"),
+            ({"params_json": {"epochs": 5}}, "stage2"),
+            ({"params_json": None}, "stage2"),
+            ({}, "stage2"),
+        ],
+    )
+    def test_from_params(self, run, stage):
+        assert run_stage(run) == stage
@@ -0,0 +1,192 @@
+"""
+內容定址影像儲存：本地 backend、背景寫入、重試與失敗標記
+"""
+
+import io
+import threading
+import time
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from inference.image_store import (  # noqa: E402
+    ImageStore,
+    ImageStoreFull,
+    LocalBackend,
+    SupabaseBackend,
+)
+
+
+def jpeg(color="red", size=(800, 600)):
+    img = Image.new("RGB", size, color=color)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG")
+    return buf.getvalue(), img
+
+
+def wait_for(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+
+class FlakyBackend(LocalBackend):
+    """前 fail_times 次 write 拋錯"""
+
+    def __init__(self, root, fail_times):
+        super().__init__(root)
+        self.fail_times, self.writes = fail_times, 0
+
+    def write(self, key, data, content_type):
+        self.writes += 1
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise OSError("storage unavailable")
+        super().write(key, data, content_type)
+
+
+class TestLocalBackend:
+    """LocalBackend 測試"""
+
+    def test_write_exists_and_urls(self, tmp_path):
+        be = LocalBackend(str(tmp_path), public_base="/images/")
+        assert not be.exists("a/b.jpg")
+        be.write("a/b.jpg", b"data", "image/jpeg")
+        assert be.exists("a/b.jpg")
+        assert (tmp_path / "a" / "b.jpg").read_bytes() == b"data"
+        assert not list(tmp_path.rglob("*.part"))
+        assert be.url("a/b.jpg") == "/images/a/b.jpg"
+        assert be.uri("a/b.jpg") == (tmp_path / "a" / "b.jpg").as_uri()
+
+
+class TestImageStore:
+    """ImageStore 測試"""
+
+    def test_put_writes_original_and_derivatives(self, tmp_path):
+        store = ImageStore(LocalBackend(str(tmp_path)))
+        raw, img = jpeg()
+        out = store.put(raw, img, "image/jpeg")
+        store.close()
+        keys = out["keys"]
+        assert keys["original"].endswith(f"{out['sha256']}/original.jpg")
+        assert (tmp_path / keys["original"]).read_bytes() == raw
+        assert max(Image.open(tmp_path / keys["model"]).size) == 640
+        assert max(Image.open(tmp_path / keys["thumb"]).size) == 256
+        assert Image.open(tmp_path / keys["webp"]).size == (800, 600)
+        assert store.summary()["stored"] == 1
+
+    def test_read_back_stored_view(self, tmp_path):
+        """背景補 listing 重啟後從 full.webp 讀回 VLM 所看的影像"""
+        store = ImageStore(LocalBackend(str(tmp_path)))
+        raw, img = jpeg()
+        out = store.put(raw, img, "image/jpeg")
+        store.close()
+        assert store.read(out["keys"]["original"]) == raw
+        back = Image.open(io.BytesIO(store.read(out["keys"]["webp"])))
+        assert back.size == img.size
+        with pytest.raises(FileNotFoundError):
+            store.read("images/00/missing/full.webp")
+
+    def test_same_content_stored_once(self, tmp_path):
+        store = ImageStore(LocalBackend(str(tmp_path)))
+        raw, img = jpeg()
+        a = store.put(raw, img, "image/jpeg")
+        wait_for(lambda: store.summary()["pending"] == 0)
+        b = store.put(raw, img, "image/jpeg")
+        store.close()
+        assert a["keys"] == b["keys"]
+        st = store.summary()
+        assert (st["stored"], st["duplicates"]) == (1, 1)
+
+    def test_full_rejects(self, tmp_path):
+        gate = threading.Event()
+
+        class Slow(LocalBackend):
+            def exists(self, key):
+                gate.wait(5)
+                return False
+
+        store = ImageStore(Slow(str(tmp_path)), workers=1, max_pending=1)
+        store.put(*jpeg("red"), "image/jpeg")
+        with pytest.raises(ImageStoreFull):
+            store.put(*jpeg("blue"), "image/jpeg")
+        assert store.summary()["rejected"] == 1
+        gate.set()
+        store.close()
+
+    def test_transient_failure_retried(self, tmp_path):
+        failed = []
+        store = ImageStore(
+            FlakyBackend(str(tmp_path), fail_times=1),
+            retry_s=0.001,
+            on_failed=lambda sha, keys: failed.append(sha),
+        )
+        out = store.put(*jpeg(), "image/jpeg")
+        store.close()
+        assert (tmp_path / out["keys"]["original"]).exists()
+        assert store.summary()["retries"] == 1
+        assert not store.failed(out["sha256"]) and failed == []
+
+    def test_exhausted_retries_reported(self, tmp_path):
+        """重試用盡時記下 sha256 並呼叫 on_failed，讓呼叫端標記資料列"""
+        failed = []
+        store = ImageStore(
+            FlakyBackend(str(tmp_path), fail_times=100),
+            attempts=3,
+            retry_s=0.001,
+            on_failed=lambda sha, keys: failed.append((sha, keys["model"])),
+        )
+        out = store.put(*jpeg(), "image/jpeg")
+        store.close()
+        assert store.failed(out["sha256"])
+        assert failed == [(out["sha256"], out["keys"]["model"])]
+        st = store.summary()
+        assert (st["failed"], st["retries"], st["pending"]) == (1, 2, 0)
+
+
+class FakeBucket:
+    def __init__(self, error=None):
+        self.error, self.uploads = error, []
+
+    def upload(self, key, data, opts):
+        self.uploads.append((key, opts))
+        if self.error:
+            raise RuntimeError(self.error)
+
+
+class FakeStorage:
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def from_(self, name):
+        return self.bucket
+
+
+class FakeSB:
+    supabase_url = "https://x.supabase.co"
+
+    def __init__(self, bucket):
+        self.storage = FakeStorage(bucket)
+
+
+class TestSupabaseBackend:
+    """SupabaseBackend 測試"""
+
+    def test_never_overwrites(self):
+        bucket = FakeBucket()
+        be = SupabaseBackend(FakeSB(bucket), "samples")
+        be.write("images/a", b"x", "image/jpeg")
+        assert "upsert" not in bucket.uploads[0][1]
+        assert be.uri("images/a") == "images/a"
+        assert be.url("images/a").endswith("/object/public/samples/images/a")
+
+    def test_existing_key_is_success(self):
+        be = SupabaseBackend(FakeSB(FakeBucket("{'error': 'Duplicate'}")), "samples")
+        be.write("images/a", b"x", "image/jpeg")
+
+    def test_other_errors_raise(self):
+        be = SupabaseBackend(FakeSB(FakeBucket("403 Unauthorized")), "samples")
+        with pytest.raises(RuntimeError):
+            be.write("images/a", b"x", "image/jpeg")
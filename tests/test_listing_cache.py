@@ -0,0 +1,76 @@
+"""
+listing 文字快取：TTL、LRU 與寫回
+"""
+
+import pytest
+
+from inference import listing_cache
+from inference.listing_cache import ListingCache, listing_key
+
+TEXT = {"title_zh": "Nike 球鞋", "desc": "輕微磨損", "title_en": "Nike sneaker"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可控制的 time.time()"""
+    now = [1_000_000.0]
+    monkeypatch.setattr(listing_cache.time, "time", lambda: now[0])
+    return now
+
+
+class TestListingCache:
+    """ListingCache 測試"""
+
+    def test_key_normalized(self):
+        assert listing_key(" Nike ", "Air  Max", ["b", "a"], "sell") == listing_key(
+            "nike", "air max", ["a", "b"], "sell"
+        )
+        assert listing_key(None, "", [], "sell") == "unknown|unknown|none|sell"
+
+    def test_ttl_expiry(self, tmp_path, clock):
+        cache = ListingCache(tmp_path / "c.json", ttl_s=100)
+        cache.put("k", TEXT)
+        clock[0] += 99
+        assert cache.get("k")["title_zh"] == "Nike 球鞋"
+        clock[0] += 1
+        assert cache.get("k") is None
+        st = cache.summary()
+        assert (st["hits"], st["misses"], st["expired"], st["size"]) == (1, 1, 1, 0)
+
+    def test_expired_not_loaded(self, tmp_path, clock):
+        """重啟時略過已過期的項目"""
+        path = tmp_path / "c.json"
+        cache = ListingCache(path, ttl_s=100)
+        cache.put("old", TEXT)
+        clock[0] += 50
+        cache.put("new", TEXT)
+        cache.flush()
+        clock[0] += 60
+        reloaded = ListingCache(path, ttl_s=100)
+        assert reloaded.get("old") is None
+        assert reloaded.get("new") is not None
+
+    def test_lru_eviction(self, tmp_path, clock):
+        cache = ListingCache(tmp_path / "c.json", max_size=2)
+        cache.put("a", TEXT)
+        cache.put("b", TEXT)
+        cache.get("a")
+        cache.put("c", TEXT)
+        assert cache.get("b") is None
+        assert cache.get("a") and cache.get("c")
+        assert cache.summary()["evicted"] == 1
+
+    def test_incomplete_text_not_cached(self, tmp_path):
+        cache = ListingCache(tmp_path / "c.json")
+        cache.put("k", {"title_zh": "只有標題"})
+        assert cache.get("k") is None
+
+    def test_invalidate(self, tmp_path):
+        path = tmp_path / "c.json"
+        cache = ListingCache(path)
+        cache.put("a", TEXT)
+        cache.put("b", TEXT)
+        assert cache.invalidate("a") == 1
+        assert ListingCache(path).get("b") is not None
+        assert cache.invalidate() == 1
+        assert ListingCache(path).summary()["size"] == 0
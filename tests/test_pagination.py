@@ -0,0 +1,28 @@
+"""
+/admin/runs 分頁游標
+"""
+
+import pytest
+
+from inference.pagination import decode_cursor, encode_cursor
+
+
+class TestCursor:
+    """encode_cursor() / decode_cursor() 測試"""
+
+    def test_round_trip(self):
+        row = {"started_at": "2024-05-01T12:00:00+00:00", "id": "run-1", "x": 1}
+        cursor = encode_cursor(row)
+        assert "=" not in cursor
+        assert decode_cursor(cursor) == ("2024-05-01T12:00:00+00:00", "run-1")
+
+    def test_url_safe(self):
+        cursor = encode_cursor({"started_at": "?>>", "id": "~~~"})
+        assert not set(cursor) & set("+/=")
+        assert decode_cursor(cursor) == ("?>>", "~~~")
+
+    @pytest.mark.parametrize("bad", ["", "not-a-cursor", "e30", "WzFd"])
+    def test_invalid(self, bad):
+        """非 base64、非 JSON 或欄位數不對都拋出 ValueError"""
+        with pytest.raises(ValueError):
+            decode_cursor(bad)
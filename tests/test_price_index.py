@@ -0,0 +1,136 @@
+"""
+embedding 最近鄰估價：群組過濾、定價來源、模型版本與 IVF
+"""
+
+import threading
+
+import numpy as np
+import pytest
+
+from inference import price_index as pi
+from inference.price_index import PriceIndex
+
+PRICES = {"90": [1000, 1500], "70": [700, 1000], "50": [400, 700]}
+
+
+def near(base, rng, noise=0.05):
+    return base + rng.normal(0, noise, size=base.shape)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+class TestEstimate:
+    """add() / estimate() 測試"""
+
+    def test_median_of_similar_priced_neighbors(self, tmp_path, rng):
+        idx = PriceIndex(tmp_path, model="m1")
+        base = rng.normal(size=64)
+        for i, low in enumerate((900, 1000, 1100)):
+            prices = {**PRICES, "90": [low, low + 500]}
+            idx.add(f"i{i}", near(base, rng), "Nike", ["hole"], prices, "vlm")
+        est = idx.estimate(near(base, rng), "nike ", ["hole"])
+        assert est["prices"]["90"] == [1000, 1500]
+        assert sorted(est["neighbors"]) == ["i0", "i1", "i2"]
+        assert est["similarity"] > 0.9
+
+    def test_group_and_source_filters(self, tmp_path, rng):
+        """其他 (brand, defects) 群組與 nn 自己估的價格不當作鄰居"""
+        idx = PriceIndex(tmp_path, model="m1")
+        base = rng.normal(size=64)
+        for i in range(3):
+            idx.add(f"a{i}", near(base, rng), "nike", ["hole"], PRICES, "nn")
+            idx.add(f"b{i}", near(base, rng), "adidas", ["hole"], PRICES, "vlm")
+        assert idx.estimate(base, "nike", ["hole"]) is None
+        assert idx.estimate(base, "nike", ["flat"]) is None
+        assert idx.estimate(base, "adidas", ["hole"]) is not None
+
+    def test_dissimilar_neighbors_rejected(self, tmp_path, rng):
+        idx = PriceIndex(tmp_path, model="m1", min_sim=0.8)
+        for i in range(5):
+            idx.add(f"i{i}", rng.normal(size=64), "nike", [], PRICES, "human")
+        assert idx.estimate(rng.normal(size=64), "nike", []) is None
+
+    def test_no_prices_not_added(self, tmp_path, rng):
+        idx = PriceIndex(tmp_path)
+        idx.add("i0", rng.normal(size=8), "nike", [], None, "vlm")
+        assert len(idx) == 0
+
+
+class TestPersistence:
+    """重啟與模型版本切換"""
+
+    def test_reload(self, tmp_path, rng):
+        base = rng.normal(size=32)
+        idx = PriceIndex(tmp_path, model="m1")
+        for i in range(3):
+            idx.add(f"i{i}", near(base, rng), "nike", [], PRICES, "vlm")
+        again = PriceIndex(tmp_path, model="m1")
+        assert len(again) == 3 and again.archived is None
+        assert again.estimate(base, "nike", []) is not None
+
+    def test_other_model_archived(self, tmp_path, rng):
+        idx = PriceIndex(tmp_path, model="m1")
+        idx.add("i0", rng.normal(size=32), "nike", [], PRICES, "vlm")
+        switched = PriceIndex(tmp_path, model="m2")
+        assert len(switched) == 0
+        assert switched.archived["model"] == "m1"
+        assert (tmp_path / "stale-m1" / "meta.jsonl").exists()
+        switched.add("j0", rng.normal(size=16), "nike", [], PRICES, "vlm")
+        assert switched.dim == 16
+
+
+class TestIVF:
+    """build_ivf() 測試"""
+
+    def test_small_index_skips_ivf(self, tmp_path, rng):
+        idx = PriceIndex(tmp_path)
+        idx.add("i0", rng.normal(size=8), "nike", [], PRICES, "vlm")
+        assert idx.build_ivf() == 0 and idx.centroids is None
+
+    def test_ivf_finds_same_neighbors(self, tmp_path, rng, monkeypatch):
+        monkeypatch.setattr(pi, "IVF_MIN", 100)
+        idx = PriceIndex(tmp_path, model="m1")
+        centers = rng.normal(size=(10, 32))
+        for i in range(400):
+            idx.add(f"i{i}", near(centers[i % 10], rng), "nike", [], PRICES, "vlm")
+        q = near(centers[3], rng)
+        brute = idx.estimate(q, "nike", [])
+        assert idx.build_ivf(nlist=10) == 10
+        assert len(idx.lists) == len(idx)
+        est = idx.estimate(q, "nike", [])
+        # float16 相似度可能同分，只比較價格與鄰居所屬的群
+        assert est["prices"] == brute["prices"]
+        assert all(int(n[1:]) % 10 == 3 for n in est["neighbors"] + brute["neighbors"])
+        # 重啟後沿用 IVF
+        again = PriceIndex(tmp_path, model="m1")
+        assert again.centroids is not None and len(again.lists) == 400
+
+    def test_add_during_build_stays_consistent(self, tmp_path, rng, monkeypatch):
+        """k-means 期間的 add 與 estimate 不會讀到長度不一致的 lists"""
+        monkeypatch.setattr(pi, "IVF_MIN", 100)
+        idx = PriceIndex(tmp_path, model="m1")
+        centers = rng.normal(size=(5, 32))
+        for i in range(300):
+            idx.add(f"i{i}", near(centers[i % 5], rng), "nike", [], PRICES, "vlm")
+        errors = []
+
+        def writer():
+            r = np.random.default_rng(1)
+            try:
+                for i in range(200):
+                    idx.add(f"w{i}", near(centers[i % 5], r), "nike", [], PRICES, "vlm")
+                    idx.estimate(centers[i % 5], "nike", [])
+            except Exception as e:
+                errors.append(e)
+
+        t = threading.Thread(target=writer)
+        t.start()
+        for _ in range(3):
+            idx.build_ivf(nlist=5)
+        t.join()
+        assert errors == []
+        assert len(idx.lists) == len(idx) == 500
+        assert idx.estimate(centers[0], "nike", []) is not None
@@ -0,0 +1,81 @@
+"""
+read-through 快取：TTL、stale-while-revalidate 與 invalidate
+"""
+
+import threading
+import time
+
+from inference.read_cache import ReadCache
+
+
+class Loader:
+    """每次呼叫回傳遞增的值；可設定為拋錯或卡住"""
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.gate = None
+
+    def __call__(self):
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            raise RuntimeError("supabase down")
+        self.calls += 1
+        return self.calls
+
+
+def wait_for(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+
+class TestReadCache:
+    """ReadCache 測試"""
+
+    def test_hit_within_ttl(self):
+        cache, load = ReadCache(ttl_s=60), Loader()
+        assert cache.get(("t", 1), load) == 1
+        assert cache.get(("t", 1), load) == 1
+        st = cache.summary()["t"]
+        assert (st["misses"], st["hits"], st["entries"]) == (1, 1, 1)
+
+    def test_stale_served_then_refreshed(self):
+        """過期但在 stale 視窗內先回舊值，背景載入新值"""
+        cache, load = ReadCache(ttl_s=0.02, stale_s=60), Loader()
+        assert cache.get(("t",), load) == 1
+        time.sleep(0.05)
+        load.gate = threading.Event()
+        assert cache.get(("t",), load) == 1  # 不等 loader
+        assert cache.get(("t",), load) == 1  # 同一鍵只有一個背景載入
+        load.gate.set()
+        wait_for(lambda: cache.summary()["t"]["refreshes"] == 1)
+        assert load.calls == 2
+        assert cache.get(("t",), load, ttl=60) == 2
+
+    def test_refresh_error_keeps_old_value(self):
+        cache, load = ReadCache(ttl_s=0.02, stale_s=60), Loader()
+        cache.get(("t",), load)
+        time.sleep(0.05)
+        load.fail = True
+        assert cache.get(("t",), load) == 1
+        wait_for(lambda: cache.summary()["t"]["errors"] == 1)
+        assert cache.get(("t",), load) == 1
+
+    def test_expired_past_stale_loads_sync(self):
+        cache, load = ReadCache(ttl_s=0.01, stale_s=0.01), Loader()
+        cache.get(("t",), load)
+        time.sleep(0.05)
+        assert cache.get(("t",), load) == 2
+        assert cache.summary()["t"]["misses"] == 2
+
+    def test_invalidate_prefix(self):
+        cache, load = ReadCache(ttl_s=60), Loader()
+        cache.get(("runs", "a", 1), load)
+        cache.get(("runs", "a", 2), load)
+        cache.get(("runs", "b"), load)
+        assert cache.invalidate("runs", "a") == 2
+        assert cache.summary()["runs"]["entries"] == 1
+        assert cache.get(("runs", "a", 1), load) == 4
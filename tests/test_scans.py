@@ -0,0 +1,127 @@
+"""
+QR 掃描：簽章驗證、payload 解析與批次寫入
+"""
+
+import threading
+import uuid
+
+import pytest
+
+from inference.scans import ScanBuffer, parse_qr, qr_signature, sign_payload, verify_qr
+
+SECRET = "test-secret"
+ITEM = str(uuid.uuid4())
+
+
+class APIError(Exception):
+    """模擬 postgrest 的 APIError（帶 SQLSTATE）"""
+
+    def __init__(self, code):
+        super().__init__(f"sqlstate {code}")
+        self.code = code
+
+
+class TestSignature:
+    """qr_signature() / sign_payload() / verify_qr() 測試"""
+
+    def test_round_trip(self):
+        qr = sign_payload(SECRET, {"item_id": ITEM, "route": "r1", "ts": 1})
+        assert verify_qr(SECRET, qr)
+
+    @pytest.mark.parametrize("field", ["item_id", "route", "ts"])
+    def test_tampered_field(self, field):
+        qr = sign_payload(SECRET, {"item_id": ITEM, "route": "r1", "ts": 1})
+        qr[field] = "x"
+        assert not verify_qr(SECRET, qr)
+
+    def test_wrong_secret_or_missing_sig(self):
+        payload = {"item_id": ITEM, "route": "r1", "ts": 1}
+        assert not verify_qr("other", sign_payload(SECRET, payload))
+        assert not verify_qr(SECRET, payload)
+
+    def test_signature_is_deterministic(self):
+        payload = {"item_id": ITEM, "route": "r1", "ts": 1, "extra": "ignored"}
+        assert qr_signature(SECRET, payload) == qr_signature(
+            SECRET, {"ts": 1, "route": "r1", "item_id": ITEM}
+        )
+
+    def test_query_params_rebuild(self):
+        """/logistics/{id}/status 以查詢參數重組 QR 內容驗章"""
+        qr = sign_payload(SECRET, {"item_id": ITEM, "route": "DONATE", "ts": 1700})
+        rebuilt = {"item_id": ITEM, "route": "DONATE", "ts": 1700, "sig": qr["sig"]}
+        assert verify_qr(SECRET, rebuilt)
+        other = {**rebuilt, "item_id": str(uuid.uuid4())}
+        assert not verify_qr(SECRET, other)
+
+
+class TestParse:
+    """parse_qr() 測試"""
+
+    def test_json_string(self):
+        assert parse_qr(f'{{"item_id": "{ITEM}"}}') == {"item_id": ITEM}
+
+    @pytest.mark.parametrize(
+        "qr", ["{bad json", "[]", {"route": "r1"}, {"item_id": "not-a-uuid"}, None]
+    )
+    def test_rejected(self, qr):
+        assert parse_qr(qr) is None
+
+
+class TestScanBuffer:
+    """ScanBuffer 測試"""
+
+    def test_poison_row_isolated(self):
+        """資料錯誤的那一筆進 dead letter，其餘照常寫入"""
+        written = []
+
+        def flush(rows):
+            if any(r["bad"] for r in rows):
+                raise APIError("22P02")
+            written.extend(rows)
+
+        buf = ScanBuffer(flush, max_batch=64, max_wait_s=0.01)
+        futs = buf.offer([{"i": i, "bad": i == 17} for i in range(64)])
+        results = [f.result(5) for f in futs]
+        assert len(written) == 63
+        assert results[17] and all(r is None for i, r in enumerate(results) if i != 17)
+        st = buf.summary()
+        assert st["dead"] == 1 and st["recent_dead"][0]["event"]["i"] == 17
+        buf.close()
+
+    def test_transient_error_retried(self):
+        """暫時性錯誤重試後成功"""
+        calls = []
+
+        def flush(rows):
+            calls.append(len(rows))
+            if len(calls) == 1:
+                raise ConnectionError("timeout")
+
+        buf = ScanBuffer(flush, max_wait_s=0.01)
+        assert [f.result(5) for f in buf.offer([{"i": 1}, {"i": 2}])] == [None, None]
+        assert buf.summary()["retries"] == 2
+        buf.close()
+
+    def test_gives_up_after_max_attempts(self):
+        def flush(rows):
+            raise ConnectionError("down")
+
+        buf = ScanBuffer(flush, max_wait_s=0.01, max_attempts=2)
+        assert "down" in buf.offer([{"i": 1}])[0].result(5)
+        buf.close()
+
+    def test_full_buffer_rejects_rest(self):
+        """緩衝滿時只收下放得進去的事件"""
+        busy, release = threading.Event(), threading.Event()
+
+        def flush(rows):
+            busy.set()
+            release.wait(5)
+
+        buf = ScanBuffer(flush, max_batch=1, max_buffer=2, max_wait_s=0.01)
+        first = buf.offer([{"i": 0}])
+        assert busy.wait(5)  # worker 卡在寫入中，佇列不再被取出
+        assert len(buf.offer([{"i": i} for i in range(5)])) == 2
+        release.set()
+        assert first[0].result(5) is None
+        buf.close()
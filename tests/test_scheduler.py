@@ -0,0 +1,103 @@
+"""
+推論排程：優先等級、deadline 與取消
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from inference.scheduler import DeadlineExceeded, Lane, Scheduler, Ticket
+
+
+def blocked_lane():
+    """回傳 (lane, gate)：lane 唯一的 worker 卡在 gate 上，方便先排好佇列"""
+    lane = Lane("test", workers=1)
+    gate = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        started.set()
+        gate.wait(5)
+
+    lane.submit(Ticket("interactive", "t"), hold)
+    assert started.wait(5)
+    return lane, gate
+
+
+class TestLane:
+    """Lane 測試"""
+
+    def test_priority_and_round_robin(self):
+        """嚴格優先；同等級內 tenant 輪流"""
+        lane, gate = blocked_lane()
+        order = []
+        futs = [
+            lane.submit(Ticket("bulk", "ngo"), order.append, "bulk"),
+            lane.submit(Ticket("standard", "a"), order.append, "a1"),
+            lane.submit(Ticket("standard", "a"), order.append, "a2"),
+            lane.submit(Ticket("standard", "b"), order.append, "b1"),
+            lane.submit(Ticket("interactive", "x"), order.append, "x"),
+        ]
+        gate.set()
+        for f in futs:
+            f.result(5)
+        assert order == ["x", "a1", "b1", "a2", "bulk"]
+
+    def test_expired_job_is_dropped(self):
+        """排隊期間過期的工作不執行，future 拋出 DeadlineExceeded"""
+        lane, gate = blocked_lane()
+        ran = []
+        fut = lane.submit(Ticket("standard", "a", deadline_s=0.01), ran.append, 1)
+        time.sleep(0.05)
+        gate.set()
+        with pytest.raises(DeadlineExceeded):
+            fut.result(5)
+        assert ran == []
+        assert lane.summary()["standard"]["expired"] == 1
+
+    def test_cancelled_expired_job_keeps_lane_alive(self):
+        """呼叫端已取消且過期的工作不會讓 worker 停掉"""
+        lane, gate = blocked_lane()
+        fut = lane.submit(Ticket("standard", "a", deadline_s=0.01), lambda: 1)
+        assert fut.cancel()
+        time.sleep(0.05)
+        gate.set()
+        assert lane.submit(Ticket("standard", "a"), lambda: 42).result(5) == 42
+
+    def test_cancelled_job_is_skipped(self):
+        lane, gate = blocked_lane()
+        ran = []
+        fut = lane.submit(Ticket("standard", "a"), ran.append, 1)
+        fut.cancel()
+        gate.set()
+        assert lane.submit(Ticket("standard", "a"), lambda: "ok").result(5) == "ok"
+        assert ran == []
+
+    def test_exception_propagates(self):
+        """工作本身的例外交給呼叫端，lane 繼續運作"""
+        lane = Lane("test")
+        with pytest.raises(ZeroDivisionError):
+            lane.submit(Ticket("standard", "a"), lambda: 1 / 0).result(5)
+        assert lane.submit(Ticket("standard", "a"), lambda: 2).result(5) == 2
+
+
+class TestScheduler:
+    """Scheduler 測試"""
+
+    def test_run(self):
+        sched = Scheduler({"yolo": 1})
+        out = asyncio.run(sched.run("yolo", Ticket("standard", "a"), pow, 2, 3))
+        assert out == 8
+
+    def test_expired_before_submit(self):
+        sched = Scheduler({"yolo": 1})
+        ticket = Ticket("standard", "a", deadline_s=0.001)
+        time.sleep(0.01)
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(sched.run("yolo", ticket, pow, 2, 3))
+
+    def test_unknown_class_is_standard(self):
+        assert Ticket("vip", "").cls == "standard"
+        assert Ticket("vip", "").tenant == "anon"
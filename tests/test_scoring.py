@@ -0,0 +1,86 @@
+"""
+主動學習評分：不確定度與批次挑選
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from scoring import score_matrix, score_samples, select_batch
+
+
+def reference(d):
+    """inference/app.py uncertainty() 的逐筆版本"""
+    total = sum(max(v, 0.0) for v in d.values())
+    if total <= 0:
+        return 1.0
+    p = sorted((max(v, 0.0) / total for v in d.values()), reverse=True)
+    k = len(p)
+    if k == 1:
+        return 0.5 * (1.0 - p[0])
+    ent = -sum(x * math.log(x) for x in p if x > 0) / math.log(k)
+    return 0.5 * (ent + 1.0 - (p[0] - p[1]))
+
+
+class TestScore:
+    """score_matrix() / score_samples() 測試"""
+
+    def test_extremes(self):
+        """均勻分佈最不確定、one-hot 最確定、沒有分數用 missing"""
+        u = score_matrix([{"a": 0.5, "b": 0.5}, {"a": 1.0, "b": 0.0}, None], 0.3)
+        assert u.tolist() == pytest.approx([1.0, 0.0, 0.3])
+
+    def test_matches_reference(self):
+        """不同類別組合的列與逐筆計算一致"""
+        rng = np.random.default_rng(0)
+        names = ["a", "b", "c", "d"]
+        dicts = []
+        for _ in range(50):
+            k = int(rng.integers(2, 5))
+            dicts.append(
+                {c: float(v) for c, v in zip(names[:k], rng.dirichlet(np.ones(k)))}
+            )
+        u = score_matrix(dicts, missing=1.0)
+        # 矩陣版把缺少的類別當 0，k 以全部類別數計
+        padded = [{c: d.get(c, 0.0) for c in names} for d in dicts]
+        assert u.tolist() == pytest.approx([reference(d) for d in padded], abs=1e-5)
+
+    def test_zero_scores(self):
+        """分數全為 0 視為完全不確定"""
+        assert score_matrix([{"a": 0.0, "b": 0.0}], 0.0).tolist() == [1.0]
+
+    def test_stage2_missing_not_uncertain(self):
+        """沒跑 stage2 時只看 stage1"""
+        rows = [
+            {"stage1_scores": {"shoe": 1.0, "other": 0.0}},
+            {"stage1_scores": {"shoe": 1.0, "other": 0.0}, "stage2_scores": {}},
+            {"stage1_scores": None},
+        ]
+        assert score_samples(rows).tolist() == pytest.approx([0.0, 0.0, 1.0])
+
+
+class TestSelect:
+    """select_batch() 測試"""
+
+    def test_skips_labeled_and_threshold(self):
+        rows = [{"is_labeled": True}, {}, {}]
+        scores = np.array([0.9, 0.8, 0.1], dtype=np.float32)
+        assert select_batch(rows, scores, budget=5, threshold=0.5) == [1]
+
+    def test_one_per_near_duplicate_group(self):
+        """近重複群只挑分數最高的一張"""
+        rows = [
+            {"phash": "0000000000000000"},
+            {"phash": "0000000000000001"},
+            {"phash": "ffffffffffffffff"},
+        ]
+        scores = np.array([0.5, 0.9, 0.4], dtype=np.float32)
+        assert select_batch(rows, scores, budget=3) == [1, 2]
+
+    def test_classes_take_turns(self):
+        """各預測類別先各取到上限，剩餘名額再依分數補"""
+        rows = [{"stage2_pred": "a"}] * 4 + [{"stage2_pred": "b"}] * 2
+        scores = np.array([0.9, 0.8, 0.7, 0.6, 0.2, 0.1], dtype=np.float32)
+        assert select_batch(rows, scores, budget=4) == [0, 1, 4, 5]
+        assert select_batch(rows, scores, budget=0) == []
@@ -0,0 +1,166 @@
+"""
+候選模型影子評估：權重下載、抽樣、一致率與預算控制
+"""
+
+import hashlib
+import threading
+import time
+
+import pytest
+
+from inference import shadow as shadow_mod
+from inference.shadow import ShadowEvaluator, fetch_weights, load_candidates
+
+
+class FakeModel:
+    """以權重檔內容當作預測類別"""
+
+    def __init__(self, path):
+        with open(path) as f:
+            self.top = f.read()
+        self.path = path
+
+
+def predict(model, img):
+    return model.top, {model.top: 1.0}
+
+
+def wait_for(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def flushed():
+    return []
+
+
+@pytest.fixture
+def evaluator(flushed):
+    ev = ShadowEvaluator(
+        predict, lambda run_id, s: flushed.append((run_id, s)), sample_rate=1.0
+    )
+    yield ev
+    ev.stop()
+
+
+class TestWeights:
+    """fetch_weights() / load_candidates() 測試"""
+
+    def test_storage_key_downloaded_by_content(self, tmp_path):
+        calls = []
+
+        def download(key):
+            calls.append(key)
+            return b"weights-v1"
+
+        path = fetch_weights(download, "runs/abc/stage2_best.pt", tmp_path)
+        digest = hashlib.sha256(b"weights-v1").hexdigest()
+        assert path == str(tmp_path / f"{digest}.pt")
+        assert open(path, "rb").read() == b"weights-v1"
+        # 同內容的另一個 key 共用同一個檔案
+        assert fetch_weights(download, "runs/def/stage2_best.pt", tmp_path) == path
+        assert calls == ["runs/abc/stage2_best.pt", "runs/def/stage2_best.pt"]
+
+    def test_local_file_used_as_is(self, tmp_path):
+        local = tmp_path / "best.pt"
+        local.write_bytes(b"x")
+
+        def download(key):
+            raise AssertionError("should not download")
+
+        assert fetch_weights(download, str(local), tmp_path / "cache") == str(local)
+
+    def test_start_with_storage_key_artifact(self, tmp_path, evaluator, flushed):
+        """artifacts 只有 storage key 時仍能啟動 shadow，並與正式模型比較"""
+        store = {"runs/r1/stage2_best.pt": b"hole"}
+        models = load_candidates(
+            {"stage1": None, "stage2": "runs/r1/stage2_best.pt"},
+            FakeModel,
+            store.__getitem__,
+            tmp_path,
+        )
+        assert list(models) == ["stage2"]
+        evaluator.start("r1", models)
+        assert evaluator.active
+        assert evaluator.submit("img", {"stage1": "sneaker", "stage2": "hole"}, 5.0)
+        assert evaluator.submit("img", {"stage1": "sneaker", "stage2": "good"}, 5.0)
+        wait_for(lambda: evaluator.summary()["samples"] == 2)
+        summary = evaluator.stop()
+        assert summary["stage2_agreement"] == 0.5
+        assert summary["stage2_preds"] == {"hole": 2}
+        assert summary["stage1_agreement"] is None
+        assert flushed[-1][0] == "r1"
+        assert not evaluator.active
+
+
+class _Model:
+    def __init__(self, top):
+        self.top = top
+
+
+class TestShadowEvaluator:
+    """ShadowEvaluator 測試"""
+
+    def test_inactive_ignores_submit(self, evaluator):
+        assert not evaluator.submit("img", {"stage1": "sneaker"})
+        assert evaluator.stop() is None
+
+    def test_stage2_compared_only_when_production_ran_it(self, evaluator):
+        evaluator.start("r1", {"stage1": _Model("sneaker"), "stage2": _Model("good")})
+        evaluator.submit("img", {"stage1": "sneaker", "stage2": "good"})
+        evaluator.submit("img", {"stage1": "other", "stage2": None})
+        wait_for(lambda: evaluator.summary()["samples"] == 2)
+        s = evaluator.summary()
+        assert s["stage1_agreement"] == 0.5
+        assert s["stage2_agreement"] == 1.0
+
+    def test_sample_rate(self, evaluator, monkeypatch):
+        evaluator.start("r1", {"stage1": _Model("sneaker")}, sample_rate=0.25)
+        monkeypatch.setattr(shadow_mod.random, "random", lambda: 0.3)
+        assert not evaluator.submit("img", {"stage1": "sneaker"})
+        monkeypatch.setattr(shadow_mod.random, "random", lambda: 0.2)
+        assert evaluator.submit("img", {"stage1": "sneaker"})
+
+    def test_full_queue_drops(self):
+        gate = threading.Event()
+
+        def slow(model, img):
+            gate.wait(5)
+            return "sneaker", {}
+
+        ev = ShadowEvaluator(slow, lambda *a: None, sample_rate=1.0, max_queue=1)
+        ev.start("r1", {"stage1": _Model("sneaker")})
+        ev.submit("img", {"stage1": "sneaker"})
+        wait_for(lambda: ev._q.empty())  # 第一筆已在執行中
+        assert ev.submit("img", {"stage1": "sneaker"})
+        assert not ev.submit("img", {"stage1": "sneaker"})
+        assert ev.summary()["dropped"] == 1
+        gate.set()
+        ev.stop()
+
+    def test_duty_cap_drops(self, evaluator):
+        evaluator.start("r1", {"stage1": _Model("sneaker")})
+        with evaluator._lock:
+            evaluator._busy.append((time.monotonic(), evaluator.window_s))
+            evaluator._busy_sum += evaluator.window_s
+        assert not evaluator.submit("img", {"stage1": "sneaker"})
+        assert evaluator.summary()["dropped"] == 1
+
+    def test_errors_counted_and_periodic_flush(self, flushed):
+        def flaky(model, img):
+            if img == "bad":
+                raise RuntimeError("boom")
+            return "sneaker", {}
+
+        ev = ShadowEvaluator(flaky, lambda r, s: flushed.append(s), 1.0, flush_every=2)
+        ev.start("r1", {"stage1": _Model("sneaker")})
+        for img in ("bad", "ok", "ok"):
+            ev.submit(img, {"stage1": "sneaker"})
+            time.sleep(0.02)
+        wait_for(lambda: ev.summary()["samples"] == 2)
+        assert ev.summary()["errors"] == 1
+        wait_for(lambda: len(flushed) == 1)
+        ev.stop()
@@ -0,0 +1,83 @@
+"""
+超參數 sweep：取樣空間與 median pruning
+"""
+
+import math
+import threading
+
+import pytest
+
+from sweep import sample_space, should_prune
+
+
+class TestSampleSpace:
+    """sample_space() 測試"""
+
+    def test_small_discrete_space_is_full_grid(self):
+        trials = sample_space({"lr0": [0.01, 0.001], "batch": [16, 32, 64]}, n=8)
+        assert len(trials) == 6
+        assert {(t["lr0"], t["batch"]) for t in trials} == {
+            (lr, b) for lr in (0.01, 0.001) for b in (16, 32, 64)
+        }
+
+    def test_large_discrete_space_sampled_without_repeats(self):
+        space = {"a": list(range(10)), "b": list(range(10))}
+        trials = sample_space(space, n=5)
+        assert len(trials) == 5
+        assert len({(t["a"], t["b"]) for t in trials}) == 5
+
+    def test_continuous_ranges_and_constants(self):
+        space = {
+            "lr0": {"min": 1e-4, "max": 1e-1, "log": True},
+            "epochs": {"min": 5, "max": 20, "int": True},
+            "imgsz": 224,
+        }
+        trials = sample_space(space, n=20)
+        assert len(trials) == 20
+        for t in trials:
+            assert 1e-4 <= t["lr0"] <= 1e-1
+            assert isinstance(t["epochs"], int) and 5 <= t["epochs"] <= 20
+            assert t["imgsz"] == 224
+        # log 取樣：指數在範圍內大致均勻，不會全擠在上端
+        assert min(math.log10(t["lr0"]) for t in trials) < -2.5
+
+    def test_seed_is_reproducible(self):
+        space = {"lr0": {"min": 0.001, "max": 0.1}, "batch": [16, 32]}
+        assert sample_space(space, 4, seed=1) == sample_space(space, 4, seed=1)
+        assert sample_space(space, 4, seed=1) != sample_space(space, 4, seed=2)
+
+    def test_exhausted_space_returns_fewer(self):
+        """含常數的空間不走 grid；取不到 n 組不重複時回傳現有的"""
+        trials = sample_space({"a": [1, 2], "c": 0}, n=5)
+        assert sorted(t["a"] for t in trials) == [1, 2]
+
+
+class TestShouldPrune:
+    """should_prune() 測試"""
+
+    def report(self, history, lock, epoch, values, min_epochs=3):
+        return [should_prune(history, lock, epoch, v, min_epochs) for v in values]
+
+    def test_below_median_pruned_after_min_epochs(self):
+        history, lock = {}, threading.Lock()
+        assert self.report(history, lock, 2, [0.8, 0.6, 0.5, 0.9]) == [
+            False,
+            False,
+            True,
+            False,
+        ]
+        assert history[2] == [0.8, 0.6, 0.5, 0.9]
+
+    def test_never_pruned_before_min_epochs(self):
+        history, lock = {}, threading.Lock()
+        assert not any(self.report(history, lock, 1, [0.9, 0.8, 0.1]))
+
+    @pytest.mark.parametrize("value", [0.7, 0.75])
+    def test_at_or_above_median_kept(self, value):
+        history, lock = {2: [0.6, 0.7, 0.8]}, threading.Lock()
+        assert not should_prune(history, lock, 2, value, 3)
+
+    def test_epochs_compared_separately(self):
+        history, lock = {3: [0.9, 0.95]}, threading.Lock()
+        assert not should_prune(history, lock, 2, 0.1, 3)
+        assert should_prune(history, lock, 3, 0.5, 3)
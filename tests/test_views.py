@@ -0,0 +1,61 @@
+"""
+多視角分類彙整：平均分數、代表視角與單一視角的瑕疵
+"""
+
+import pytest
+
+from inference.views import aggregate_views
+
+
+def view(**scores):
+    return max(scores, key=scores.get), scores
+
+
+class TestAggregateViews:
+    """aggregate_views() 測試"""
+
+    def test_single_view(self):
+        top, mean, idx = aggregate_views([view(good=0.7, hole=0.3)])
+        assert (top, idx) == ("good", 0)
+        assert mean == {"good": 0.7, "hole": 0.3}
+
+    def test_mean_and_most_confident_view(self):
+        per_view = [view(good=0.6, hole=0.4), view(good=0.9, hole=0.1)]
+        top, mean, idx = aggregate_views(per_view)
+        assert top == "good" and idx == 1
+        assert mean == pytest.approx({"good": 0.75, "hole": 0.25})
+
+    def test_failed_views_ignored(self):
+        per_view = [("unknown", {}), view(sneaker=0.8, other=0.2), (None, None)]
+        top, mean, idx = aggregate_views(per_view)
+        assert (top, idx) == ("sneaker", 1)
+        assert mean == {"sneaker": 0.8, "other": 0.2}
+
+    def test_no_scores(self):
+        assert aggregate_views([("unknown", {}), (None, None)]) == ("unknown", {}, 0)
+
+    def test_mismatched_classes_rejected(self):
+        with pytest.raises(ValueError):
+            aggregate_views([view(good=1.0, hole=0.0), view(good=1.0, flat=0.0)])
+
+    def test_defect_seen_in_one_view_wins(self):
+        """破洞只在一個角度看得到：平均是 good，但該視角信心夠高"""
+        per_view = [
+            view(good=0.9, hole=0.05, flat=0.05),
+            view(good=0.2, hole=0.75, flat=0.05),
+            view(good=0.95, hole=0.0, flat=0.05),
+        ]
+        top, mean, idx = aggregate_views(per_view, defect_conf=0.6)
+        assert (top, idx) == ("hole", 1)
+        assert max(mean, key=mean.get) == "good"
+
+    def test_weak_defect_keeps_mean(self):
+        per_view = [view(good=0.9, hole=0.1), view(good=0.5, hole=0.5)]
+        assert aggregate_views(per_view, defect_conf=0.6)[0] == "good"
+        # 沒有 defect_conf 時只看平均
+        strong = [
+            view(good=0.9, hole=0.1),
+            view(good=0.1, hole=0.9),
+            view(good=1.0, hole=0.0),
+        ]
+        assert aggregate_views(strong)[0] == "good"
@@ -0,0 +1,188 @@
+"""
+訓練 worker：lease 領取、heartbeat、被接手與 checkpoint 續跑
+"""
+
+import threading
+import time
+
+import pytest
+
+from worker import Lease, claim, resume_from, run_forever
+
+
+class Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class Call:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self):
+        return Result(self.fn())
+
+
+class FakeDB:
+    """以記憶體模擬 claim_training_run / heartbeat_training_run 的語意"""
+
+    def __init__(self, runs):
+        self.runs = {r["id"]: {"attempts": 0, **r} for r in runs}
+        self.now = 0.0
+        self.heartbeats = []
+        self.fail_heartbeats = 0
+        self.lock = threading.Lock()
+
+    def rpc(self, name, params):
+        return Call(lambda: getattr(self, name)(**params))
+
+    def claim_training_run(self, p_worker, p_lease_s, p_run_id=None):
+        with self.lock:
+            for r in sorted(self.runs.values(), key=lambda r: r["started_at"]):
+                if p_run_id and r["id"] != p_run_id:
+                    continue
+                expired = r.get("lease_expires_at", 0) < self.now
+                if r["status"] == "queued" or (r["status"] == "running" and expired):
+                    r.update(status="running", lease_owner=p_worker)
+                    r["lease_expires_at"] = self.now + p_lease_s
+                    r["attempts"] += 1
+                    return [dict(r)]
+            return []
+
+    def heartbeat_training_run(self, p_id, p_worker, p_lease_s, p_progress):
+        with self.lock:
+            if self.fail_heartbeats:
+                self.fail_heartbeats -= 1
+                raise ConnectionError("network blip")
+            r = self.runs[p_id]
+            if r["lease_owner"] != p_worker or r["status"] != "running":
+                return False
+            r["lease_expires_at"] = self.now + p_lease_s
+            r["progress_json"] = p_progress
+            self.heartbeats.append((p_worker, dict(p_progress)))
+            return True
+
+
+class Trainer:
+    def __init__(self, epoch, epochs, top1):
+        self.epoch, self.epochs, self.stop = epoch, epochs, False
+        self.metrics = {"metrics/accuracy_top1": top1}
+
+
+def runs(*ids):
+    return [{"id": i, "status": "queued", "started_at": n} for n, i in enumerate(ids)]
+
+
+class TestClaim:
+    """claim() 測試"""
+
+    def test_oldest_queued_first(self):
+        db = FakeDB(runs("r1", "r2"))
+        assert claim(db, "w1", lease_s=60)["id"] == "r1"
+        assert claim(db, "w2", lease_s=60)["id"] == "r2"
+        assert claim(db, "w3", lease_s=60) is None
+
+    def test_expired_lease_reclaimed(self):
+        db = FakeDB(runs("r1"))
+        claim(db, "w1", lease_s=60)
+        db.now = 30
+        assert claim(db, "w2", lease_s=60) is None
+        db.now = 61
+        run = claim(db, "w2", lease_s=60)
+        assert (run["lease_owner"], run["attempts"]) == ("w2", 2)
+
+    @pytest.mark.parametrize("data", [[], None, {"id": None}, [{"id": None}]])
+    def test_empty_results(self, data):
+        class SB:
+            def rpc(self, name, params):
+                return Call(lambda: data)
+
+        assert claim(SB(), "w1") is None
+
+    def test_single_row_object(self):
+        class SB:
+            def rpc(self, name, params):
+                return Call(lambda: {"id": "r1"})
+
+        assert claim(SB(), "w1") == {"id": "r1"}
+
+
+class TestLease:
+    """Lease 測試"""
+
+    def test_heartbeat_reports_progress(self):
+        db = FakeDB(runs("r1"))
+        claim(db, "w1", lease_s=60)
+        lease = Lease(db, "r1", "w1", lease_s=60)
+        lease.on_epoch(Trainer(2, 10, 0.8))
+        assert lease.heartbeat()
+        assert db.heartbeats == [("w1", {"epoch": 3, "epochs": 10, "top1": 0.8})]
+
+    def test_taken_over_stops_trainer(self):
+        db = FakeDB(runs("r1"))
+        claim(db, "w1", lease_s=60)
+        db.now = 61
+        claim(db, "w2", lease_s=60)
+        lease = Lease(db, "r1", "w1", lease_s=60)
+        assert not lease.heartbeat() and lease.lost
+        trainer = Trainer(4, 10, 0.5)
+        lease.on_epoch(trainer)
+        assert trainer.stop
+
+    def test_background_heartbeat_survives_errors(self):
+        db = FakeDB(runs("r1"))
+        claim(db, "w1", lease_s=60)
+        db.fail_heartbeats = 2
+        with Lease(db, "r1", "w1", lease_s=0.03) as lease:
+            deadline = time.monotonic() + 5
+            while len(db.heartbeats) < 2:
+                assert time.monotonic() < deadline
+                time.sleep(0.005)
+        assert not lease.lost
+        assert not lease._thread.is_alive()
+
+
+class TestRunForever:
+    """run_forever() 測試"""
+
+    def test_once_executes_claimed_run(self):
+        db = FakeDB(runs("r1"))
+        seen = []
+        run_forever(
+            db, lambda run, lease: seen.append((run["id"], lease.run_id)), once=True
+        )
+        assert seen == [("r1", "r1")]
+        run_forever(db, lambda run, lease: seen.append(run["id"]), once=True)
+        assert len(seen) == 1
+
+
+class TestResumeFrom:
+    """resume_from() 測試"""
+
+    CHECKPOINT = {"checkpoint": {"weights": "runs/r1/checkpoint/last.pt", "epoch": 7}}
+
+    @pytest.mark.parametrize("status", ["running", "failed"])
+    def test_checkpoint_resumed(self, status):
+        run = {"status": status, "artifacts": self.CHECKPOINT}
+        assert resume_from(run) == self.CHECKPOINT
+
+    @pytest.mark.parametrize(
+        "run",
+        [
+            {"status": "queued", "artifacts": CHECKPOINT},
+            {"status": "running", "artifacts": {"snapshot": "x"}},
+            {"status": "failed", "artifacts": None},
+            {"status": "pending_review", "artifacts": CHECKPOINT},
+        ],
+    )
+    def test_started_fresh(self, run):
+        assert resume_from(run) is None
+
+    def test_reclaimed_run_resumes(self):
+        """worker 當掉、lease 過期後由另一個 worker 領走並從 checkpoint 續跑"""
+        db = FakeDB(runs("r1"))
+        claim(db, "w1", lease_s=60)
+        db.runs["r1"]["artifacts"] = self.CHECKPOINT
+        db.now = 61
+        run = claim(db, "w2", lease_s=60)
+        assert resume_from(run)["checkpoint"]["epoch"] == 7
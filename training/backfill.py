@@ -0,0 +1,170 @@
+"""
+新模型核可後重新評分所有 dataset_samples：`python training/pipeline.py --backfill stage2`
+
+- 依 id 分頁讀取，影像經 exporter 的 ObjectCache 取得（多半已在本地快取）
+- 每頁切成 batch 丟給 process pool；每個 worker 只載入一次模型、限制自己的
+  執行緒數並調低 nice，批次推論後回傳分數
+- 預測、信心、完整分數與不確定度以 apply_sample_predictions() 整批寫回
+- 每頁寫完把 last_id 存進 system_flags，中斷後以同一組模型重跑會從該處接續
+- 以 duty cycle 節流：每頁處理完後休息，讓推論服務與資料庫保有餘裕
+"""
+
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from exporter import EXPORT_WORKERS, ObjectCache, resolver
+from scoring import score_samples
+
+IMGSZ = 640  # 與 inference/app.py 的 yolo_cls 相同
+BATCH = 64
+PAGE_SIZE = 1024
+COLUMNS = (
+    "id,image_path,stage1_pred,stage1_conf,stage1_scores,"
+    "stage2_pred,stage2_conf,stage2_scores"
+)
+FLAG_KEY = "backfill_checkpoint"
+NON_DEFECT = ("good", "unknown")
+
+_models = {}
+
+
+def _init_worker(weights: dict, threads: int):
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+    import torch
+    from ultralytics import YOLO
+
+    torch.set_num_threads(threads)
+    for stage, path in weights.items():
+        _models[stage] = YOLO(path)
+
+
+def _predict(stage: str, paths: list):
+    model = _models[stage]
+    names = model.names
+    out = []
+    for r in model.predict(paths, imgsz=IMGSZ, verbose=False, batch=len(paths)):
+        probs = getattr(r, "probs", None)
+        out.append(
+            {names[i]: float(probs.data[i]) for i in range(len(names))} if probs else {}
+        )
+    return out
+
+
+def iter_pages(sb, after: str | None, page_size: int = PAGE_SIZE):
+    last = after
+    while True:
+        q = sb.table("dataset_samples").select(COLUMNS).not_.is_("image_path", "null")
+        if last:
+            q = q.gt("id", last)
+        rows = q.order("id").limit(page_size).execute().data
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]["id"]
+        if len(rows) < page_size:
+            return
+
+
+def load_checkpoint(sb, models: dict) -> dict:
+    rows = sb.table("system_flags").select("value").eq("key", FLAG_KEY).execute().data
+    cp = rows[0]["value"] if rows else None
+    if cp and cp.get("models") == models and not cp.get("done"):
+        return cp
+    return {"models": models, "last_id": None, "processed": 0, "done": False}
+
+
+def save_checkpoint(sb, cp: dict):
+    cp = {**cp, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    sb.table("system_flags").upsert({"key": FLAG_KEY, "value": cp}).execute()
+
+
+def _apply(rows, stage: str, scores):
+    for row, s in zip(rows, scores):
+        top = max(s, key=s.get) if s else "unknown"
+        row[f"{stage}_scores"] = s or None
+        row[f"{stage}_conf"] = max(s.values()) if s else None
+        row[f"{stage}_pred"] = top
+        if stage == "stage2":
+            row["stage2_pred"] = top if top not in NON_DEFECT else None
+
+
+def _run_stage(pool, stage: str, rows, paths, batch: int):
+    futs = [
+        (rows[i : i + batch], pool.submit(_predict, stage, paths[i : i + batch]))
+        for i in range(0, len(rows), batch)
+    ]
+    for chunk, fut in futs:
+        _apply(chunk, stage, fut.result())
+
+
+def backfill(
+    sb,
+    weights: dict,
+    models: dict,
+    workers: int | None = None,
+    threads: int = 2,
+    batch: int = BATCH,
+    max_duty: float = 0.5,
+    limit: int | None = None,
+):
+    """
+    weights: {"stage1": 本地路徑, "stage2": 本地路徑}（至少一個）；
+    models: 對應的 model_registry id，作為 checkpoint 的識別。
+    """
+    cp = load_checkpoint(sb, models)
+    workers = workers or max(1, (os.cpu_count() or 1) // (2 * threads))
+    resolve = resolver(sb, ObjectCache())
+    ctx = mp.get_context("spawn")
+    t_start = time.time()
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as io_pool, ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(weights, threads),
+    ) as pool:
+        for page in iter_pages(sb, cp["last_id"]):
+            t0 = time.time()
+            local = [(row, str(p)) for row, p, _ in io_pool.map(resolve, page) if p]
+            rows = [row for row, _ in local]
+            paths = [p for _, p in local]
+            if "stage1" in weights:
+                _run_stage(pool, "stage1", rows, paths, batch)
+            if "stage2" in weights:
+                # stage2 只對（新的）stage1 判為球鞋的樣本；其餘清空
+                idx = [i for i, r in enumerate(rows) if r["stage1_pred"] == "sneaker"]
+                for r in rows:
+                    if r["stage1_pred"] != "sneaker":
+                        r.update(stage2_pred=None, stage2_conf=None, stage2_scores=None)
+                _run_stage(
+                    pool,
+                    "stage2",
+                    [rows[i] for i in idx],
+                    [paths[i] for i in idx],
+                    batch,
+                )
+            if rows:
+                u = score_samples(rows)
+                for r, x in zip(rows, u.tolist()):
+                    r["uncertainty"] = round(float(x), 4)
+                    r.pop("image_path", None)
+                sb.rpc("apply_sample_predictions", {"p_rows": rows}).execute()
+            cp["last_id"] = page[-1]["id"]
+            cp["processed"] += len(rows)
+            cp["skipped"] = cp.get("skipped", 0) + len(page) - len(rows)
+            save_checkpoint(sb, cp)
+            print(f"backfill: {cp['processed']} samples (last id {cp['last_id']})")
+            if limit and cp["processed"] >= limit:
+                break
+            busy = time.time() - t0
+            time.sleep(busy * (1 - max_duty) / max_duty)
+        else:
+            cp["done"] = True
+            save_checkpoint(sb, cp)
+    return {**cp, "seconds": round(time.time() - t_start, 1)}
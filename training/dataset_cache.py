@@ -0,0 +1,93 @@
+"""
+版本化的本地資料集快取
+
+Roboflow 下載與 dataset_samples 匯出共用同一個目錄結構：
+
+    <cache>/datasets/roboflow/<workspace>/<project>/v<version>/
+    <cache>/datasets/samples/<name>/
+
+每個資料集根目錄有 manifest.json（來源、鍵、每個檔案的 sha256 與大小），
+快取命中時只需驗證大小；offline 模式只用快取，不連線。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+CACHE_DIR = Path(os.getenv("DATASET_CACHE_DIR", "/tmp/shoes-ngo-cache"))
+MANIFEST = "manifest.json"
+
+
+class DatasetCacheMiss(RuntimeError):
+    pass
+
+
+def dataset_dir(source: str, *parts, root: Path = CACHE_DIR) -> Path:
+    return Path(root) / "datasets" / source / Path(*[str(p) for p in parts])
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_manifest(path: Path, meta: dict, checksums: dict | None = None) -> dict:
+    """checksums 可由呼叫端提供（例如內容定址的檔名），省去重新雜湊。"""
+    path = Path(path)
+    files = {}
+    for p in sorted(path.rglob("*")):
+        if not p.is_file() or p.name == MANIFEST:
+            continue
+        rel = p.relative_to(path).as_posix()
+        sha = (checksums or {}).get(rel) or sha256_file(p)
+        files[rel] = {"sha256": sha, "size": p.stat().st_size}
+    manifest = {
+        **meta,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "file_count": len(files),
+        "bytes": sum(f["size"] for f in files.values()),
+        "files": files,
+    }
+    (path / MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False, indent=1))
+    return manifest
+
+
+def verify(path: Path, checksums: bool = False) -> bool:
+    path = Path(path)
+    mf = path / MANIFEST
+    if not mf.exists():
+        return False
+    files = json.loads(mf.read_text()).get("files", {})
+    for rel, info in files.items():
+        p = path / rel
+        if not p.is_file() or p.stat().st_size != info["size"]:
+            return False
+        if checksums and sha256_file(p) != info["sha256"]:
+            return False
+    return True
+
+
+def get_or_fetch(path: Path, fetch, meta: dict, offline=False, checksums=False):
+    """
+    命中且驗證通過就直接回傳；否則呼叫 fetch(tmp_dir) 下載到暫存目錄，
+    寫入 manifest 後原子性地換上。offline 時未命中會拋出 DatasetCacheMiss。
+    """
+    path = Path(path)
+    if verify(path, checksums):
+        return path, True
+    if offline:
+        raise DatasetCacheMiss(f"dataset not cached (offline): {path}")
+    tmp = path.with_name(path.name + ".part")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    fetch(tmp)
+    write_manifest(tmp, meta)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path, False
@@ -0,0 +1,156 @@
+"""
+以 pHash 做近重複分群與無洩漏切分
+
+完全相同的 hash 先以 np.unique 合併。64-bit pHash 切成 max_dist+1 個 band；
+依鴿籠原理，漢明距離 <= max_dist 的兩張圖至少有一個 band 完全相同。每個 band
+排序後只比較同 bucket 內的配對（向量化），已在同一群的配對先濾掉，再以
+scipy 的 connected_components 合併成群。超大 bucket（例如全黑圖）只比較排序後
+window 內的鄰居，避免退化成平方時間。
+"""
+
+import hashlib
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+MAX_DIST = 4
+MAX_WINDOW = 256
+
+
+def phash_to_u64(phashes) -> np.ndarray:
+    return np.array([int(p, 16) for p in phashes], dtype=np.uint64)
+
+
+if hasattr(np, "bitwise_count"):
+
+    def popcount(x: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(x)
+
+else:
+    _POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(x: np.ndarray) -> np.ndarray:
+        b = x.astype(np.uint64).view(np.uint8).reshape(-1, 8)
+        return _POP8[b].sum(axis=1)
+
+
+def _merge(labels: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """把 a[i]-b[i] 的邊併進既有分群 labels（值域 0..m-1），回傳新的分群。"""
+    m = len(labels)
+    g = coo_matrix(
+        (np.ones(len(a), dtype=np.int8), (labels[a], labels[b])), shape=(m, m)
+    )
+    return connected_components(g, directed=False)[1][labels]
+
+
+def _representatives(labels: np.ndarray) -> np.ndarray:
+    """每個樣本所屬群的代表 index（群內最小 index）。"""
+    _, first = np.unique(labels, return_index=True)
+    rep = np.empty(labels.max() + 1, dtype=np.int64)
+    rep[labels[first]] = first
+    return rep[labels]
+
+
+def bands(max_dist: int):
+    n = max_dist + 1
+    width, extra = divmod(64, n)
+    shift = 0
+    for i in range(n):
+        w = width + (1 if i < extra else 0)
+        yield shift, (1 << w) - 1
+        shift += w
+
+
+def cluster(hashes: np.ndarray, max_dist: int = MAX_DIST, window: int = MAX_WINDOW):
+    """回傳每個樣本的群代表 index（群內最小 index）。"""
+    n = len(hashes)
+    if n < 2:
+        return np.arange(n)
+    uniq, inv = np.unique(hashes, return_inverse=True)
+    m = len(uniq)
+    labels = np.arange(m)
+    pend_a, pend_b, pending = [], [], 0
+    for shift, mask in bands(max_dist):
+        key = (uniq >> np.uint64(shift)) & np.uint64(mask)
+        order = np.argsort(key, kind="stable")
+        skey, sh = key[order], uniq[order]
+        for k in range(1, min(window, m - 1) + 1):
+            idx = np.nonzero(skey[:-k] == skey[k:])[0]
+            if not len(idx):
+                break
+            idx = idx[popcount(sh[idx] ^ sh[idx + k]) <= max_dist]
+            x, y = order[idx], order[idx + k]
+            keep = labels[x] != labels[y]
+            if keep.any():
+                pend_a.append(x[keep])
+                pend_b.append(y[keep])
+                pending += int(keep.sum())
+            # 累積夠多邊就先合併，之後已同群的配對會在上面被濾掉
+            if pending >= m:
+                labels = _merge(labels, np.concatenate(pend_a), np.concatenate(pend_b))
+                pend_a, pend_b, pending = [], [], 0
+    if pending:
+        labels = _merge(labels, np.concatenate(pend_a), np.concatenate(pend_b))
+    return _representatives(labels[inv])
+
+
+def cluster_split(key: str, val_ratio: float) -> str:
+    h = int(hashlib.md5(key.encode()).hexdigest()[:8], 16)
+    return "val" if (h % 10000) < val_ratio * 10000 else "train"
+
+
+def group_keys(rows, max_dist: int = MAX_DIST) -> dict:
+    """
+    rows 需含 id、phash、created_at、item_id。回傳 id -> 群鍵；holdout 與
+    train/val 都依群鍵切分。群為 pHash 近重複群與同一件 item 的各視角（不同角度
+    的 pHash 不相近）的聯集，整群不會分散到兩邊。群鍵取群內最早建立的樣本 id，
+    新樣本加入既有群時鍵不變。
+    """
+    rows = sorted(rows, key=lambda r: (r.get("created_at") or "", r["id"]))
+    if not rows:
+        return {}
+    hashed = np.array([i for i, r in enumerate(rows) if r.get("phash")], dtype=np.int64)
+    labels = np.arange(len(rows))
+    if len(hashed):
+        reps = cluster(phash_to_u64([rows[i]["phash"] for i in hashed]), max_dist)
+        labels[hashed] = hashed[reps]
+    first, a, b = {}, [], []
+    for i, r in enumerate(rows):
+        item = r.get("item_id")
+        if item is None:
+            continue
+        if item in first:
+            a.append(first[item])
+            b.append(i)
+        else:
+            first[item] = i
+    if a:
+        labels = _representatives(_merge(labels, np.array(a), np.array(b)))
+    return {r["id"]: rows[c]["id"] for r, c in zip(rows, labels.tolist())}
+
+
+def plan_splits(rows, keys: dict, mode: str = "drop", val_ratio: float = 0.2):
+    """
+    rows 需含 id、phash、blur_score；keys 為 group_keys() 的結果。回傳
+    (plan, stats)，plan[id] 為 "train"/"val"，或 None 表示該樣本為重複而略過。
+    mode="drop" 每群只留最清晰的一張；mode="group" 全留但整群同一邊。
+    沒有 pHash 的樣本不在 plan 中，由呼叫端依群鍵用預設切分。
+    """
+    rows = [r for r in rows if r.get("phash")]
+    if not rows:
+        return {}, {"samples": 0, "clusters": 0, "dropped": 0}
+    labels = cluster(phash_to_u64([r["phash"] for r in rows]))
+    blur = np.array([r.get("blur_score") or 0.0 for r in rows])
+    best = {}
+    for i, c in enumerate(labels.tolist()):
+        if c not in best or blur[i] > blur[best[c]]:
+            best[c] = i
+    plan, dropped = {}, 0
+    for i, c in enumerate(labels.tolist()):
+        if mode == "drop" and best[c] != i:
+            plan[rows[i]["id"]] = None
+            dropped += 1
+        else:
+            plan[rows[i]["id"]] = cluster_split(keys[rows[i]["id"]], val_ratio)
+    return plan, {"samples": len(rows), "clusters": len(best), "dropped": dropped}
@@ -0,0 +1,124 @@
+"""
+候選模型評估：固定 holdout 上的準確率/F1，加上 serving backend 的延遲與記憶體
+
+holdout 由 exporter.in_holdout() 依近重複群鍵決定，整群永遠不進訓練資料。候選與目前正式模型
+在同一份 holdout、同一台機器上量測，結果寫入 metrics_json["eval"]，
+approve_run 依此把關。
+"""
+
+import os
+import resource
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from exporter import (
+    EXPORT_WORKERS,
+    LABEL_COLUMN,
+    ObjectCache,
+    in_holdout,
+    iter_labeled,
+    load_group_keys,
+    resolver,
+)
+
+IMGSZ = 640  # 與 inference/app.py 的 yolo_cls 相同
+BATCH_SIZES = (1, 8)
+BENCH_ITERS = 10
+MAX_HOLDOUT = 2000
+
+
+def load_holdout(sb, stage: str, limit: int = MAX_HOLDOUT):
+    col = LABEL_COLUMN[stage]
+    keys = load_group_keys(sb, stage)
+    rows = []
+    for page in iter_labeled(sb, stage):
+        rows.extend(r for r in page if in_holdout(keys.get(r["id"], r["id"])))
+        if len(rows) >= limit:
+            break
+    resolve = resolver(sb, ObjectCache())
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+        items = [
+            (str(p), row[col])
+            for row, p, _ in pool.map(resolve, rows[:limit])
+            if p is not None
+        ]
+    return items
+
+
+def classification_metrics(y_true, y_pred):
+    labels = sorted(set(y_true))
+    f1s = []
+    for c in labels:
+        tp = sum(1 for t, p in zip(y_true, y_pred) if t == c and p == c)
+        fp = sum(1 for t, p in zip(y_true, y_pred) if t != c and p == c)
+        fn = sum(1 for t, p in zip(y_true, y_pred) if t == c and p != c)
+        prec = tp / (tp + fp) if tp + fp else 0.0
+        rec = tp / (tp + fn) if tp + fn else 0.0
+        f1s.append(2 * prec * rec / (prec + rec) if prec + rec else 0.0)
+    acc = sum(t == p for t, p in zip(y_true, y_pred)) / len(y_true)
+    return {"acc": round(acc, 4), "f1": round(sum(f1s) / len(f1s), 4)}
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark(model, images, batch_sizes=BATCH_SIZES, iters=BENCH_ITERS):
+    out = {}
+    for bs in batch_sizes:
+        batch = (images * bs)[:bs]
+        for _ in range(2):
+            model.predict(batch, imgsz=IMGSZ, verbose=False)
+        per_image = []
+        for _ in range(iters):
+            t0 = time.perf_counter()
+            model.predict(batch, imgsz=IMGSZ, verbose=False)
+            per_image.append((time.perf_counter() - t0) * 1000 / bs)
+        per_image.sort()
+        out[f"bs{bs}"] = {
+            "p50_ms": round(statistics.median(per_image), 2),
+            "p95_ms": round(per_image[min(len(per_image) - 1, int(0.95 * iters))], 2),
+        }
+    return out
+
+
+def evaluate_weights(weights: str, holdout, device: str | None = None):
+    import torch
+    from PIL import Image
+    from ultralytics import YOLO
+
+    rss0 = _rss_mb()
+    model = YOLO(weights)
+    kw = {"device": device} if device else {}
+    names = model.names
+    y_true, y_pred = [], []
+    for i in range(0, len(holdout), 32):
+        chunk = holdout[i : i + 32]
+        res = model.predict([p for p, _ in chunk], imgsz=IMGSZ, verbose=False, **kw)
+        for (_, label), r in zip(chunk, res):
+            y_true.append(label)
+            y_pred.append(names[int(r.probs.top1)])
+    out = classification_metrics(y_true, y_pred) if y_true else {}
+    imgs = [Image.open(p).convert("RGB") for p, _ in holdout[:8]]
+    if imgs:
+        out["latency"] = benchmark(model, imgs)
+    out["rss_mb"] = round(_rss_mb() - rss0, 1)
+    if torch.cuda.is_available():
+        out["cuda_peak_mb"] = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+    return out
+
+
+def evaluate_candidate(sb, stage: str, weights: str, production: str | None):
+    holdout = load_holdout(sb, stage)
+    if not holdout:
+        return {"holdout": 0}
+    report = {"holdout": len(holdout), "imgsz": IMGSZ}
+    report["candidate"] = evaluate_weights(weights, holdout)
+    if production:
+        report["production"] = evaluate_weights(production, holdout)
+    return report
@@ -0,0 +1,263 @@
+"""
+增量、內容定址的訓練資料匯出
+
+dataset_samples 中已標註的影像依 id 分頁串流讀出，以有上限的 thread pool
+平行下載到本地快取 objects/<sha256[:2]>/<sha256><ext>；同一 image_path
+只會下載一次。每次匯出用 hardlink 組出 YOLO 分類資料夾：
+
+    <cache>/datasets/samples/<name>/{train,val}/<class>/<sha256><ext>
+
+因此匯出時間只與新增的樣本數成正比。資料夾與 Roboflow 下載共用
+dataset_cache 的結構與 manifest。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dataset_cache import CACHE_DIR, MANIFEST, dataset_dir, verify, write_manifest
+from dedup import group_keys
+
+STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "samples")
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "8"))
+PAGE_SIZE = 1000
+SAVE_EVERY_PAGES = 50  # 中途存一次索引，中斷時不必重新下載太多
+HOLDOUT_RATIO = float(os.getenv("HOLDOUT_RATIO", "0.1"))
+LABEL_COLUMN = {"stage1": "label_stage1", "stage2": "label_stage2"}
+GROUP_COLUMNS = "id,item_id,phash,created_at"  # dedup.group_keys() 需要的欄位
+
+
+class ObjectCache:
+    """以 sha256 為鍵的本地物件快取，另存 image_path -> sha256 索引。"""
+
+    def __init__(self, root: Path = CACHE_DIR):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index.json"
+        self.index = (
+            json.loads(self.index_path.read_text()) if self.index_path.exists() else {}
+        )
+        self.dirty = False
+
+    def path_for(self, sha: str, ext: str) -> Path:
+        return self.objects / sha[:2] / f"{sha}{ext}"
+
+    def lookup(self, key: str) -> Path | None:
+        hit = self.index.get(key)
+        if hit:
+            p = self.path_for(hit["sha256"], hit["ext"])
+            if p.exists():
+                return p
+        return None
+
+    def put(self, key: str, data: bytes, ext: str) -> Path:
+        sha = hashlib.sha256(data).hexdigest()
+        p = self.path_for(sha, ext)
+        if not p.exists():
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_suffix(p.suffix + ".part")
+            tmp.write_bytes(data)
+            os.replace(tmp, p)
+        self.index[key] = {"sha256": sha, "ext": ext}
+        self.dirty = True
+        return p
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.index_path.with_suffix(".json.part")
+        tmp.write_text(json.dumps(self.index))
+        os.replace(tmp, self.index_path)
+        self.dirty = False
+
+
+def fetch_bytes(sb, image_path: str) -> bytes:
+    if image_path.startswith(("http://", "https://", "file://")):
+        with urllib.request.urlopen(image_path, timeout=30) as r:
+            return r.read()
+    if image_path.startswith("s3://"):
+        # inference/image_store.py 的 S3 backend；endpoint 與推論端相同
+        import boto3
+
+        bucket, key = image_path[5:].split("/", 1)
+        client = boto3.client(
+            "s3", endpoint_url=os.getenv("IMAGE_STORE_S3_ENDPOINT") or None
+        )
+        return client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    return sb.storage.from_(STORAGE_BUCKET).download(image_path)
+
+
+def iter_labeled(sb, stage: str, page_size: int = PAGE_SIZE, columns: str = ""):
+    col = LABEL_COLUMN[stage]
+    last = None
+    while True:
+        q = (
+            sb.table("dataset_samples")
+            .select(columns or f"id,image_path,phash,created_at,{col}")
+            .eq("is_labeled", True)
+            .eq("image_missing", False)
+            .not_.is_("image_path", "null")
+            .not_.is_(col, "null")
+        )
+        if last:
+            q = q.gt("id", last)
+        rows = q.order("id").limit(page_size).execute().data
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]["id"]
+        if len(rows) < page_size:
+            return
+
+
+def resolver(sb, cache: ObjectCache):
+    """回傳 resolve(row) -> (row, 本地路徑或 None, 是否新下載)。"""
+
+    def resolve(row):
+        p = cache.lookup(row["image_path"])
+        if p is not None:
+            return row, p, False
+        try:
+            data = fetch_bytes(sb, row["image_path"])
+        except Exception:
+            return row, None, False
+        ext = Path(row["image_path"].split("?")[0]).suffix.lower() or ".jpg"
+        return row, cache.put(row["image_path"], data, ext), True
+
+    return resolve
+
+
+def load_group_keys(sb, stage: str) -> dict:
+    """已標註樣本的 id -> 群鍵（見 dedup.group_keys），只讀輕量欄位。"""
+    return group_keys(
+        [r for page in iter_labeled(sb, stage, columns=GROUP_COLUMNS) for r in page]
+    )
+
+
+def in_holdout(key: str, ratio: float = HOLDOUT_RATIO) -> bool:
+    """
+    固定的評估集：永遠不進 train/val，供 evaluate.py 比較候選與正式模型。
+    key 為群鍵，整群近重複圖一起進出 holdout。
+    """
+    h = int(hashlib.md5(("holdout:" + key).encode()).hexdigest()[:8], 16)
+    return (h % 10000) < ratio * 10000
+
+
+def default_split(key: str, val_ratio: float) -> str:
+    h = int(hashlib.md5(key.encode()).hexdigest()[:8], 16)
+    return "val" if (h % 10000) < val_ratio * 10000 else "train"
+
+
+def safe_label(label) -> str | None:
+    """標籤直接當資料夾名稱；含路徑分隔或 . / .. 的一律拒絕。"""
+    label = str(label).strip() if label is not None else ""
+    if not label or label in (".", "..") or any(c in label for c in "/\\\0"):
+        return None
+    return label
+
+
+def link_into(src: Path, dst: Path) -> bool:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        return False
+    except OSError:
+        shutil.copy2(src, dst)
+    return True
+
+
+def export_dataset(
+    sb,
+    stage: str,
+    name: str | None = None,
+    val_ratio: float = 0.2,
+    split_of=None,
+    cache: ObjectCache | None = None,
+    workers: int = EXPORT_WORKERS,
+    keys: dict | None = None,
+):
+    """
+    匯出 stage1/stage2 的 YOLO 分類資料夾。split_of(row) 可覆寫切分方式
+    （回傳 "train"/"val"，或 None 表示略過該樣本）；keys 為群鍵，未提供時
+    自行載入。回傳資料夾與統計。
+    """
+    cache = cache or ObjectCache()
+    keys = load_group_keys(sb, stage) if keys is None else keys
+    col = LABEL_COLUMN[stage]
+    out = dataset_dir("samples", name or stage, root=cache.root)
+    if out.exists():
+        shutil.rmtree(out)
+    stats = {"rows": 0, "downloaded": 0, "cached": 0, "skipped": 0, "failed": 0}
+    stats["holdout"] = stats["bad_label"] = 0
+    classes, sources = {}, {}
+    resolve = resolver(sb, cache)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page, rows in enumerate(iter_labeled(sb, stage), 1):
+            stats["rows"] += len(rows)
+            kept = [r for r in rows if not in_holdout(keys.get(r["id"], r["id"]))]
+            stats["holdout"] += len(rows) - len(kept)
+            for row, p, fresh in pool.map(resolve, kept):
+                if p is None:
+                    stats["failed"] += 1
+                    continue
+                stats["downloaded" if fresh else "cached"] += 1
+                split = (
+                    split_of(row)
+                    if split_of
+                    else default_split(keys.get(row["id"], row["id"]), val_ratio)
+                )
+                if split is None:
+                    stats["skipped"] += 1
+                    continue
+                label = safe_label(row[col])
+                if label is None:
+                    stats["bad_label"] += 1
+                    continue
+                dst = out / split / label / p.name
+                if link_into(p, dst):
+                    classes.setdefault(label, {"train": 0, "val": 0})[split] += 1
+                    sources[dst.relative_to(out).as_posix()] = row["image_path"]
+            if page % SAVE_EVERY_PAGES == 0:
+                cache.save()
+    cache.save()
+    if out.exists():
+        # 檔名即 sha256，manifest 不必重新雜湊
+        sums = {
+            p.relative_to(out).as_posix(): p.stem for p in out.rglob("*") if p.is_file()
+        }
+        # sources 記下每個檔案的 image_path，之後可在別台機器重建同一份快照
+        meta = {"source": "samples", "stage": stage, "classes": classes}
+        write_manifest(out, {**meta, "sources": sources}, sums)
+    return {"path": str(out), "stats": stats, "classes": classes}
+
+
+def restore_snapshot(sb, manifest: dict, name: str, cache=None, workers=EXPORT_WORKERS):
+    """依 manifest 重建完全相同的匯出資料夾（續跑訓練時使用）。"""
+    cache = cache or ObjectCache()
+    out = dataset_dir("samples", name, root=cache.root)
+    sources = manifest.get("sources", {})
+    if (
+        verify(out)
+        and json.loads((out / MANIFEST).read_text()).get("sources") == sources
+    ):
+        return {"path": str(out), "classes": manifest.get("classes", {})}
+    shutil.rmtree(out, ignore_errors=True)
+    resolve = resolver(sb, cache)
+    rows = [{"image_path": src, "rel": rel} for rel, src in sources.items()]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for row, p, _ in pool.map(resolve, rows):
+            if p is None:
+                raise RuntimeError(f"snapshot image unavailable: {row['image_path']}")
+            link_into(p, out / row["rel"])
+    cache.save()
+    sums = {rel: info["sha256"] for rel, info in manifest.get("files", {}).items()}
+    meta = {k: manifest[k] for k in ("source", "stage", "classes") if k in manifest}
+    write_manifest(out, {**meta, "sources": sources}, sums)
+    return {"path": str(out), "classes": manifest.get("classes", {})}
@@ -1,17 +1,66 @@
 import argparse
+import hashlib
 import json
 import os
 import time
-import uuid
+from pathlib import Path
 
 from supabase import create_client
 
-# 可選：from ultralytics import YOLO  或 subprocess 呼叫 `yolo` CLI
+from backfill import backfill
+from dedup import group_keys, plan_splits
+from evaluate import evaluate_candidate
+from dataset_cache import MANIFEST
+from exporter import (
+    CACHE_DIR,
+    GROUP_COLUMNS,
+    default_split,
+    export_dataset,
+    iter_labeled,
+    restore_snapshot,
+)
+from scoring import rescore
+from sweep import run_sweep
+from worker import Lease, LeaseLost, claim, resume_from, run_forever, worker_id
+
+# ultralytics 只在實際訓練時才 import，--rescore 等指令不需載入 torch
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+ARTIFACT_BUCKET = os.getenv("ARTIFACT_BUCKET", "models")
+RUNS_DIR = Path(os.getenv("RUNS_DIR", "/tmp/shoes-ngo-runs"))
+CHECKPOINT_EVERY_S = int(os.getenv("CHECKPOINT_EVERY_S", "300"))
 sb = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+BASE_WEIGHTS = "yolov8n-cls.pt"
+FULL_PARAMS = {"seed": 42, "epochs": 80, "imgsz": 640, "optimizer": "adamw"}
+# 從 registry 模型 warm start：短排程、小學習率、舊資料只重播一部分
+INCREMENTAL_PARAMS = {
+    "epochs": 15,
+    "lr0": 0.0005,
+    "warmup_epochs": 0,
+    "patience": 5,
+    "replay_ratio": 0.3,
+}
+TRAIN_KEYS = (
+    "epochs",
+    "imgsz",
+    "batch",
+    "seed",
+    "optimizer",
+    "lr0",
+    "warmup_epochs",
+    "patience",
+    "freeze",
+    "workers",
+    "device",
+)
+OPTIMIZERS = {"adamw": "AdamW", "adam": "Adam", "sgd": "SGD", "auto": "auto"}
+
+
+# 以下讀取決定是否訓練、warm start 的 parent 與評估基準，一律直接讀資料庫：
+# approve_run 在推論服務中，無法讓這個 process 的快取失效
+
 
 def load_thresholds():
     r = (
@@ -25,15 +74,33 @@ def load_thresholds():
     return r["value"] if r else {"min_new_samples": 200, "min_label_ratio": 0.7}
 
 
-def count_candidates():
-    total = (
-        sb.table("dataset_samples")
-        .select("id", count="exact")
-        .eq("is_labeled", True)
+def load_stats():
+    # dataset_stats 由 trigger 增量維護（見 infra/supabase.sql），O(1) 讀取
+    rows = (
+        sb.table("dataset_stats")
+        .select("total,labeled,candidates,updated_at")
+        .eq("key", "all")
         .execute()
-        .count
+        .data
     )
-    all_rows = sb.table("dataset_samples").select("id", count="exact").execute().count
+    return rows[0] if rows else rebuild_stats()
+
+
+def rebuild_stats():
+    return sb.rpc("rebuild_dataset_stats", {}).execute().data
+
+
+def load_label_counts():
+    rows = sb.table("dataset_label_counts").select("stage,label,n").execute().data
+    out = {}
+    for r in rows:
+        out.setdefault(r["stage"], {})[r["label"]] = r["n"]
+    return out
+
+
+def count_candidates():
+    st = load_stats()
+    total, all_rows = st["labeled"], st["total"]
     ratio = (total / all_rows) if all_rows else 0.0
     return total, ratio
 
@@ -43,10 +110,11 @@ def start_run(meta):
         sb.table("training_runs")
         .insert(
             {
-                "status": "running",
+                "status": "queued",
                 "triggered_by": meta.get("triggered_by", "auto"),
                 "data_count": meta["data_count"],
                 "params_json": meta["params"],
+                "parent_model_id": meta.get("parent_model_id"),
             }
         )
         .execute()
@@ -55,50 +123,355 @@ def start_run(meta):
 
 
 def finish_run(run_id, status, metrics=None, artifacts=None, err=None):
-    sb.table("training_runs").update(
-        {
-            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-            "status": status,
-            "metrics_json": metrics or {},
-            "artifacts": artifacts or {},
-            "error_msg": err,
+    row = {
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "status": status,
+        "error_msg": err,
+    }
+    # 失敗時不覆寫 artifacts，保留 checkpoint 供下次續跑
+    if metrics is not None:
+        row["metrics_json"] = metrics
+    if artifacts is not None:
+        row["artifacts"] = artifacts
+    sb.table("training_runs").update(row).eq("id", run_id).execute()
+
+
+def upload_artifact(local, key):
+    opts = {"upsert": "true", "content-type": "application/octet-stream"}
+    with open(local, "rb") as f:
+        sb.storage.from_(ARTIFACT_BUCKET).upload(key, f.read(), opts)
+    return key
+
+
+def fetch_artifact(key, fresh=False):
+    if Path(key).exists():
+        return str(key)
+    local = CACHE_DIR / "artifacts" / key
+    if fresh or not local.exists():
+        local.parent.mkdir(parents=True, exist_ok=True)
+        local.write_bytes(sb.storage.from_(ARTIFACT_BUCKET).download(key))
+    return str(local)
+
+
+def latest_model(stage):
+    rows = (
+        sb.table("model_registry")
+        .select("id,model_name,stage,run_id,artifacts,created_at")
+        .eq("stage", stage)
+        .order("created_at", desc=True)
+        .limit(1)
+        .execute()
+        .data
+    )
+    return rows[0] if rows else None
+
+
+def resolve_params(params):
+    """
+    mode="incremental"（或 auto 且 registry 已有模型）時從最新核可模型接續。
+    回傳補齊後的 params 與 parent registry row。
+    """
+    stage = params.get("stage", "stage2")
+    mode = params.get("mode", "auto")
+    parent = latest_model(stage) if mode in ("auto", "incremental") else None
+    if mode == "incremental" and not parent:
+        raise RuntimeError(f"no approved {stage} model to warm start from")
+    if not parent:
+        return {**FULL_PARAMS, **params, "mode": "full"}, None
+    parent_run = (
+        sb.table("training_runs")
+        .select("started_at")
+        .eq("id", parent["run_id"])
+        .single()
+        .execute()
+        .data
+        if parent.get("run_id")
+        else None
+    )
+    out = {**FULL_PARAMS, **INCREMENTAL_PARAMS, **params, "mode": "incremental"}
+    out["parent_cutoff"] = parent_run["started_at"] if parent_run else None
+    return out, parent
+
+
+def dedup_plan(stage, mode, val_ratio=0.2):
+    """回傳 (split_of, dedup 統計, 群鍵)；mode="off" 時仍依群鍵切分，只是不丟重複。"""
+    rows = [
+        r
+        for page in iter_labeled(sb, stage, columns=GROUP_COLUMNS + ",blur_score")
+        for r in page
+    ]
+    keys = group_keys(rows)
+    plan, stats = (
+        plan_splits(rows, keys, mode=mode, val_ratio=val_ratio)
+        if mode != "off"
+        else ({}, None)
+    )
+
+    def split_of(row):
+        if row["id"] in plan:
+            return plan[row["id"]]
+        return default_split(keys.get(row["id"], row["id"]), val_ratio)
+
+    return split_of, stats, keys
+
+
+def with_replay(split_of, cutoff, ratio, val_ratio=0.2):
+    """cutoff 之前的舊樣本只有 ratio 比例進 train；val 保持完整以便比較。"""
+    base = split_of or (lambda row: default_split(row["id"], val_ratio))
+
+    def wrapped(row):
+        split = base(row)
+        if split != "train" or not cutoff or (row.get("created_at") or "") >= cutoff:
+            return split
+        h = int(hashlib.md5(("replay:" + row["id"]).encode()).hexdigest()[:8], 16)
+        return split if (h % 10000) < ratio * 10000 else None
+
+    return wrapped
+
+
+def checkpointer(run_id, artifacts, every_s=CHECKPOINT_EVERY_S):
+    """on_model_save callback：定期把 last.pt（含 optimizer 狀態）上傳到 artifacts。"""
+    state = {"t": time.time()}
+
+    def cb(trainer):
+        now = time.time()
+        if now - state["t"] < every_s:
+            return
+        state["t"] = now
+        key = upload_artifact(trainer.last, f"runs/{run_id}/checkpoint/last.pt")
+        artifacts["checkpoint"] = {
+            "weights": key,
+            "epoch": trainer.epoch + 1,
+            "at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         }
-    ).eq("id", run_id).execute()
+        sb.table("training_runs").update({"artifacts": artifacts}).eq(
+            "id", run_id
+        ).execute()
+
+    return cb
+
+
+def train_yolo(
+    data_dir, params, init_weights, name, on_epoch=None, on_save=None, resume=False
+):
+    from ultralytics import YOLO
+
+    args = {k: params[k] for k in TRAIN_KEYS if k in params}
+    if "optimizer" in args:
+        args["optimizer"] = OPTIMIZERS.get(str(args["optimizer"]).lower(), "auto")
+    model = YOLO(init_weights)
+    if on_epoch:
+        model.add_callback("on_fit_epoch_end", on_epoch)
+    if on_save:
+        model.add_callback("on_model_save", on_save)
+    if resume:
+        # 參數（含 epoch、optimizer 狀態）由 checkpoint 還原
+        model.train(resume=True, data=data_dir)
+    else:
+        model.train(
+            data=data_dir, project=str(RUNS_DIR), name=name, exist_ok=True, **args
+        )
+    best = Path(model.trainer.save_dir) / "weights" / "best.pt"
+    m = YOLO(str(best)).val(data=data_dir, split="val", verbose=False)
+    return best, {"acc": float(m.top1), "top5": float(m.top5)}
+
+
+def prepare_data(meta):
+    """匯出這次 run 的資料快照；續跑時依快照 manifest 重建同一份資料。"""
+    params, run_id = meta["params"], meta["run_id"]
+    stage = params.get("stage", "stage2")
+    name = f"{stage}-{run_id}"
+    resume = meta.get("resume")
+    if resume:
+        with open(fetch_artifact(resume["snapshot"])) as f:
+            exported = restore_snapshot(sb, json.load(f), name)
+        return exported, resume.get("dedup"), resume["snapshot"]
+    # dedup: "drop" 每群留一張；"group" 全留但整群同切分；"off" 不處理
+    mode = params.get("dedup", "drop")
+    split_of, dedup_stats, keys = dedup_plan(stage, mode)
+    if params.get("mode") == "incremental":
+        split_of = with_replay(
+            split_of, params.get("parent_cutoff"), params["replay_ratio"]
+        )
+    exported = export_dataset(sb, stage, name=name, split_of=split_of, keys=keys)
+    print(json.dumps({**exported["stats"], "dedup": dedup_stats}, ensure_ascii=False))
+    snapshot = upload_artifact(
+        Path(exported["path"]) / MANIFEST, f"runs/{run_id}/dataset_manifest.json"
+    )
+    return exported, dedup_stats, snapshot
+
+
+def evaluate_run(stage, weights):
+    """holdout 準確率/F1 與延遲，並在同一台機器上量測目前正式模型作為基準。"""
+    prod = latest_model(stage)
+    prod_weights = fetch_artifact(prod["artifacts"]["weights"]) if prod else None
+    report = evaluate_candidate(sb, stage, weights, prod_weights)
+    report["production_model_id"] = prod["id"] if prod else None
+    return report
 
 
 def train_and_export(meta):
-    # TODO: 匯出資料、訓練 YOLO、生成 best.pt 與 metrics.json
-    # 這裡先放假資料骨架
-    weights_path = f"/tmp/best_{uuid.uuid4().hex}.pt"
-    metrics = {"f1": 0.84, "acc": 0.90}
-    artifacts = {"weights": weights_path, "metrics": "/tmp/metrics.json"}
+    params = meta["params"]
+    run_id = meta["run_id"]
+    stage = params.get("stage", "stage2")
+    exported, dedup_stats, snapshot = prepare_data(meta)
+    resume = meta.get("resume")
+    progress = {**(resume or {}), "snapshot": snapshot, "dedup": dedup_stats}
+    sb.table("training_runs").update({"artifacts": progress}).eq("id", run_id).execute()
+
+    init_weights = BASE_WEIGHTS
+    if resume:
+        local = RUNS_DIR / run_id / "weights" / "last.pt"
+        init_weights = (
+            str(local)
+            if local.exists()
+            else fetch_artifact(resume["checkpoint"]["weights"], fresh=True)
+        )
+    elif params.get("mode") == "incremental":
+        init_weights = fetch_artifact(meta["parent"]["artifacts"]["weights"])
+
+    t0 = time.time()
+    if params.get("sweep"):
+        top, trials = run_sweep(sb, run_id, exported["path"], params, init_weights)
+        best, metrics = top["best"], {**top["metrics"], "best_trial": top["id"]}
+        metrics["sweep"] = trials
+    else:
+        best, metrics = train_yolo(
+            exported["path"],
+            params,
+            init_weights,
+            run_id,
+            on_epoch=meta.get("on_epoch"),
+            on_save=checkpointer(run_id, progress),
+            resume=bool(resume),
+        )
+    metrics["train_seconds"] = round(time.time() - t0, 1)
+    key = upload_artifact(best, f"runs/{run_id}/{stage}_best.pt")
+    try:
+        metrics["eval"] = evaluate_run(stage, str(best))
+    except Exception as e:
+        # 權重已上傳；評估失敗只記錄下來，approve_run 的 gate 會拒絕，
+        # 之後可用 --evaluate 重跑
+        metrics["eval"] = {"error": f"{type(e).__name__}: {e}"}
+    artifacts = {
+        "weights": key,
+        f"{stage}_weights": key,
+        "snapshot": snapshot,
+        "dataset": {
+            "path": exported["path"],
+            "classes": exported["classes"],
+            "dedup": dedup_stats,
+        },
+    }
     return {"metrics": metrics, "artifacts": artifacts}
 
 
+def execute_run(run, params, lease=None):
+    resume = resume_from(run)
+    if resume:
+        # 有 checkpoint：沿用原本的 params 與資料快照續跑
+        parent = None
+        sb.table("training_runs").update({"status": "running", "error_msg": None}).eq(
+            "id", run["id"]
+        ).execute()
+        print(f"Resuming run {run['id']} from epoch {resume['checkpoint']['epoch']}")
+    else:
+        params, parent = resolve_params(params)
+        sb.table("training_runs").update(
+            {"params_json": params, "parent_model_id": parent["id"] if parent else None}
+        ).eq("id", run["id"]).execute()
+    try:
+        meta = {"params": params, "run_id": run["id"], "parent": parent}
+        meta.update(resume=resume, on_epoch=lease.on_epoch if lease else None)
+        r = train_and_export(meta)
+        if lease and lease.lost:
+            raise LeaseLost(run["id"])
+        finish_run(
+            run["id"], "pending_review", metrics=r["metrics"], artifacts=r["artifacts"]
+        )
+    except LeaseLost:
+        # 另一個 worker 已接手（本機 lease 過期），不要覆寫它的狀態
+        print(f"lease lost for run {run['id']}, leaving it to the new owner")
+    except Exception as e:
+        finish_run(run["id"], "failed", err=str(e))
+
+
+def claim_and_execute(run_id):
+    me = worker_id()
+    run = claim(sb, me, run_id)
+    if run is None:
+        print(f"run {run_id} is not claimable (finished or leased by another worker)")
+        return
+    with Lease(sb, run["id"], me) as lease:
+        execute_run(run, run.get("params_json") or {}, lease)
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--run-id", default=None)
+    ap.add_argument("--rebuild-stats", action="store_true")
+    ap.add_argument("--worker", action="store_true", help="常駐領取 queued runs")
+    ap.add_argument("--evaluate", default=None, help="重新評估指定 run（例如在 serving 機器上）")
+    ap.add_argument("--rescore", action="store_true")
+    ap.add_argument("--budget", type=int, default=None)
+    ap.add_argument("--min-uncertainty", type=float, default=0.0)
+    ap.add_argument("--full", action="store_true", help="不 warm start，從頭訓練")
+    ap.add_argument("--sweep", default=None, help="搜尋空間 JSON 檔")
+    ap.add_argument("--trials", type=int, default=None)
+    ap.add_argument(
+        "--backfill", default=None, help="以最新核可模型重新評分，例如 stage2 或 stage1,stage2"
+    )
+    ap.add_argument("--max-duty", type=float, default=0.5, help="backfill 佔用時間比例上限")
     args = ap.parse_args()
 
-    if args.run_id:
+    if args.backfill:
+        weights, models = {}, {}
+        for stage in args.backfill.split(","):
+            row = latest_model(stage)
+            if not row:
+                raise SystemExit(f"no approved {stage} model in registry")
+            weights[stage] = fetch_artifact(row["artifacts"]["weights"])
+            models[stage] = row["id"]
+        report = backfill(sb, weights, models, max_duty=args.max_duty)
+        print(json.dumps(report, ensure_ascii=False))
+        return
+
+    if args.rescore:
+        budget = args.budget or load_thresholds()["min_new_samples"]
+        print(json.dumps(rescore(sb, budget, args.min_uncertainty)))
+        return
+
+    if args.rebuild_stats:
+        print(json.dumps(rebuild_stats(), ensure_ascii=False, default=str))
+        print(json.dumps(load_label_counts(), ensure_ascii=False))
+        return
+
+    if args.evaluate:
         run = (
             sb.table("training_runs")
             .select("*")
-            .eq("id", args.run_id)
+            .eq("id", args.evaluate)
             .single()
             .execute()
             .data
         )
-        try:
-            r = train_and_export({"params": run.get("params_json", {})})
-            finish_run(
-                run["id"],
-                "pending_review",
-                metrics=r["metrics"],
-                artifacts=r["artifacts"],
-            )
-        except Exception as e:
-            finish_run(run["id"], "failed", err=str(e))
+        stage = (run.get("params_json") or {}).get("stage", "stage2")
+        report = evaluate_run(stage, fetch_artifact(run["artifacts"]["weights"]))
+        metrics = {**(run.get("metrics_json") or {}), "eval": report}
+        sb.table("training_runs").update({"metrics_json": metrics}).eq(
+            "id", run["id"]
+        ).execute()
+        print(json.dumps(report, ensure_ascii=False))
+        return
+
+    if args.worker:
+        run_forever(
+            sb, lambda run, lease: execute_run(run, run.get("params_json") or {}, lease)
+        )
+        return
+
+    if args.run_id:
+        claim_and_execute(args.run_id)
         return
 
     th = load_thresholds()
@@ -107,19 +480,17 @@ def main():
         print("Threshold not met, skip.")
         return
 
-    meta = {
-        "triggered_by": "auto",
-        "data_count": total,
-        "params": {"seed": 42, "epochs": 80, "imgsz": 640, "optimizer": "adamw"},
-    }
+    params = {"mode": "full"} if args.full else {}
+    if args.sweep:
+        with open(args.sweep) as f:
+            cfg = json.load(f)
+        cfg = cfg if "space" in cfg else {"space": cfg}
+        if args.trials:
+            cfg["trials"] = args.trials
+        params["sweep"] = cfg
+    meta = {"triggered_by": "auto", "data_count": total, "params": params}
     run = start_run(meta)
-    try:
-        r = train_and_export(meta)
-        finish_run(
-            run["id"], "pending_review", metrics=r["metrics"], artifacts=r["artifacts"]
-        )
-    except Exception as e:
-        finish_run(run["id"], "failed", err=str(e))
+    claim_and_execute(run["id"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+"""
+主動學習不確定度評分
+
+把 dataset_samples 的 stage1_scores/stage2_scores 一次讀成矩陣，以 NumPy
+向量化計算 0.5 * (正規化 entropy + (1 - margin))，與 inference/app.py 的
+uncertainty() 定義一致。門檻或模型變動後重新排序，並在標註預算內挑出
+多樣化的批次：依 pHash 近重複群每群最多一張，且各預測類別輪流入選。
+"""
+
+import math
+
+import numpy as np
+
+from dedup import cluster, phash_to_u64
+from exporter import PAGE_SIZE
+
+COLUMNS = "id,phash,stage1_scores,stage2_scores,stage2_pred,is_labeled"
+DIVERSITY_DIST = 8
+POOL_FACTOR = 5
+
+
+def iter_samples(sb, page_size: int = PAGE_SIZE):
+    last = None
+    while True:
+        q = sb.table("dataset_samples").select(COLUMNS).eq("image_missing", False)
+        if last:
+            q = q.gt("id", last)
+        rows = q.order("id").limit(page_size).execute().data
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]["id"]
+        if len(rows) < page_size:
+            return
+
+
+def score_matrix(dicts, missing: float) -> np.ndarray:
+    """dicts: 每列一個 {class: score} 或 None。回傳每列的不確定度。"""
+    classes = sorted({k for d in dicts if d for k in d})
+    n = len(dicts)
+    if not classes:
+        return np.full(n, missing, dtype=np.float32)
+    col = {c: j for j, c in enumerate(classes)}
+    P = np.zeros((n, len(classes)), dtype=np.float32)
+    has = np.zeros(n, dtype=bool)
+    for i, d in enumerate(dicts):
+        if d:
+            has[i] = True
+            for k, v in d.items():
+                P[i, col[k]] = v
+    P = np.clip(P, 0.0, None)
+    total = P.sum(axis=1, keepdims=True)
+    empty = total[:, 0] <= 0
+    P = np.divide(P, total, out=np.zeros_like(P), where=total > 0)
+
+    k = P.shape[1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ent = -np.where(P > 0, P * np.log(P), 0.0).sum(axis=1)
+    ent = ent / math.log(k) if k > 1 else np.zeros(n, dtype=np.float32)
+    if k > 1:
+        top2 = -np.partition(-P, 1, axis=1)[:, :2]
+        margin = top2[:, 0] - top2[:, 1]
+    else:
+        margin = P[:, 0]
+    u = 0.5 * (ent + (1.0 - margin))
+    u[~has] = missing
+    u[has & empty] = 1.0
+    return u.astype(np.float32)
+
+
+def score_samples(rows) -> np.ndarray:
+    u1 = score_matrix([r.get("stage1_scores") for r in rows], missing=1.0)
+    # stage2 沒跑（非球鞋）不算不確定
+    u2 = score_matrix([r.get("stage2_scores") for r in rows], missing=0.0)
+    return np.maximum(u1, u2)
+
+
+def select_batch(rows, scores: np.ndarray, budget: int, threshold: float = 0.0):
+    """在未標註樣本中挑出最多 budget 筆，兼顧不確定度與多樣性。"""
+    unlabeled = np.array([not r.get("is_labeled") for r in rows])
+    idx = np.nonzero(unlabeled & (scores >= threshold))[0]
+    if budget <= 0 or len(idx) == 0:
+        return []
+    pool = idx[np.argsort(-scores[idx], kind="stable")][: budget * POOL_FACTOR]
+
+    with_hash = [i for i in pool.tolist() if rows[i].get("phash")]
+    group = {}
+    if with_hash:
+        labels = cluster(
+            phash_to_u64([rows[i]["phash"] for i in with_hash]), DIVERSITY_DIST
+        )
+        group = {i: int(c) for i, c in zip(with_hash, labels.tolist())}
+
+    # 先每個預測類別取到上限，剩餘名額再依分數補滿
+    classes = {rows[i].get("stage2_pred") for i in pool.tolist()}
+    cap = math.ceil(budget / max(1, len(classes)))
+    taken, seen, per_class = [], set(), {}
+    for capped in (True, False):
+        for i in pool.tolist():
+            if len(taken) >= budget:
+                break
+            g = group.get(i, ("solo", i))
+            cls = rows[i].get("stage2_pred")
+            if g in seen or (capped and per_class.get(cls, 0) >= cap):
+                continue
+            seen.add(g)
+            per_class[cls] = per_class.get(cls, 0) + 1
+            taken.append(i)
+    return taken
+
+
+def rescore(sb, budget: int, threshold: float = 0.0, chunk: int = 5000):
+    rows = [r for page in iter_samples(sb) for r in page]
+    if not rows:
+        return {"samples": 0, "selected": 0}
+    scores = score_samples(rows)
+    for s in range(0, len(rows), chunk):
+        sb.rpc(
+            "apply_candidate_scores",
+            {
+                "p_ids": [r["id"] for r in rows[s : s + chunk]],
+                "p_scores": [round(float(x), 4) for x in scores[s : s + chunk]],
+            },
+        ).execute()
+    chosen = select_batch(rows, scores, budget, threshold)
+    sb.rpc("select_candidates", {"p_ids": [rows[i]["id"] for i in chosen]}).execute()
+    unlabeled = np.array([not r.get("is_labeled") for r in rows])
+    return {
+        "samples": len(rows),
+        "unlabeled": int(unlabeled.sum()),
+        "selected": len(chosen),
+        "mean_uncertainty_selected": (
+            round(float(scores[chosen].mean()), 4) if chosen else None
+        ),
+        "mean_uncertainty_unlabeled": (
+            round(float(scores[unlabeled].mean()), 4) if unlabeled.any() else None
+        ),
+    }
@@ -0,0 +1,173 @@
+"""
+超參數 sweep：在 process pool 中平行跑多個 trial
+
+- pool 大小 = CPU 核心數 // trial_threads，每個 trial 限制自己的 torch/OMP 執行緒
+- 每個 epoch 回報 val top1；達 min_epochs 後若低於同 epoch 已回報 trial 的
+  中位數就提早停止（median pruning）
+- 每個 trial 寫成 training_runs 的子列（parent_run_id 指向 sweep 本身）
+"""
+
+import math
+import multiprocessing as mp
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DEFAULT_TRIALS = 8
+DEFAULT_TRIAL_THREADS = 2
+MIN_EPOCHS = 3
+METRIC_KEY = "metrics/accuracy_top1"
+
+
+def sample_space(space: dict, n: int, seed: int = 42):
+    """
+    space 的值可以是 list（離散選項）、{"min","max","log"}（連續）或常數。
+    離散空間小於 n 時回傳完整 grid。
+    """
+    rng = random.Random(seed)
+    discrete = {k: v for k, v in space.items() if isinstance(v, list)}
+    if len(discrete) == len(space) and discrete:
+        grid = [{}]
+        for k, vals in discrete.items():
+            grid = [{**g, k: v} for g in grid for v in vals]
+        if len(grid) <= n:
+            return grid
+    trials, seen = [], set()
+    for _ in range(n * 20):
+        t = {}
+        for k, v in space.items():
+            if isinstance(v, list):
+                t[k] = rng.choice(v)
+            elif isinstance(v, dict):
+                lo, hi = v["min"], v["max"]
+                if v.get("log"):
+                    t[k] = math.exp(rng.uniform(math.log(lo), math.log(hi)))
+                else:
+                    t[k] = rng.uniform(lo, hi)
+                if v.get("int"):
+                    t[k] = int(round(t[k]))
+            else:
+                t[k] = v
+        key = tuple(sorted((k, repr(x)) for k, x in t.items()))
+        if key not in seen:
+            seen.add(key)
+            trials.append(t)
+        if len(trials) >= n:
+            break
+    return trials
+
+
+def _init_worker(threads: int):
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import torch
+
+    torch.set_num_threads(threads)
+
+
+def should_prune(history, lock, epoch: int, value: float, min_epochs: int) -> bool:
+    with lock:
+        seen = list(history.get(epoch, []))
+        history[epoch] = seen + [value]
+    if epoch + 1 < min_epochs or len(seen) < 2:
+        return False
+    return value < statistics.median(seen)
+
+
+def _run_trial(data_dir, params, init_weights, child_id, history, lock, min_epochs):
+    import pipeline
+
+    pruned = {"epoch": None}
+
+    def on_epoch(trainer):
+        value = (trainer.metrics or {}).get(METRIC_KEY)
+        if value is None:
+            return
+        if should_prune(history, lock, trainer.epoch, float(value), min_epochs):
+            pruned["epoch"] = trainer.epoch
+            trainer.stop = True
+
+    t0 = time.time()
+    try:
+        best, metrics = pipeline.train_yolo(
+            data_dir, params, init_weights, child_id, on_epoch=on_epoch
+        )
+    except Exception as e:
+        pipeline.finish_run(child_id, "failed", err=str(e))
+        return {"id": child_id, "status": "failed", "params": params, "error": str(e)}
+    metrics["train_seconds"] = round(time.time() - t0, 1)
+    status = "canceled" if pruned["epoch"] is not None else "succeeded"
+    if pruned["epoch"] is not None:
+        metrics["pruned_at_epoch"] = pruned["epoch"]
+    pipeline.finish_run(
+        child_id, status, metrics=metrics, artifacts={"local": str(best)}
+    )
+    return {
+        "id": child_id,
+        "status": status,
+        "params": params,
+        "metrics": metrics,
+        "best": str(best),
+    }
+
+
+def run_sweep(sb, run_id, data_dir, params, init_weights):
+    """回傳最佳 trial（weights 路徑、metrics）與所有 trial 摘要。"""
+    cfg = params["sweep"]
+    threads = int(cfg.get("trial_threads", DEFAULT_TRIAL_THREADS))
+    workers = max(1, (os.cpu_count() or 1) // threads)
+    base = {k: v for k, v in params.items() if k != "sweep"}
+    base.setdefault("workers", min(2, threads))
+    base.setdefault("device", "cpu")
+    trials = sample_space(
+        cfg["space"], int(cfg.get("trials", DEFAULT_TRIALS)), base.get("seed", 42)
+    )
+
+    children = []
+    for t in trials:
+        row = (
+            sb.table("training_runs")
+            .insert(
+                {
+                    "status": "running",
+                    "triggered_by": f"sweep:{run_id}",
+                    "parent_run_id": run_id,
+                    "params_json": {**base, **t},
+                }
+            )
+            .execute()
+            .data[0]
+        )
+        children.append((row["id"], {**base, **t}))
+
+    ctx = mp.get_context("spawn")
+    manager = ctx.Manager()
+    history, lock = manager.dict(), manager.Lock()
+    min_epochs = int(cfg.get("min_epochs", MIN_EPOCHS))
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(children)),
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(threads,),
+    ) as pool:
+        futs = [
+            pool.submit(
+                _run_trial, data_dir, p, init_weights, cid, history, lock, min_epochs
+            )
+            for cid, p in children
+        ]
+        for f in as_completed(futs):
+            results.append(f.result())
+    manager.shutdown()
+
+    done = [r for r in results if r["status"] == "succeeded"]
+    if not done:
+        raise RuntimeError("all sweep trials failed or were pruned")
+    best = max(done, key=lambda r: r["metrics"]["acc"])
+    summary = [
+        {k: r.get(k) for k in ("id", "status", "params", "metrics")} for r in results
+    ]
+    return best, summary
@@ -0,0 +1,121 @@
+"""
+常駐訓練 worker：`python training/pipeline.py --worker`
+
+輪詢 claim_training_run()（SQL 端 for update skip locked），取得 lease 後執行；
+背景執行緒定期 heartbeat 延長 lease 並回寫進度。lease 過期（worker 當掉）的
+running 列會被其他 worker 重新領走，有 checkpoint 的會從 checkpoint 續跑。
+"""
+
+import os
+import socket
+import threading
+import time
+
+LEASE_S = int(os.getenv("WORKER_LEASE_S", "120"))
+POLL_S = float(os.getenv("WORKER_POLL_S", "2"))
+
+
+class LeaseLost(RuntimeError):
+    pass
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(sb, worker: str, run_id: str | None = None, lease_s: int = LEASE_S):
+    rows = (
+        sb.rpc(
+            "claim_training_run",
+            {"p_worker": worker, "p_lease_s": lease_s, "p_run_id": run_id},
+        )
+        .execute()
+        .data
+    )
+    if isinstance(rows, list):
+        rows = rows[0] if rows else None
+    return rows if rows and rows.get("id") else None
+
+
+def resume_from(run) -> dict | None:
+    """
+    被重新領走的 running（lease 過期）或手動重跑的 failed run 有 checkpoint 時，
+    回傳其 artifacts 供續跑；否則 None（從頭開始）。
+    """
+    artifacts = run.get("artifacts") or {}
+    if run.get("status") in ("running", "failed") and artifacts.get("checkpoint"):
+        return artifacts
+    return None
+
+
+class Lease:
+    """持有 run 的 lease；heartbeat 失敗（被別人接手）時 lost 會變成 True。"""
+
+    def __init__(self, sb, run_id: str, worker: str, lease_s: int = LEASE_S):
+        self.sb, self.run_id, self.worker, self.lease_s = sb, run_id, worker, lease_s
+        self.progress = {}
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        return False
+
+    def heartbeat(self) -> bool:
+        ok = (
+            self.sb.rpc(
+                "heartbeat_training_run",
+                {
+                    "p_id": self.run_id,
+                    "p_worker": self.worker,
+                    "p_lease_s": self.lease_s,
+                    "p_progress": self.progress,
+                },
+            )
+            .execute()
+            .data
+        )
+        if ok is False:
+            self.lost = True
+        return not self.lost
+
+    def _loop(self):
+        while not self._stop.wait(self.lease_s / 3):
+            try:
+                if not self.heartbeat():
+                    return
+            except Exception:
+                pass  # 暫時性網路錯誤：下一輪再試，lease 還有餘裕
+
+    def on_epoch(self, trainer):
+        self.progress = {
+            "epoch": trainer.epoch + 1,
+            "epochs": trainer.epochs,
+            "top1": (trainer.metrics or {}).get("metrics/accuracy_top1"),
+        }
+        if self.lost:
+            trainer.stop = True
+
+
+def run_forever(sb, execute, poll_s: float = POLL_S, once: bool = False):
+    """execute(run, lease) 由 pipeline 提供，負責實際訓練與 finish_run。"""
+    me = worker_id()
+    print(f"worker {me} polling every {poll_s}s")
+    while True:
+        run = claim(sb, me)
+        if run is None:
+            if once:
+                return
+            time.sleep(poll_s)
+            continue
+        print(f"claimed run {run['id']} (attempt {run.get('attempts')})")
+        with Lease(sb, run["id"], me) as lease:
+            execute(run, lease)
+        if once:
+            return